@@ -1 +1,2 @@
 from ads import Ads, Project, Service, ServiceSet, Profile, BadSelectorException, Cache, _load_spec_file
+from ads import Controller, OpResult
@@ -1,4 +1,5 @@
 import sys
+import threading
 
 
 class colors:
@@ -12,24 +13,32 @@ class colors:
     UNDERLINE = '\033[4m'
 
 
+# Keeps lines whole when several services are worked on at once
+_output_lock = threading.RLock()
+
+
 def debug(msg):
-    print(colors.OKBLUE + msg + colors.ENDC)
-    sys.stdout.flush()
+    with _output_lock:
+        print(colors.OKBLUE + msg + colors.ENDC)
+        sys.stdout.flush()
 
 
 def info(msg):
-    print(colors.OKGREEN + "--- " + msg + colors.ENDC)
-    sys.stdout.flush()
+    with _output_lock:
+        print(colors.OKGREEN + "--- " + msg + colors.ENDC)
+        sys.stdout.flush()
 
 
 def warning(msg):
-    print(colors.WARNING + "!! " + msg + colors.ENDC)
-    sys.stdout.flush()
+    with _output_lock:
+        print(colors.WARNING + "!! " + msg + colors.ENDC)
+        sys.stdout.flush()
 
 
 def error(msg):
-    sys.stderr.write(colors.FAIL + "!!! " + msg + "\n" + colors.ENDC)
-    sys.stderr.flush()
+    with _output_lock:
+        sys.stderr.write(colors.FAIL + "!!! " + msg + "\n" + colors.ENDC)
+        sys.stderr.flush()
 
 
 def separator():
@@ -46,10 +55,28 @@ except ImportError:
     sys.exit(1)
 
 import os
+import re
+import errno
+import signal
+import fcntl
+import stat
+import zlib
+import bz2
+import contextlib
+import ctypes
 import tempfile
 import subprocess
 import argparse
-import glob
+import fnmatch
+import hashlib
+import json
+import math
+import select
+import sqlite3
+import struct
+import tarfile
+import Queue
+import StringIO
 import time
 from collections import OrderedDict
 
@@ -82,20 +109,295 @@ class Treelisting:
                     print(("%" + str(column_width) + "s: %s") % (k, v))
 
 
+class Table:
+    """Columns of text; the first is left-aligned, the rest right-aligned."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.rows = []
+
+    def with_row(self, cells):
+        self.rows.append([str(c) for c in cells])
+        return self
+
+    def format_lines(self):
+        widths = [
+            max(len(row[i]) for row in [self.headers] + self.rows)
+            for i in range(len(self.headers))]
+        return [
+            "  ".join(
+                i == 0 and cell.ljust(widths[i]) or cell.rjust(widths[i])
+                for (i, cell) in enumerate(row)).rstrip()
+            for row in [self.headers] + self.rows]
+
+    def pretty_print(self):
+        print("\n".join(self.format_lines()))
+
+
+def _format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024 or unit == "GB":
+            return unit == "B" and "%d%s" % (n, unit) or "%.1f%s" % (n, unit)
+        n /= 1024.0
+
+
+##############################################
+# Tracing
+##############################################
+
+class _Tracer:
+    """Collects timed spans, for --timings and ADS_TRACE."""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, name, start, end, args):
+        with self.lock:
+            self.spans.append(
+                (name, start, end, threading.current_thread().ident, args))
+
+    def summary_lines(self):
+        by_name = OrderedDict()
+        for (name, start, end, _, _) in self.spans:
+            by_name.setdefault(name, []).append(end - start)
+        table = Table(["span", "count", "total", "mean", "max"])
+        for (name, durations) in sorted(by_name.items(),
+                                        key=lambda item: -sum(item[1])):
+            table.with_row([name, len(durations),
+                            "%.3fs" % sum(durations),
+                            "%.3fs" % (sum(durations) / len(durations)),
+                            "%.3fs" % max(durations)])
+        return table.format_lines()
+
+    def write_chrome_trace(self, path):
+        """Trace Event Format, for chrome://tracing and ui.perfetto.dev."""
+        pid = os.getpid()
+        events = [{"name": name, "cat": "ads", "ph": "X", "pid": pid,
+                   "tid": tid,
+                   "ts": int((start - self.started_at) * 1e6),
+                   "dur": int((end - start) * 1e6),
+                   "args": args}
+                  for (name, start, end, tid, args) in self.spans]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# Set by main() when tracing is on
+_tracer = None
+
+
+@contextlib.contextmanager
+def _span(name, **args):
+    if _tracer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        _tracer.record(name, start, time.time(), args)
+
+
+##############################################
+# Concurrency
+##############################################
+
+def _parallel_map(func, items, max_workers=None):
+    """[func(item) for item in items], on up to max_workers threads.
+
+    Items are taken in order. The first exception raised by func is
+    re-raised here once the other workers are done.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    todo = Queue.Queue()
+    for pair in enumerate(items):
+        todo.put(pair)
+    failures = []
+
+    def work():
+        while not failures:
+            try:
+                (i, item) = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(item)
+            except BaseException:
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(max_workers or len(items), len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # A timeout keeps the main thread responsive to ctrl+c
+        while thread.is_alive():
+            thread.join(0.1)
+    if failures:
+        raise failures[0][0], failures[0][1], failures[0][2]
+    return results
+
+
 ##############################################
 # subprocess stuff
 ##############################################
 
-def _shell_get_output(cmd_str, working_dir):
-    process = subprocess.Popen(
-        cmd_str,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=file("/dev/null", "w"),
-        close_fds=True,
-        cwd=working_dir)
+def _stdin_is_tty():
+    return os.isatty(0)
+
+
+def _signal_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+        return False
+
 
-    return process.communicate()[0]
+def _signal_command(pid, own_group, sig):
+    """Signal a command, and everything it started if it has its own group."""
+    if own_group:
+        return _signal_group(pid, sig)
+    try:
+        os.kill(pid, sig)
+        return True
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+        return False
+
+
+class _CommandEngine:
+    """Runs every command ads starts, within limits.
+
+    At most max_procs commands run at once overall, and at most
+    per_service at once for any one service. Each command gets its own
+    process group, so that cancel_all (on ctrl+c) can stop everything that
+    is running, including whatever those commands started. The exception
+    is commands that can read the terminal: in a group of their own they'd
+    be a background job, and get stopped (SIGTTIN) as soon as they tried.
+    Those stay in ads's group, where ctrl+c reaches them anyway.
+    """
+
+    def __init__(self, max_procs, per_service):
+        self.slots = threading.BoundedSemaphore(max_procs)
+        self.per_service = per_service
+        self.service_slots = {}
+        # {process: whether it has its own process group}
+        self.running = {}
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def _service_slot(self, service):
+        with self.lock:
+            if service not in self.service_slots:
+                self.service_slots[service] = threading.BoundedSemaphore(
+                    self.per_service)
+            return self.service_slots[service]
+
+    @contextlib.contextmanager
+    def _slot(self, semaphore):
+        # Semaphore.acquire() can't be interrupted by ctrl+c, so poll
+        delay = 0.001
+        while not semaphore.acquire(False):
+            if self.cancelled:
+                raise KeyboardInterrupt()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def run(self, argv, cwd, service=None, stdout=None, stderr=None,
+            on_line=None):
+        """Run argv and return its exit status.
+
+        With on_line, stdout is read a line at a time and passed to it.
+        Raises KeyboardInterrupt if ads is interrupted meanwhile.
+        """
+        with self._slot(self.slots):
+            if service is None:
+                return self._run(argv, cwd, stdout, stderr, on_line)
+            with self._slot(self._service_slot(service)):
+                return self._run(argv, cwd, stdout, stderr, on_line)
+
+    def _run(self, argv, cwd, stdout, stderr, on_line):
+        if self.cancelled:
+            raise KeyboardInterrupt()
+        own_group = bool(on_line) or not _stdin_is_tty()
+        process = subprocess.Popen(
+            argv,
+            close_fds=True,
+            cwd=cwd,
+            stdin=on_line and open(os.devnull) or None,
+            stdout=on_line and subprocess.PIPE or stdout,
+            stderr=stderr,
+            preexec_fn=own_group and os.setpgrp or None)
+        with self.lock:
+            self.running[process] = own_group
+        try:
+            if on_line:
+                # Not "for line in stdout", which reads ahead in big blocks
+                for line in iter(process.stdout.readline, ""):
+                    on_line(line)
+                process.stdout.close()
+            status = process.wait()
+        except KeyboardInterrupt:
+            self.cancel_all()
+            raise
+        except IOError as e:
+            if e.errno != errno.EINTR:
+                raise
+            # Interrupted by ctrl+c while reading
+            self.cancel_all()
+            raise KeyboardInterrupt()
+        finally:
+            with self.lock:
+                self.running.pop(process, None)
+        if self.cancelled:
+            raise KeyboardInterrupt()
+        return status
+
+    def cancel_all(self, grace=2.0):
+        """Interrupt every running command, and kill any that linger."""
+        with self.lock:
+            self.cancelled = True
+            commands = [(p.pid, own_group)
+                        for (p, own_group) in self.running.items()]
+        commands = [c for c in commands
+                    if _signal_command(c[0], c[1], signal.SIGINT)]
+        deadline = time.time() + grace
+        while commands and time.time() < deadline:
+            time.sleep(0.05)
+            commands = [c for c in commands if _signal_command(c[0], c[1], 0)]
+        for (pid, own_group) in commands:
+            _signal_command(pid, own_group, signal.SIGKILL)
+
+
+def _get_engine_limit(env_var, default):
+    try:
+        return max(int(os.getenv(env_var) or default), 1)
+    except ValueError:
+        return default
+
+
+_engine = _CommandEngine(_get_engine_limit("ADS_MAX_PROCS", 32),
+                         _get_engine_limit("ADS_MAX_PROCS_PER_SERVICE", 1))
+
+
+def _shell_get_output(cmd_str, working_dir):
+    lines = []
+    with open(os.devnull, "w") as devnull:
+        _engine.run(["/bin/sh", "-c", cmd_str], working_dir,
+                    stderr=devnull, on_line=lines.append)
+    return "".join(lines)
 
 
 STREAM = "stream"
@@ -103,11 +405,57 @@ BUFFER = "buffer"
 NULL = "null"
 
 
-def _shell(cmd_str, working_dir, output_mode=STREAM):
+def _get_output_tail_bytes():
+    try:
+        return max(int(os.environ["ADS_OUTPUT_TAIL_KB"]), 1) * 1024
+    except (KeyError, ValueError):
+        return 64 * 1024
+
+
+def _read_tail(out_file, max_bytes, full_output_path=None):
+    """The last max_bytes or so of out_file, from the start of a line.
+
+    If that's not all of it, says how much was left out (and where to find
+    it, given full_output_path).
+    """
+    size = os.fstat(out_file.fileno()).st_size
+    if size <= max_bytes:
+        out_file.seek(0)
+        return out_file.read()
+    out_file.seek(size - max_bytes)
+    tail = out_file.read(max_bytes)
+    newline = tail.find("\n")
+    if newline != -1:
+        tail = tail[newline + 1:]
+    where = full_output_path and "; see " + full_output_path or ""
+    return "[... first %s of output not shown%s ...]\n%s" % (
+        _format_bytes(size - len(tail)), where, tail)
+
+
+def _shell(cmd_str, working_dir, output_mode=STREAM,
+           service=None, cmd_type="shell", output_path=None):
+    """Run cmd_str with bash; returns (exit status, output).
+
+    Output is only returned in BUFFER mode, and then only the last
+    $ADS_OUTPUT_TAIL_KB (default 64) KB of it. With output_path, all of it
+    is also added to the end of that file.
+    """
+    with _span(cmd_type, service=service, cmd=cmd_str):
+        return _shell_untraced(cmd_str, working_dir, output_mode, service,
+                               output_path)
+
+
+def _shell_untraced(cmd_str, working_dir, output_mode, service,
+                    output_path=None):
     if output_mode == STREAM:
         out_file = None
+    elif output_mode == BUFFER and output_path:
+        _mkdir_p(os.path.dirname(output_path))
+        out_file = open(output_path, "a+")
     elif output_mode == BUFFER:
-        out_file = tempfile.NamedTemporaryFile()
+        # A file rather than a pipe: start commands often leave things
+        # running in the background that hold on to their output
+        out_file = tempfile.TemporaryFile()
     elif output_mode == NULL:
         out_file = open(os.devnull, 'w')
     else:
@@ -124,28 +472,256 @@ ADS_EOF
 """ % (working_dir, cmd_str, cmd_str))
     cmd_file.flush()
     try:
-        status = subprocess.Popen(
-            ["/bin/bash", cmd_file.name],
-            close_fds=True,
-            cwd=working_dir,
+        status = _engine.run(
+            ["/bin/bash", cmd_file.name], working_dir, service,
             # Same file for stdout and stderr to preserve order (roughly)
             stdout=out_file,
-            stderr=out_file).wait()
-    except KeyboardInterrupt:
-        # Suppress python from printing a stack trace
-        status = 47
-        pass
-    cmd_file.close()
+            stderr=out_file)
+    finally:
+        cmd_file.close()
+        if output_mode != BUFFER and out_file:
+            out_file.close()
 
     if output_mode == BUFFER:
-        out_file.seek(0)
-        output = out_file.read()
+        # Only as much as we'd show, however much the command said
+        output = _read_tail(out_file, _get_output_tail_bytes(), output_path)
         out_file.close()
         return status, output
     else:
         return status, None
 
 
+def _shell_lines(cmd_str, working_dir, on_line, service=None):
+    """Run cmd_str with bash, passing each line it outputs to on_line.
+
+    stdout and stderr are merged. Returns the exit status.
+    """
+    return _engine.run(["/bin/bash", "-c", cmd_str], working_dir, service,
+                       stderr=subprocess.STDOUT, on_line=on_line)
+
+
+##############################################
+# Log streaming
+##############################################
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _can_sendfile_to(out_fd):
+    # Linux can sendfile into regular files and pipes; other platforms
+    # (notably Mac OS) only support sockets as the destination.
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return False
+    mode = os.fstat(out_fd).st_mode
+    return stat.S_ISREG(mode) or stat.S_ISFIFO(mode)
+
+
+def _write_all(out_fd, data):
+    while data:
+        written = os.write(out_fd, data)
+        data = data[written:]
+
+
+def _copy_fd(in_fd, out_fd):
+    while True:
+        chunk = os.read(in_fd, _COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        _write_all(out_fd, chunk)
+
+
+def _sendfile_fd(in_fd, out_fd):
+    offset = os.lseek(in_fd, 0, os.SEEK_CUR)
+    while True:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, _COPY_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+            # Not supported for this pair of fds after all
+            os.lseek(in_fd, offset, os.SEEK_SET)
+            _copy_fd(in_fd, out_fd)
+            return
+        if sent == 0:
+            # Leave in_fd where the data ended, as a read would
+            os.lseek(in_fd, offset, os.SEEK_SET)
+            return
+        offset += sent
+
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+_DECOMPRESSORS = {
+    ".gz": _gzip_decompressor,
+    ".bz2": bz2.BZ2Decompressor,
+}
+
+
+def _copy_decompressed(in_file, out_fd, new_decompressor):
+    decompressor = new_decompressor()
+    while True:
+        chunk = in_file.read(_COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        while chunk:
+            _write_all(out_fd, decompressor.decompress(chunk))
+            # Concatenated archives (e.g. from `cat a.gz b.gz`) are legal;
+            # anything past the end of one stream starts the next.
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = new_decompressor()
+
+
+def _copy_file_to_fd(path, out_fd, use_sendfile, offset=0):
+    """Returns where the copy stopped, for files that aren't compressed."""
+    new_decompressor = _DECOMPRESSORS.get(os.path.splitext(path)[1])
+    with open(path, "rb") as f:
+        if offset and not new_decompressor:
+            f.seek(offset)
+        if new_decompressor:
+            _copy_decompressed(f, out_fd, new_decompressor)
+            return None
+        elif use_sendfile:
+            _sendfile_fd(f.fileno(), out_fd)
+        else:
+            _copy_fd(f.fileno(), out_fd)
+        return os.lseek(f.fileno(), 0, os.SEEK_CUR)
+
+
+def _dump_files(paths, out_fd, offsets=None, ends=None):
+    """Copy each file to out_fd in order, without spawning anything.
+
+    Compressed files (.gz, .bz2) are decompressed on the fly; others start
+    at offsets[path] if given, and where they ended is put in ends[path]
+    if given. Returns False if any file could not be read. A closed pipe
+    on the output side (e.g. `ads logs --cat | head`) just ends the dump.
+    """
+    use_sendfile = _can_sendfile_to(out_fd)
+    offsets = offsets or {}
+    ok = True
+    for path in paths:
+        try:
+            end = _copy_file_to_fd(path, out_fd, use_sendfile,
+                                   offsets.get(path, 0))
+            if ends is not None and end is not None:
+                ends[path] = end
+        except EnvironmentError as e:
+            if e.errno == errno.EPIPE:
+                return ok
+            error("%s: %s" % (path, e.strerror or e))
+            ok = False
+        except zlib.error as e:
+            error("%s: %s" % (path, e))
+            ok = False
+    return ok
+
+
+# app.log.3.gz -> (app.log, 3, None, .gz); app.log-20160102 -> (app.log, None,
+# 20160102, None). Anything without a rotation suffix is a live log.
+_ROTATED_LOG_RE = re.compile(
+    r"^(?P<base>.+?)"
+    r"(?:\.(?P<generation>\d+)|-(?P<date>\d{8,14}))?"
+    r"(?P<compression>\.gz|\.bz2)?$")
+
+
+def _parse_log_name(path):
+    match = _ROTATED_LOG_RE.match(os.path.basename(path))
+    base = os.path.join(os.path.dirname(path), match.group("base"))
+    generation = match.group("generation")
+    date = match.group("date")
+    if generation is not None:
+        age_key = (0, -int(generation))
+    elif date is not None:
+        age_key = (1, int(date))
+    elif match.group("compression"):
+        age_key = (2, 0)
+    else:
+        age_key = (3, 0)
+    return base, age_key
+
+
+def _is_live_log(path):
+    return _parse_log_name(path)[1][0] == 3
+
+
+def _find_rotated_siblings(paths):
+    listings = {}
+    siblings = []
+    for path in paths:
+        if not _is_live_log(path):
+            continue
+        dir_ = os.path.dirname(path)
+        if dir_ not in listings:
+            try:
+                listings[dir_] = os.listdir(dir_ or os.curdir)
+            except OSError:
+                listings[dir_] = []
+        for name in listings[dir_]:
+            candidate = os.path.join(dir_, name)
+            if (not _is_live_log(candidate) and
+                    _parse_log_name(candidate)[0] == path and
+                    os.path.isfile(candidate)):
+                siblings.append(candidate)
+    return siblings
+
+
+def _order_log_history(paths, include_siblings=True):
+    """Group rotated logs with their live file, oldest to newest.
+
+    Groups keep the order in which their first file appeared. With
+    include_siblings, rotated versions of each live log are found even if
+    no log_paths glob matched them.
+    """
+    if include_siblings:
+        paths = list(paths) + _find_rotated_siblings(paths)
+
+    families = OrderedDict()
+    for path in paths:
+        base, age_key = _parse_log_name(path)
+        families.setdefault(base, {})[path] = age_key
+
+    return [path
+            for members in families.values()
+            for path in sorted(members, key=lambda p: (members[p], p))]
+
+
+def _live_logs(paths):
+    return [p for p in paths if _is_live_log(p)]
+
+
+def _modified_since(paths, since):
+    result = []
+    for path in paths:
+        try:
+            if os.path.getmtime(path) >= since:
+                result.append(path)
+        except OSError:
+            pass
+    return result
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_SINCE_DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S",
+                       "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"]
+
+
+def _parse_since(spec, now=None):
+    """Turn '90m', '2h', '3d' or a local date/time into epoch seconds."""
+    match = re.match(r"^(\d+)([smhdw])$", spec.strip())
+    if match:
+        now = now if now is not None else time.time()
+        return now - int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    for fmt in _SINCE_DATE_FORMATS:
+        try:
+            return time.mktime(time.strptime(spec.strip(), fmt))
+        except ValueError:
+            pass
+    return None
+
+
 ##############################################
 # YML stuff
 ##############################################
@@ -164,7 +740,8 @@ def _expect(expected_type, actual, origin_file):
 
 def _load_spec_file(path):
     try:
-        result = yaml.safe_load(file(path, "r").read()) or {}
+        with _span("yaml load", path=path):
+            result = yaml.safe_load(file(path, "r").read()) or {}
     except IOError:
         result = {}
 
@@ -172,6 +749,162 @@ def _load_spec_file(path):
     return result
 
 
+##############################################
+# Glob matching
+##############################################
+
+_GLOBSTAR = "**"
+
+
+def _has_glob_magic(segment):
+    return re.search(r"[*?[]", segment) is not None
+
+
+def _compile_glob_segment(segment):
+    if segment == _GLOBSTAR:
+        return _GLOBSTAR
+    if not _has_glob_magic(segment):
+        return lambda name: name == segment
+    regex = re.compile(fnmatch.translate(segment))
+    # Like the shell, wildcards don't match hidden files unless asked to
+    allow_hidden = segment.startswith(".")
+    return lambda name: ((allow_hidden or not name.startswith(".")) and
+                         regex.match(name) is not None)
+
+
+def _glob_match(segments, i, names, j):
+    if i == len(segments):
+        return j == len(names)
+    if segments[i] is _GLOBSTAR:
+        if _glob_match(segments, i + 1, names, j):
+            return True
+        return (j < len(names) and not names[j].startswith(".") and
+                _glob_match(segments, i, names, j + 1))
+    return (j < len(names) and segments[i](names[j]) and
+            _glob_match(segments, i + 1, names, j + 1))
+
+
+def _glob_could_match_below(segments, i, dir_names, j):
+    if j == len(dir_names):
+        return i < len(segments)
+    if i == len(segments):
+        return False
+    if segments[i] is _GLOBSTAR:
+        return ((not dir_names[j].startswith(".") and
+                 _glob_could_match_below(segments, i, dir_names, j + 1)) or
+                _glob_could_match_below(segments, i + 1, dir_names, j))
+    return (segments[i](dir_names[j]) and
+            _glob_could_match_below(segments, i + 1, dir_names, j + 1))
+
+
+def _split_glob(abs_pattern):
+    """Split a pattern into its literal base dir and the segments after it."""
+    parts = os.path.normpath(abs_pattern).split(os.sep)
+    for i, part in enumerate(parts):
+        if _has_glob_magic(part):
+            return os.sep.join(parts[:i]) or os.sep, parts[i:]
+    return None, parts
+
+
+def _walk_globs(root, patterns, visited_dirs=None):
+    """Walk root once, returning {pattern: [files]} for the given patterns.
+
+    patterns maps each pattern to its compiled segments relative to root.
+    Directories that no pattern can match below are never entered; the
+    ones that are get appended to visited_dirs, if given.
+    """
+    matches = dict((p, []) for p in patterns)
+    live_by_dir = {root: list(patterns.items())}
+    seen_dirs = set()
+    for dir_path, dir_names, file_names in os.walk(root, followlinks=True):
+        live = live_by_dir.pop(dir_path, [])
+        if visited_dirs is not None:
+            visited_dirs.append(dir_path)
+        rel = os.path.relpath(dir_path, root)
+        rel_names = [] if rel == os.curdir else rel.split(os.sep)
+
+        for name in file_names:
+            names = rel_names + [name]
+            for (pattern, segments) in live:
+                if _glob_match(segments, 0, names, 0):
+                    matches[pattern].append(os.path.join(dir_path, name))
+
+        descend = []
+        for name in dir_names:
+            names = rel_names + [name]
+            sub_live = [
+                (pattern, segments)
+                for (pattern, segments) in live
+                if _glob_could_match_below(segments, 0, names, 0)]
+            if not sub_live:
+                continue
+            sub_dir = os.path.join(dir_path, name)
+            try:
+                st = os.stat(sub_dir)
+            except OSError:
+                continue
+            # Symlinks can form cycles; only ever visit a dir once
+            if (st.st_dev, st.st_ino) in seen_dirs:
+                continue
+            seen_dirs.add((st.st_dev, st.st_ino))
+            descend.append(name)
+            live_by_dir[sub_dir] = sub_live
+        dir_names[:] = descend
+
+    return matches
+
+
+def _glob_files(abs_patterns, visited_dirs=None):
+    """Resolve many absolute glob patterns to the files they match.
+
+    Returns {pattern: sorted list of files}. Patterns are grouped by their
+    literal base directory, and nested bases are merged, so each part of
+    the tree is walked at most once no matter how many patterns (or
+    services) point into it. '**' matches zero or more directories.
+
+    With visited_dirs, every directory a match could turn up in is
+    appended to it.
+    """
+    result = {}
+    segments_by_base = {}
+    for pattern in set(abs_patterns):
+        base, rest = _split_glob(pattern)
+        if base is None:
+            # No wildcards; a stat is all it takes
+            path = os.path.normpath(pattern)
+            result[pattern] = [path] if os.path.isfile(path) else []
+            if visited_dirs is not None and os.path.isdir(
+                    os.path.dirname(path)):
+                visited_dirs.append(os.path.dirname(path))
+        else:
+            segments_by_base.setdefault(base, {})[pattern] = rest
+
+    roots = OrderedDict()
+    for base in sorted(segments_by_base):
+        root = next((r for r in roots
+                     if base == r or base.startswith(r.rstrip(os.sep) + os.sep)),
+                    None)
+        if root is None:
+            root = base
+            roots[root] = {}
+        extra = os.path.relpath(base, root)
+        prefix = [] if extra == os.curdir else extra.split(os.sep)
+        for (pattern, rest) in segments_by_base[base].items():
+            roots[root][pattern] = [
+                _compile_glob_segment(s) for s in prefix + rest]
+
+    for (root, patterns) in roots.items():
+        if os.path.isdir(root):
+            for (pattern, files) in _walk_globs(
+                    root, patterns, visited_dirs).items():
+                result[pattern] = sorted(files)
+        else:
+            for pattern in patterns:
+                result[pattern] = []
+
+    return result
+
+
 ##############################################
 # Service
 ##############################################
@@ -180,10 +913,68 @@ def _abs_to_cwd_rel(abspath):
     return os.path.relpath(abspath, os.path.abspath(os.curdir))
 
 
+def _resolve_logs(services, log_type):
+    """Map each service's name to its cwd-relative log files.
+
+    All services' patterns are resolved together by _glob_files, so services
+    sharing a log root don't cost a walk each.
+    """
+    abs_patterns_by_service = OrderedDict(
+        (s.name, [os.path.join(s.home, p) for p in s.get_log_paths(log_type)])
+        for s in services)
+    files_by_pattern = _glob_files([
+        p for patterns in abs_patterns_by_service.values() for p in patterns])
+
+    result = OrderedDict()
+    for (name, abs_patterns) in abs_patterns_by_service.items():
+        files = []
+        seen = set()
+        for pattern in abs_patterns:
+            for f in files_by_pattern[pattern]:
+                if f not in seen:
+                    seen.add(f)
+                    files.append(_abs_to_cwd_rel(f))
+        result[name] = files
+    return result
+
+
+class Task:
+    @classmethod
+    def load(cls, name, spec, origin_file):
+        if isinstance(spec, str):
+            # Just the command
+            return Task(name, spec)
+        _expect(dict, spec, origin_file)
+        _expect(str, spec.get("cmd"), origin_file)
+        inputs = spec.get("inputs") or []
+        _expect(list, inputs, origin_file)
+        for pattern in inputs:
+            _expect(str, pattern, origin_file)
+        return Task(name, spec["cmd"], inputs)
+
+    @classmethod
+    def load_multiple(cls, spec, origin_file):
+        spec = spec or {}
+        _expect(dict, spec, origin_file)
+        return dict((name, Task.load(name, value, origin_file))
+                    for (name, value) in spec.items())
+
+    def __init__(self, name, cmd, inputs=None):
+        self.name = name
+        self.cmd = cmd
+        # Globs relative to the service home. Without any, the task
+        # always runs.
+        self.inputs = inputs or []
+
+
 class Service:
     @classmethod
     def load(cls, name, svc_yml):
         spec = _load_spec_file(svc_yml)
+        watch_paths = spec.get("watch_paths") or []
+        _expect(list, watch_paths, svc_yml)
+        for pattern in watch_paths:
+            _expect(str, pattern, svc_yml)
         return Service(name,
                        os.path.dirname(svc_yml),
                        spec.get("description"),
@@ -191,7 +982,10 @@ class Service:
                        spec.get("stop_cmd"),
                        spec.get("status_cmd"),
                        spec.get("log_paths"),
-                       spec.get("err_log_paths"))
+                       spec.get("err_log_paths"),
+                       Task.load_multiple(spec.get("tasks"), svc_yml),
+                       spec.get("ready_cmd"),
+                       watch_paths)
 
     @classmethod
     def as_printable_dict(cls, services):
@@ -200,7 +994,8 @@ class Service:
 
     def __init__(self, name, home, description=None,
                  start_cmd=None, stop_cmd=None, status_cmd=None,
-                 log_paths=None, err_log_paths=None):
+                 log_paths=None, err_log_paths=None, tasks=None,
+                 ready_cmd=None, watch_paths=None):
 
         self.name = name
         self.home = home
@@ -209,26 +1004,26 @@ class Service:
         self.start_cmd = start_cmd
         self.stop_cmd = stop_cmd
         self.status_cmd = status_cmd
+        self.ready_cmd = ready_cmd
 
         self.log_paths = log_paths or []
         self.err_log_paths = err_log_paths or []
 
-    def resolve_logs_relative_to_cwd(self, log_type):
+        self.tasks = tasks or {}
+
+        # Globs relative to home, for `ads up --watch`
+        self.watch_paths = watch_paths or []
+
+    def get_log_paths(self, log_type):
         if log_type == "general":
-            log_paths = self.log_paths
+            return self.log_paths
         elif log_type == "error":
-            log_paths = self.err_log_paths
+            return self.err_log_paths
         else:
             assert False, "Unknown log_type %s" % log_type
 
-        result = []
-        for logfile in log_paths:
-            abs_log_glob = os.path.join(self.home, logfile)
-            result = result + [
-                _abs_to_cwd_rel(abs_log_file)
-                for abs_log_file
-                in glob.iglob(abs_log_glob)]
-        return result
+    def resolve_logs_relative_to_cwd(self, log_type):
+        return _resolve_logs([self], log_type)[self.name]
 
     def resolve_home_relative_to_cwd(self):
         return _abs_to_cwd_rel(self.home)
@@ -249,35 +1044,127 @@ class BadSelectorException(Exception):
         super(BadSelectorException, self).__init__(msg)
 
 
-def _resolve(selector, project, service_sets_by_name, selector_stack):
-    assert selector
+def _parse_selector(selector):
+    """Split a selector expression like '-a&b' into (exclude, [a, b]).
+
+    A leading '-' excludes the services it matches from everything else
+    that's selected, and '&' takes the intersection of its sides.
+    """
+    exclude = selector.startswith("-")
+    terms = selector[exclude and 1 or 0:].split("&")
+    if not all(terms):
+        raise BadSelectorException("Malformed selector '%s'" % selector)
+    return (exclude, terms)
+
+
+class _SelectorResolver:
+    """Resolves selectors against one project and its groups.
+
+    Each group's closure is computed once and kept as a bitset over the
+    project's services (bit i is set for the i-th name in sorted order), so
+    overlapping groups cost a few integer ORs rather than a re-resolution.
+    If a Cache is given, group closures are also kept across runs for as
+    long as the services and group definitions don't change.
+    """
+
+    def __init__(self, project, service_sets, cache=None):
+        # Later definitions win, so profile groups override project ones
+        self.service_sets_by_name = dict((s.name, s) for s in service_sets)
+        self.parsed = {}
+        self.names = sorted(project.services_by_name.keys())
+        self.bits = dict((name, 1 << i) for (i, name) in enumerate(self.names))
+        self.cache = cache
+        self.closures = {}
+        self.fingerprint = None
+        if cache:
+            self.fingerprint = self._fingerprint()
+            for (name, services) in cache.get_closures(
+                    self.fingerprint).items():
+                self.closures[name] = self._to_bits(services)
+
+    def _fingerprint(self):
+        groups = sorted((s.name, sorted(s.selectors))
+                        for s in self.service_sets_by_name.values())
+        return hashlib.sha1(json.dumps([self.names, groups])).hexdigest()
+
+    def _to_bits(self, services):
+        bits = 0
+        for name in services:
+            bits |= self.bits[name]
+        return bits
+
+    def _to_names(self, bits):
+        return frozenset(name for (i, name) in enumerate(self.names)
+                         if bits >> i & 1)
 
-    if selector in selector_stack:
-        stack_as_list = list(selector_stack) + [selector]
-        raise BadSelectorException(
-            "Definition of selector '%s' is circular: %s" %
-            (stack_as_list[0], " -> ".join(stack_as_list)))
+    def resolve(self, selector):
+        return self.resolve_all([selector])
+
+    def resolve_all(self, selectors):
+        cached_before = len(self.closures)
+        with _span("resolve", selectors=selectors):
+            bits = self._resolve_all(selectors, OrderedDict())
+        if self.cache and len(self.closures) > cached_before:
+            self.cache.write_closures(
+                self.fingerprint,
+                dict((name, sorted(self._to_names(group_bits)))
+                     for (name, group_bits) in self.closures.items()))
+        return self._to_names(bits)
+
+    def _parse(self, selector):
+        if selector not in self.parsed:
+            if (selector in self.bits or
+                    selector in self.service_sets_by_name):
+                # Plain names always mean themselves
+                self.parsed[selector] = (False, [selector])
+            else:
+                self.parsed[selector] = _parse_selector(selector)
+        return self.parsed[selector]
+
+    def _resolve_all(self, selectors, selector_stack):
+        """Union of the selectors, minus the union of the excluded ones."""
+        (included, excluded) = (0, 0)
+        for selector in selectors:
+            (exclude, terms) = self._parse(selector)
+            bits = self._resolve(terms[0], selector_stack)
+            for term in terms[1:]:
+                bits &= self._resolve(term, selector_stack)
+            if exclude:
+                excluded |= bits
+            else:
+                included |= bits
+        return included & ~excluded
+
+    def _resolve(self, selector, selector_stack):
+        assert selector
+
+        if selector in selector_stack:
+            stack_as_list = list(selector_stack) + [selector]
+            raise BadSelectorException(
+                "Definition of selector '%s' is circular: %s" %
+                (stack_as_list[0], " -> ".join(stack_as_list)))
 
-    if selector == "all":
-        return frozenset(project.services_by_name.keys())
+        if selector == "all":
+            return (1 << len(self.names)) - 1
 
-    if selector in project.services_by_name:
-        return frozenset([project.services_by_name[selector].name])
+        if selector in self.bits:
+            return self.bits[selector]
 
-    if selector in service_sets_by_name:
-        selector_stack[selector] = True
-        sub_results = map(lambda s: _resolve(s,
-                                             project,
-                                             service_sets_by_name,
-                                             selector_stack),
-                          service_sets_by_name[selector].selectors)
-        selector_stack.popitem(True)
-        return frozenset(reduce(frozenset.__or__, sub_results))
+        if selector in self.closures:
+            return self.closures[selector]
 
-    stack_as_list = list(selector_stack) + [selector]
-    raise BadSelectorException(
-        "No service or selector named '%s'. Reference chain: %s" %
-        (selector, " -> ".join(stack_as_list)))
+        if selector in self.service_sets_by_name:
+            selector_stack[selector] = True
+            bits = self._resolve_all(
+                self.service_sets_by_name[selector].selectors, selector_stack)
+            selector_stack.popitem(True)
+            self.closures[selector] = bits
+            return bits
+
+        stack_as_list = list(selector_stack) + [selector]
+        raise BadSelectorException(
+            "No service or selector named '%s'. Reference chain: %s" %
+            (selector, " -> ".join(stack_as_list)))
 
 
 class ServiceSet:
@@ -307,10 +1194,7 @@ class ServiceSet:
 
     @classmethod
     def resolve(cls, selector, project, service_sets):
-        return _resolve(selector,
-                        project,
-                        dict((s.name, s) for s in service_sets),
-                        OrderedDict())
+        return _SelectorResolver(project, service_sets).resolve(selector)
 
     @classmethod
     def as_printable_dict(cls, service_sets):
@@ -325,12 +1209,24 @@ class ServiceSet:
 # Cache
 ##############################################
 
-ADS_ROOT = "adsroot"
+# How many projects the cache remembers; the least recently used go first
+CACHE_MAX_PROJECTS = 32
+# Don't rewrite the cache just to bump a project's last use more often
+_CACHE_TOUCH_INTERVAL = 24 * 60 * 60
+
 
 class Cache:
+    """Where each service's ads.yml is, for every project ads has seen.
+
+    The cache file holds one entry per adsroot.yml, so switching between
+    checkouts doesn't throw it away. It's JSON, replaced atomically, and
+    read-modify-writes hold an flock so parallel ads runs don't lose each
+    other's entries.
+    """
+
     @classmethod
     def get_cache_path(cls, dir_):
-        adscache = ".ads_cache.yml"
+        adscache = ".ads_cache.json"
         cache_home = os.getenv("ADS_CACHE_HOME")
         if cache_home:
             return "%s/%s" % (cache_home, adscache)
@@ -338,20 +1234,29 @@ class Cache:
         return "%s/%s" % (dir_, adscache)
 
     @classmethod
-    def load_from_cache(cls, cachefile, project_file, profile_dir):
-        map_ = {}
-        if os.path.isfile(cachefile):
-            cache_spec = _load_spec_file(cachefile)
+    def read_projects(cls, cachefile):
+        cache = _read_json(cachefile)
+        projects = isinstance(cache, dict) and cache.get("projects")
+        return projects if isinstance(projects, dict) else {}
 
-            if cache_spec.get(ADS_ROOT) == project_file:
-                del cache_spec[ADS_ROOT]
-                map_ = cache_spec
+    @classmethod
+    def load_from_cache(cls, cachefile, project_file, profile_dir):
+        return cls.load_entry(cachefile, project_file).get("services", {})
 
-        return map_
+    @classmethod
+    def load_entry(cls, cachefile, project_file):
+        return cls.read_projects(cachefile).get(project_file) or {}
 
     def __init__(self, project_file, profile_dir):
         self.cachefile = Cache.get_cache_path(profile_dir)
-        self.cache_map = Cache.load_from_cache(self.cachefile, project_file, profile_dir)
+        self.project_file = project_file
+        with _span("cache load"):
+            entry = Cache.load_entry(self.cachefile, project_file)
+        self.cache_map = entry.get("services", {})
+        self.closures = entry.get("closures")
+        if (self.cache_map and
+                entry.get("used_at", 0) < time.time() - _CACHE_TOUCH_INTERVAL):
+            self._update_entry()
 
     def get(self, key):
         if isinstance(key, Service):
@@ -363,12 +1268,17 @@ class Cache:
         selectors = set()
         for service_set in service_sets:
             for selector in service_set.selectors:
-                selectors.add(selector)
+                try:
+                    selectors.update(_parse_selector(selector)[1])
+                except BadSelectorException:
+                    # Resolution will complain about it
+                    pass
 
         groups = set(group.name for group in service_sets)
         services = selectors.difference(groups)
 
-        return self.yamls_exist(list(services))
+        with _span("cache validate"):
+            return self.yamls_exist(list(services))
 
     def yamls_exist(self, services):
         not_cached = []
@@ -386,13 +1296,93 @@ class Cache:
 
         return True
 
+    def get_closures(self, fingerprint):
+        if self.closures and self.closures.get("fingerprint") == fingerprint:
+            return self.closures["groups"]
+        return {}
+
+    def write_closures(self, fingerprint, closures):
+        self.closures = {"fingerprint": fingerprint, "groups": closures}
+        self._update_entry()
+
     def write_to_cache(self, project_file, svc_to_yml):
+        self.project_file = project_file
         self.cache_map = dict(svc_to_yml)
-        svc_to_yml[ADS_ROOT] = project_file
-        with open(self.cachefile, 'w') as outfile:
-            yaml.safe_dump(svc_to_yml, outfile, default_flow_style=False)
+        self._update_entry()
 
-        del svc_to_yml[ADS_ROOT]
+    def _update_entry(self):
+        entry = {"services": self.cache_map, "used_at": time.time()}
+        if self.closures:
+            # Stale closures are harmless: their fingerprint won't match
+            entry["closures"] = self.closures
+        try:
+            with _span("cache write"), _FileLock(self.cachefile + ".lock"):
+                projects = Cache.read_projects(self.cachefile)
+                projects[self.project_file] = entry
+                for project_file in sorted(
+                        projects, key=lambda p: projects[p].get("used_at", 0),
+                        reverse=True)[CACHE_MAX_PROJECTS:]:
+                    del projects[project_file]
+                _write_json_atomically(self.cachefile, {"projects": projects})
+        except EnvironmentError as e:
+            # Only costs a rediscovery next time
+            warning("Couldn't update the cache %s: %s" %
+                    (self.cachefile, e.strerror or e))
+
+
+class LockTimeout(Exception):
+    def __init__(self, path):
+        super(LockTimeout, self).__init__("Timed out waiting for " + path)
+
+
+class _FileLock:
+    """Exclusive flock on path (created if needed), held in a with block.
+
+    If someone else holds it, on_wait is called and the lock is waited for,
+    for up to timeout seconds (None: as long as it takes) before raising
+    LockTimeout.
+    """
+
+    def __init__(self, path, timeout=None, on_wait=None):
+        self.path = path
+        self.timeout = timeout
+        self.on_wait = on_wait
+        self.fd = None
+
+    def __enter__(self):
+        _mkdir_p(os.path.dirname(self.path))
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._acquire()
+        except:
+            os.close(self.fd)
+            raise
+        return self
+
+    def _acquire(self):
+        # Poll rather than block, so that ctrl+c still works
+        deadline = (time.time() + self.timeout
+                    if self.timeout is not None else None)
+        delay = None
+        while True:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if deadline is not None and time.time() >= deadline:
+                raise LockTimeout(self.path)
+            if delay is None:
+                delay = 0.001
+                if self.on_wait:
+                    self.on_wait()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def __exit__(self, *exc_info):
+        # Closing releases the lock
+        os.close(self.fd)
 
 
 ##############################################
@@ -411,9 +1401,10 @@ def _find_project_yml(search_start):
 
 
 def _find_service_ymls(project_root):
-    find_output = _shell_get_output(
-        "/usr/bin/find . -mindepth 2 -name ads.yml -or -name adsroot.yml",
-        project_root).splitlines()
+    with _span("discovery", root=project_root):
+        find_output = _shell_get_output(
+            "/usr/bin/find . -mindepth 2 -name ads.yml -or -name adsroot.yml",
+            project_root).splitlines()
 
     nested_project_dirs = [
         os.path.dirname(path)
@@ -483,17 +1474,19 @@ class Project:
             in ymls_by_service.items()
         ]
 
-        return Project(name, home, services, service_sets, default_selector)
+        return Project(name, home, services, service_sets, default_selector,
+                       cache)
 
     def __init__(self,
                  name, home,
                  services=None, service_sets=None,
-                 default_selector="all"):
+                 default_selector="all", cache=None):
         self.name = name
         self.home = home
         self.services_by_name = dict((s.name, s) for s in (services or []))
         self.service_sets = service_sets or []
         self.default_selector = default_selector
+        self.cache = cache
 
 
 ##############################################
@@ -507,14 +1500,1670 @@ class Profile:
         if not os.path.isfile(rc_path):
             return Profile()
 
-        rc_spec = _load_spec_file(rc_path)
-        return Profile(
-            ServiceSet.load_multiple(rc_spec.get("groups"), rc_path),
-            ServiceSet.load_default(rc_spec.get("default"), rc_path))
+        rc_spec = _load_spec_file(rc_path)
+        return Profile(
+            ServiceSet.load_multiple(rc_spec.get("groups"), rc_path),
+            ServiceSet.load_default(rc_spec.get("default"), rc_path))
+
+    def __init__(self, service_sets=None, default_selector=None):
+        self.service_sets = service_sets or []
+        self.default_selector = default_selector
+
+
+def _get_profile_home():
+    profile_home = os.getenv("ADS_PROFILE_HOME")
+    if not profile_home or len(profile_home) == 0:
+        profile_home = os.path.expanduser("~")
+    return profile_home
+
+
+##############################################
+# Local state
+##############################################
+
+def _mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _get_state_dir(project):
+    """Dir where ads remembers things about a project between runs.
+
+    Lives under $ADS_STATE_HOME (default: ~/.ads_state), one subdir per
+    project checkout.
+    """
+    state_home = (os.getenv("ADS_STATE_HOME") or
+                  os.path.join(_get_profile_home(), ".ads_state"))
+    project_key = "%s-%s" % (
+        project.name, hashlib.sha1(project.home).hexdigest()[:12])
+    path = os.path.join(state_home, project_key)
+    _mkdir_p(path)
+    return path
+
+
+def _write_json_atomically(path, obj):
+    # Readers see either the old file or the new one, never half of it
+    _mkdir_p(os.path.dirname(path))
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                      prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+##############################################
+# Log index
+##############################################
+
+# Lowercased runs of word characters. Long words are split rather than
+# dropped so that queries tokenize the same way.
+_TOKEN_RE = re.compile(r"[a-z0-9_]{2,64}")
+
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _hash_head(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+# Bumped whenever the tables change; older indexes are rebuilt
+_LOG_INDEX_VERSION = 2
+
+# How much of the start of a file is hashed to tell it from a new file
+# that got the same inode
+_LOG_INDEX_HEAD_SIZE = 1024
+
+
+class LogIndex:
+    """An inverted index (token -> file, line offset) over log files.
+
+    Files are indexed incrementally: each run picks up where the last one
+    stopped, and starts over for a file that was truncated. Files are known
+    by inode and a hash of their first bytes, so a log that was rotated to
+    a new name keeps what was indexed of it, but a new file that reuses a
+    deleted one's inode doesn't.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        if version < _LOG_INDEX_VERSION:
+            # It's only an index; start it over
+            self.db.executescript("""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS postings;
+                PRAGMA user_version = %d;
+                """ % _LOG_INDEX_VERSION)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                head_size INTEGER NOT NULL,
+                head_hash TEXT NOT NULL,
+                indexed_to INTEGER NOT NULL,
+                UNIQUE (dev, inode));
+            CREATE INDEX IF NOT EXISTS files_by_path ON files (path);
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                file_id INTEGER NOT NULL,
+                offset INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS postings_by_token
+                ON postings (token, file_id, offset);
+            CREATE INDEX IF NOT EXISTS postings_by_file
+                ON postings (file_id);
+            """)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths):
+        """Index whatever was appended to paths since last time.
+
+        Files that aren't among paths any more are dropped from the index.
+        Returns the number of bytes indexed.
+        """
+        files = []
+        for path in paths:
+            if os.path.splitext(path)[1] in _DECOMPRESSORS:
+                # Offsets into compressed files aren't seekable
+                continue
+            try:
+                files.append((os.path.abspath(path), os.stat(path)))
+            except EnvironmentError as e:
+                warning("Can't index %s: %s" % (path, e.strerror or e))
+        self._forget_others(files)
+        total = 0
+        for (path, st) in files:
+            try:
+                total += self._update_file(path, st)
+            except EnvironmentError as e:
+                warning("Can't index %s: %s" % (path, e.strerror or e))
+        return total
+
+    def _forget_others(self, files):
+        """Drop every file that isn't one of these."""
+        current = set((st.st_dev, st.st_ino) for (_, st) in files)
+        rows = self.db.execute("SELECT id, dev, inode FROM files").fetchall()
+        for (file_id, dev, inode) in rows:
+            if (dev, inode) not in current:
+                self.db.execute(
+                    "DELETE FROM postings WHERE file_id = ?", (file_id,))
+                self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def _update_file(self, path, st):
+        with open(path, "rb") as f:
+            row = self.db.execute(
+                "SELECT id, path, head_size, head_hash, indexed_to "
+                "FROM files WHERE dev = ? AND inode = ?",
+                (st.st_dev, st.st_ino)).fetchone()
+            if row is None:
+                file_id = self.db.execute(
+                    "INSERT INTO files "
+                    "(path, dev, inode, head_size, head_hash, indexed_to) "
+                    "VALUES (?, ?, ?, 0, '', 0)",
+                    (path, st.st_dev, st.st_ino)).lastrowid
+                indexed_to = 0
+            else:
+                (file_id, old_path, head_size, head_hash, indexed_to) = row
+                if old_path != path:
+                    # Rotated; same data, new name
+                    self.db.execute("UPDATE files SET path = ? WHERE id = ?",
+                                    (path, file_id))
+                if (st.st_size < indexed_to or
+                        _hash_head(f.read(head_size)) != head_hash):
+                    # Truncated, or a new file that got a deleted one's
+                    # inode; what we knew is no longer true
+                    self.db.execute(
+                        "DELETE FROM postings WHERE file_id = ?", (file_id,))
+                    indexed_to = 0
+
+            f.seek(0)
+            head = f.read(_LOG_INDEX_HEAD_SIZE)
+            offset = indexed_to
+            f.seek(offset)
+            pending = ""
+            while True:
+                chunk = f.read(_COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines = (pending + chunk).split("\n")
+                # An unterminated last line may still be being written
+                pending = lines.pop()
+                postings = []
+                for line in lines:
+                    for token in set(_tokenize(line)):
+                        postings.append((token, file_id, offset))
+                    offset += len(line) + 1
+                self.db.executemany(
+                    "INSERT INTO postings (token, file_id, offset) "
+                    "VALUES (?, ?, ?)", postings)
+        self.db.execute(
+            "UPDATE files SET head_size = ?, head_hash = ?, indexed_to = ? "
+            "WHERE id = ?",
+            (len(head), _hash_head(head), offset, file_id))
+        self.db.commit()
+        return offset - indexed_to
+
+    def search(self, query, paths):
+        """Yield (path, line) for lines in paths containing every word."""
+        tokens = sorted(set(_tokenize(query)))
+        if not tokens:
+            return
+        paths_by_abs = dict((os.path.abspath(p), p) for p in paths)
+        file_paths = dict(
+            (file_id, paths_by_abs[abs_path])
+            for (file_id, abs_path)
+            in self.db.execute("SELECT id, path FROM files")
+            if abs_path in paths_by_abs)
+
+        matches = self.db.execute(
+            " INTERSECT ".join(
+                ["SELECT file_id, offset FROM postings WHERE token = ?"] *
+                len(tokens)) +
+            " ORDER BY file_id, offset",
+            tokens)
+
+        open_file_id, open_file = None, None
+        try:
+            for (file_id, offset) in matches:
+                if file_id not in file_paths:
+                    continue
+                if file_id != open_file_id:
+                    if open_file:
+                        open_file.close()
+                    open_file_id = file_id
+                    open_file = open(file_paths[file_id], "rb")
+                open_file.seek(offset)
+                yield file_paths[file_id], open_file.readline().rstrip("\n")
+        finally:
+            if open_file:
+                open_file.close()
+
+
+def _open_log_index(project):
+    return LogIndex(os.path.join(_get_state_dir(project), "log_index.db"))
+
+
+##############################################
+# Start offsets
+##############################################
+
+def _start_record_path(state_dir, service):
+    return os.path.join(state_dir, "starts", service.name + ".json")
+
+
+def _record_start(state_dir, service):
+    """Remember where each of service's logs ended just before it starts."""
+    files = {}
+    for log_type in ("general", "error"):
+        for path in service.resolve_logs_relative_to_cwd(log_type):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.abspath(path)] = [st.st_dev, st.st_ino, st.st_size]
+    _write_json_atomically(_start_record_path(state_dir, service),
+                           {"started_at": time.time(), "files": files})
+
+
+def _load_start_record(state_dir, service):
+    return _read_json(_start_record_path(state_dir, service))
+
+
+def _offsets_since_start(record, history):
+    """Pick the files (and where in them) that hold output since the start.
+
+    history is ordered oldest first, as from _order_log_history. A file that
+    existed at start time is recognized by its inode, even if it has since
+    been rotated to another name; older files in its family are skipped and
+    newer ones read from the beginning. Returns (paths, {path: offset}).
+    """
+    offsets_by_inode = dict(
+        ((dev, inode), size)
+        for (dev, inode, size) in record["files"].values())
+
+    families = OrderedDict()
+    for path in history:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        families.setdefault(_parse_log_name(path)[0], []).append((path, st))
+
+    paths = []
+    offsets = {}
+    for members in families.values():
+        known = [i for (i, (_, st)) in enumerate(members)
+                 if (st.st_dev, st.st_ino) in offsets_by_inode]
+        if known:
+            for (path, st) in members[known[-1]:]:
+                offset = offsets_by_inode.get((st.st_dev, st.st_ino), 0)
+                if offset > st.st_size:
+                    # Truncated since; it's all new
+                    offset = 0
+                paths.append(path)
+                offsets[path] = offset
+        else:
+            for (path, st) in members:
+                if st.st_mtime >= record["started_at"]:
+                    paths.append(path)
+                    offsets[path] = 0
+    return paths, offsets
+
+
+##############################################
+# Log stats
+##############################################
+
+DEFAULT_STATS_PATTERNS = ["ERROR", "WARN"]
+
+
+def _compile_line_counter(pattern):
+    # One C-level scan per chunk and pattern. Each match consumes the line
+    # up to the first hit, and the next one has to start at a new line, so
+    # this counts lines rather than hits.
+    return re.compile(r"^.*?(?:%s)" % pattern, re.MULTILINE)
+
+
+def _scan_log_counts(path, offset, counters):
+    """Count lines matching each counter from offset to the last newline.
+
+    Returns (offset after the last complete line, [count per counter]).
+    """
+    counts = [0] * len(counters)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        pending = ""
+        while True:
+            chunk = f.read(_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind("\n") + 1
+            pending = data[end:]
+            for (i, counter) in enumerate(counters):
+                counts[i] += len(counter.findall(data, 0, end))
+            offset += end
+    return offset, counts
+
+
+def _log_stats_entry(checkpoint, name):
+    """(checked_at, {"dev:inode": offset}) for service name, from checkpoint.
+
+    (None, {}) if that service was never looked at.
+    """
+    if not checkpoint:
+        return (None, {})
+    if "services" not in checkpoint:
+        # Written back when one checkpoint covered the whole project
+        return (checkpoint["checked_at"], checkpoint["files"])
+    entry = checkpoint["services"].get(name)
+    return entry and (entry["checked_at"], entry["files"]) or (None, {})
+
+
+def _update_log_stats(checkpoint, logs_by_service, patterns):
+    """Count new matching lines per service since the checkpoint.
+
+    checkpoint is {"services": {service: {"checked_at": time, "files":
+    {"dev:inode": offset}}}} from previous runs (or None). Each service
+    keeps its own entry, so looking at some services doesn't lose track of
+    the others. Files are tracked by inode, so a log that was rotated since
+    is finished off rather than counted again. Returns ({service: (new
+    bytes, [count per pattern])}, new checkpoint).
+    """
+    counters = [_compile_line_counter(p) for p in patterns]
+    entries = dict(checkpoint and checkpoint.get("services") or {})
+    now = time.time()
+    results = {}
+    stats = OrderedDict()
+    for (name, logs) in logs_by_service.items():
+        (checked_at, old_files) = _log_stats_entry(checkpoint, name)
+        new_files = {}
+        new_bytes = 0
+        counts = [0] * len(counters)
+        for path in _order_log_history(logs):
+            if os.path.splitext(path)[1] in _DECOMPRESSORS:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = "%d:%d" % (st.st_dev, st.st_ino)
+            if key in new_files:
+                # Matched twice
+                continue
+            if key in old_files:
+                offset = old_files[key]
+                if offset > st.st_size:
+                    # Truncated in place
+                    offset = 0
+            elif checked_at and st.st_mtime < checked_at:
+                # Nothing written since we last looked
+                offset = st.st_size
+            else:
+                offset = 0
+            # Services sharing a file usually share its offset too
+            if (key, offset) not in results:
+                results[(key, offset)] = _scan_log_counts(
+                    path, offset, counters)
+            (new_offset, file_counts) = results[(key, offset)]
+            new_files[key] = new_offset
+            new_bytes += new_offset - offset
+            counts = [a + b for (a, b) in zip(counts, file_counts)]
+        stats[name] = (new_bytes, counts)
+        entries[name] = {"checked_at": now, "files": new_files}
+    return stats, {"services": entries}
+
+
+def _print_log_stats(stats, patterns, checkpoint):
+    """Print stats, with rates since each service was last looked at."""
+    now = time.time()
+    checked_at = dict((name, _log_stats_entry(checkpoint, name)[0])
+                      for name in stats)
+    times = set(checked_at.values())
+    if times == set([None]):
+        info("Log lines so far (first look; rates need a second one)")
+    elif len(times) == 1:
+        since = times.pop()
+        info("Log lines since %s (%.1f min ago)" %
+             (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(since)),
+              (now - since) / 60.0))
+    else:
+        info("Log lines since each service was last looked at")
+
+    table = Table(["service"] + patterns + [p + "/min" for p in patterns] +
+                  ["new data"])
+    for (name, (new_bytes, counts)) in stats.items():
+        elapsed_min = (checked_at[name] and
+                       (now - checked_at[name]) / 60.0)
+        rates = [elapsed_min and "%.1f" % (c / elapsed_min) or "-"
+                 for c in counts]
+        table.with_row([name] + counts + rates + [_format_bytes(new_bytes)])
+    table.pretty_print()
+
+
+##############################################
+# Bundles
+##############################################
+
+# At most this many files are being read ahead at once, each at most this
+# many chunks ahead of the archive writer. That bounds memory use no matter
+# how big the logs are.
+_BUNDLE_READERS = 4
+_BUNDLE_CHUNKS_AHEAD = 4
+
+
+class _ReadAheadFile:
+    """File-like view of a file that a background thread reads into a queue.
+
+    Exactly size bytes are produced: tar headers are written before the
+    data, so a log that grows meanwhile is cut off and one that shrinks is
+    padded with NULs (and the problem reported in .errors).
+    """
+
+    def __init__(self, path, size, done):
+        self.path = path
+        self.size = size
+        self.errors = []
+        self._queue = Queue.Queue(_BUNDLE_CHUNKS_AHEAD)
+        self._chunk = ""
+        self._pos = 0
+        self._done = done
+        thread = threading.Thread(target=self._fill)
+        thread.daemon = True
+        thread.start()
+
+    def _fill(self):
+        remaining = self.size
+        try:
+            with open(self.path, "rb") as f:
+                while remaining > 0:
+                    chunk = f.read(min(_COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self._queue.put(chunk)
+                    remaining -= len(chunk)
+        except EnvironmentError as e:
+            self.errors.append(e.strerror or str(e))
+        if remaining > 0:
+            self.errors.append("%d bytes missing" % remaining)
+        while remaining > 0:
+            padding = min(_COPY_CHUNK_SIZE, remaining)
+            self._queue.put("\0" * padding)
+            remaining -= padding
+        self._queue.put(None)
+
+    def read(self, n):
+        pieces = []
+        while n > 0:
+            if self._pos == len(self._chunk):
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                (self._chunk, self._pos) = (chunk, 0)
+            piece = self._chunk[self._pos:self._pos + n]
+            self._pos += len(piece)
+            n -= len(piece)
+            pieces.append(piece)
+        return "".join(pieces)
+
+    def close(self):
+        self._done.release()
+
+
+def _start_read_ahead(entries):
+    """Yield (tarinfo, _ReadAheadFile) for each (tarinfo, path).
+
+    Reading starts up to _BUNDLE_READERS files ahead of the consumer, which
+    must close each file when it's done with it.
+    """
+    slots = threading.Semaphore(_BUNDLE_READERS)
+    started = Queue.Queue()
+
+    def start_all():
+        for (tarinfo, path) in entries:
+            slots.acquire()
+            started.put((tarinfo, _ReadAheadFile(path, tarinfo.size, slots)))
+        started.put(None)
+
+    thread = threading.Thread(target=start_all)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = started.get()
+        if item is None:
+            return
+        yield item
+
+
+def _bundle_status(service):
+    if not service.status_cmd:
+        return "status command not defined\n"
+    (status, output) = _shell(service.status_cmd, service.home, BUFFER,
+                              service.name, "status_cmd")
+    return "%s (exit status %d)\n\n%s" % (
+        status == 0 and "ok" or "not running", status, output)
+
+
+def _bundle_arcname(service, path):
+    abs_path = os.path.abspath(path)
+    rel = os.path.relpath(abs_path, service.home)
+    if rel.startswith(os.pardir):
+        rel = abs_path.lstrip(os.sep)
+    return os.path.join(service.name, rel)
+
+
+def _log_tarinfo(arcname, st):
+    # From the stat taken when the bundle was planned, not a new lstat
+    # that could fail or find a symlink halfway through the archive
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.type = tarfile.REGTYPE
+    tarinfo.size = st.st_size
+    tarinfo.mtime = st.st_mtime
+    tarinfo.mode = stat.S_IMODE(st.st_mode)
+    return tarinfo
+
+
+def _add_bytes_to_tar(tar, arcname, data):
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mtime = time.time()
+    tar.addfile(tarinfo, StringIO.StringIO(data))
+
+
+def _write_bundle(out_path, services):
+    """Stream every service's logs, ads.yml and status into a .tar.gz.
+
+    out_path '-' means stdout. Returns (number of log files, bytes of logs).
+    """
+    statuses = {}
+
+    def collect_status(service):
+        statuses[service.name] = _bundle_status(service)
+
+    status_threads = [threading.Thread(target=collect_status, args=(s,))
+                      for s in services]
+    for thread in status_threads:
+        thread.start()
+
+    if out_path == "-":
+        top = "ads-bundle"
+    else:
+        top = os.path.basename(out_path).split(".")[0] or "ads-bundle"
+
+    entries = []
+    for s in services:
+        logs = []
+        for log_type in ("general", "error"):
+            logs += [p for p in s.resolve_logs_relative_to_cwd(log_type)
+                     if p not in logs]
+        for path in _order_log_history(logs):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            arcname = os.path.join(top, _bundle_arcname(s, path))
+            entries.append((_log_tarinfo(arcname, st), path))
+
+    if out_path == "-":
+        sys.stdout.flush()
+        tar = tarfile.open(fileobj=sys.stdout, mode="w|gz")
+    else:
+        tar = tarfile.open(out_path, mode="w|gz")
+    errors = []
+    total_bytes = 0
+    try:
+        for thread in status_threads:
+            thread.join()
+        for s in services:
+            yml = os.path.join(s.home, "ads.yml")
+            if os.path.isfile(yml):
+                tar.add(yml, os.path.join(top, s.name, "ads.yml"))
+            _add_bytes_to_tar(tar, os.path.join(top, s.name, "status.txt"),
+                              statuses[s.name])
+
+        for (tarinfo, f) in _start_read_ahead(entries):
+            try:
+                tar.addfile(tarinfo, f)
+                total_bytes += f.size
+            finally:
+                f.close()
+            errors += ["%s: %s" % (f.path, e) for e in f.errors]
+
+        if errors:
+            _add_bytes_to_tar(tar, os.path.join(top, "errors.txt"),
+                              "\n".join(errors) + "\n")
+    finally:
+        tar.close()
+
+    for e in errors:
+        error(e)
+    return len(entries), total_bytes
+
+
+##############################################
+# Timing history
+##############################################
+
+class History:
+    """How long each start and stop took, kept in sqlite."""
+
+    def __init__(self, db_path):
+        # Parallel ads runs may record at the same time
+        self.db = sqlite3.connect(db_path, timeout=10)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS ops (
+                service TEXT NOT NULL,
+                op TEXT NOT NULL,
+                finished_at REAL NOT NULL,
+                duration REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                outcome TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS ops_by_service
+                ON ops (service, op, finished_at);
+            """)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, service, op, duration, attempts, outcome):
+        with self.db:
+            self.db.execute(
+                "INSERT INTO ops VALUES (?, ?, ?, ?, ?, ?)",
+                (service, op, time.time(), duration, attempts, outcome))
+
+    def ops(self, service):
+        """(op, sorted durations, attempts list, failure count) per op."""
+        rows = self.db.execute(
+            "SELECT op, duration, attempts, outcome FROM ops "
+            "WHERE service = ? ORDER BY op, duration", (service,))
+        by_op = OrderedDict()
+        for (op, duration, attempts, outcome) in rows:
+            (durations, all_attempts, failures) = by_op.setdefault(
+                op, ([], [], [0]))
+            durations.append(duration)
+            all_attempts.append(attempts)
+            failures[0] += outcome != "ok"
+        return [(op, durations, all_attempts, failures[0])
+                for (op, (durations, all_attempts, failures))
+                in by_op.items()]
+
+    def typical_duration(self, service, op):
+        """Median duration of the last few successful runs, or None."""
+        durations = sorted(d for (d,) in self.db.execute(
+            "SELECT duration FROM ops WHERE service = ? AND op = ? "
+            "AND outcome = 'ok' ORDER BY finished_at DESC LIMIT 20",
+            (service, op)))
+        if not durations:
+            return None
+        return _percentile(durations, 50)
+
+
+def _open_history(state_dir):
+    return History(os.path.join(state_dir, "history.db"))
+
+
+def _record_op(state_dir, service, op, started_at, attempts, outcome):
+    if not state_dir:
+        return
+    try:
+        history = _open_history(state_dir)
+        try:
+            history.record(service.name, op, time.time() - started_at,
+                           attempts, outcome)
+        finally:
+            history.close()
+    except sqlite3.Error as e:
+        # Only the stats suffer
+        warning("Couldn't record %s timing for %s: %s" %
+                (op, service.name, e))
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of a non-empty sorted list."""
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def _slowest_first(services, state_dir, op="start"):
+    """Services ordered by how long op usually takes them, longest first.
+
+    Services with no history go first, since they might be slow.
+    """
+    history = _open_history(state_dir)
+    try:
+        durations = dict((s.name, history.typical_duration(s.name, op))
+                         for s in services)
+    finally:
+        history.close()
+    return sorted(services,
+                  key=lambda s: durations[s.name] is None and
+                  float("-inf") or -durations[s.name])
+
+
+def _print_history(history, services):
+    table = Table(["service", "op", "runs", "p50", "p90", "p99", "max",
+                   "failed", "attempts"])
+    for s in services:
+        for (op, durations, attempts, failures) in history.ops(s.name):
+            table.with_row(
+                [s.name, op, len(durations)] +
+                ["%.2fs" % _percentile(durations, p) for p in (50, 90, 99)] +
+                ["%.2fs" % durations[-1], failures,
+                 "%.1f" % (sum(attempts) / float(len(attempts)))])
+    if not table.rows:
+        return False
+    table.pretty_print()
+    return True
+
+
+##############################################
+# Task records
+##############################################
+
+def _task_record_path(state_dir, service):
+    return os.path.join(state_dir, "tasks", service.name + ".json")
+
+
+def _load_task_record(state_dir, service, task):
+    """(record of task's last successful run, its input files)."""
+    record = (_read_json(_task_record_path(state_dir, service)) or {}).get(
+        task.name) or {}
+    return (record, record.get("files") or {})
+
+
+def _save_task_record(state_dir, service, task, digest, files):
+    path = _task_record_path(state_dir, service)
+    records = _read_json(path) or {}
+    records[task.name] = {"digest": digest, "files": files,
+                          "finished_at": time.time()}
+    _write_json_atomically(path, records)
+
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_task_inputs(task, home, known_files):
+    """Hash the task's command and the contents of its input files.
+
+    Returns (digest, {home-relative path: [size, mtime, file digest]}), or
+    (None, {}) for a task without inputs. Files whose size and mtime match
+    known_files aren't read again.
+    """
+    if not task.inputs:
+        return (None, {})
+    patterns = [os.path.join(home, p) for p in task.inputs]
+    paths = set()
+    for matches in _glob_files(patterns).values():
+        paths.update(matches)
+
+    digest = hashlib.sha1(task.cmd)
+    files = {}
+    for path in sorted(paths):
+        rel = os.path.relpath(path, home)
+        try:
+            st = os.stat(path)
+            known = known_files.get(rel)
+            if known and known[:2] == [st.st_size, st.st_mtime]:
+                file_digest = known[2]
+            else:
+                file_digest = _hash_file(path)
+        except EnvironmentError:
+            # Gone since the glob; it just isn't an input any more
+            continue
+        files[rel] = [st.st_size, st.st_mtime, file_digest]
+        digest.update("%s\0%s\0" % (rel, file_digest))
+    return (digest.hexdigest(), files)
+
+
+##############################################
+# Watching
+##############################################
+
+class _WatchSchedule:
+    """Decides when each watched service should be probed next.
+
+    A service whose status just changed is probed again after min_interval;
+    every probe that finds it unchanged doubles that, up to max_interval.
+    """
+
+    def __init__(self, names, min_interval, max_interval, now):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.intervals = dict((name, min_interval) for name in names)
+        self.next_due = dict((name, now) for name in names)
+        self.last_probe = {}
+
+    def due(self, now):
+        return sorted(name for (name, due) in self.next_due.items()
+                      if due <= now)
+
+    def next_wakeup(self):
+        return min(self.next_due.values())
+
+    def wake(self, name, now):
+        """Probe name soon, but not within min_interval of the last probe.
+
+        Services that keep writing files would otherwise be probed back to
+        back. The backoff is left as it is.
+        """
+        earliest = max(now, self.last_probe.get(name, now) + self.min_interval)
+        self.next_due[name] = min(self.next_due[name], earliest)
+
+    def probed(self, name, changed, now):
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(self.intervals[name] * 2, self.max_interval)
+        self.intervals[name] = interval
+        self.next_due[name] = now + interval
+        self.last_probe[name] = now
+
+
+_WATCH_STATUS_COLORS = {
+    "ok": colors.OKGREEN,
+    "not running": colors.FAIL,
+}
+
+
+class _WatchScreen:
+    """Shows one row per service, rewriting only the rows that change.
+
+    When stdout isn't a terminal, each change is printed as a line instead.
+    """
+
+    HEADER_LINES = 2
+
+    def __init__(self, names, out=sys.stdout):
+        self.out = out
+        self.rows = dict((name, i) for (i, name) in enumerate(names))
+        self.width = max([len(name) for name in names] + [0])
+        self.is_tty = out.isatty()
+
+    def open(self):
+        if self.is_tty:
+            # Clear the screen and hide the cursor
+            self.out.write("\033[2J\033[H\033[?25l")
+            self.out.write("Watching %d services (ctrl+c to quit)\n" %
+                           len(self.rows))
+            self.out.flush()
+
+    def close(self):
+        if self.is_tty:
+            # Put the cursor back, below the table
+            self.out.write("\033[%d;1H\033[?25h" %
+                           (self.HEADER_LINES + len(self.rows) + 1))
+            self.out.flush()
+
+    def update(self, name, status, since):
+        text = "%s  %s%s%s" % (
+            name.ljust(self.width),
+            _WATCH_STATUS_COLORS.get(status, colors.WARNING),
+            status,
+            colors.ENDC)
+        when = time.strftime("%H:%M:%S", time.localtime(since))
+        if self.is_tty:
+            self.out.write("\033[%d;1H\033[2K%s  since %s" %
+                           (self.HEADER_LINES + self.rows[name] + 1,
+                            text, when))
+        else:
+            self.out.write("%s %s\n" % (when, text))
+        self.out.flush()
+
+
+def _probe_status(service):
+    if not service.status_cmd:
+        return "status command not defined"
+    return _is_running(service, False) and "ok" or "not running"
+
+
+def _watch(services, min_interval, max_interval, screen):
+    by_name = dict((s.name, s) for s in services)
+    statuses = {}
+    schedule = _WatchSchedule(sorted(by_name), min_interval, max_interval,
+                              time.time())
+    # Services without a status command never change
+    for service in services:
+        if not service.status_cmd:
+            del schedule.next_due[service.name]
+            statuses[service.name] = _probe_status(service)
+            screen.update(service.name, statuses[service.name], time.time())
+    while schedule.next_due:
+        now = time.time()
+        due = schedule.due(now)
+        if not due:
+            time.sleep(schedule.next_wakeup() - now)
+            continue
+        results = _parallel_map(lambda name: _probe_status(by_name[name]),
+                                due)
+        now = time.time()
+        for (name, status) in zip(due, results):
+            changed = statuses.get(name) != status
+            if changed:
+                statuses[name] = status
+                screen.update(name, status, now)
+            schedule.probed(name, changed, now)
+
+
+##############################################
+# Process stats
+##############################################
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class _ProcInfo:
+    def __init__(self, pid, ppid, cpu_ticks, rss_bytes,
+                 read_bytes, write_bytes, cwd, pgrp=None):
+        self.pid = pid
+        self.ppid = ppid
+        self.pgrp = pgrp
+        self.cpu_ticks = cpu_ticks
+        self.rss_bytes = rss_bytes
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.cwd = cwd
+
+
+def _read_proc_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _read_proc(proc_root, pid):
+    pid_dir = os.path.join(proc_root, str(pid))
+    stat_line = _read_proc_file(os.path.join(pid_dir, "stat"))
+    # The command name is in parentheses and may itself contain spaces
+    # and parentheses, so the numbered fields start after the last ")"
+    fields = stat_line[stat_line.rindex(")") + 2:].split()
+    io = {}
+    try:
+        for line in _read_proc_file(os.path.join(pid_dir, "io")).splitlines():
+            (key, _, value) = line.partition(":")
+            io[key] = int(value)
+    except EnvironmentError:
+        # Other users' processes
+        pass
+    try:
+        cwd = os.readlink(os.path.join(pid_dir, "cwd"))
+    except EnvironmentError:
+        cwd = None
+    return _ProcInfo(pid,
+                     int(fields[1]),
+                     int(fields[11]) + int(fields[12]),
+                     int(fields[21]) * _PAGE_SIZE,
+                     io.get("read_bytes", 0),
+                     io.get("write_bytes", 0),
+                     cwd,
+                     int(fields[2]))
+
+
+# Linux has it; Mac OS doesn't
+_HAS_PROC = os.path.isdir("/proc/self")
+
+
+def _sample_procs(proc_root="/proc"):
+    """Read every process's counters in one pass, without running ps."""
+    procs = {}
+    for name in os.listdir(proc_root):
+        if not name.isdigit():
+            continue
+        try:
+            procs[int(name)] = _read_proc(proc_root, int(name))
+        except (EnvironmentError, ValueError, IndexError):
+            # Exited while we were looking
+            continue
+    return procs
+
+
+def _services_by_pid(procs, services):
+    """Map pids to the names of the services they belong to.
+
+    A process belongs to the service whose home it runs in (the innermost
+    one, if homes are nested), or else to the one its parent belongs to.
+    """
+    homes = sorted([(os.path.realpath(s.home), s.name) for s in services],
+                   key=lambda h: len(h[0]), reverse=True)
+    owners = {}
+
+    def owner(pid):
+        if pid in owners:
+            return owners[pid]
+        # Guard against cycles, which pid reuse could make
+        owners[pid] = None
+        proc = procs.get(pid)
+        if proc is None:
+            return None
+        if proc.cwd:
+            for (home, name) in homes:
+                if proc.cwd == home or proc.cwd.startswith(home + os.sep):
+                    owners[pid] = name
+                    return name
+        owners[pid] = owner(proc.ppid)
+        return owners[pid]
+
+    result = {}
+    for pid in procs:
+        if pid != os.getpid() and owner(pid):
+            result[pid] = owners[pid]
+    return result
+
+
+class _ServiceUsage:
+    def __init__(self, name):
+        self.name = name
+        self.procs = 0
+        self.cpu_percent = 0.0
+        self.rss_bytes = 0
+        self.read_rate = 0.0
+        self.write_rate = 0.0
+
+
+def _service_usage(before, after, seconds, services):
+    """Sum up, per service, what its processes used between two samples."""
+    usage = OrderedDict((s.name, _ServiceUsage(s.name)) for s in services)
+    for (pid, name) in _services_by_pid(after, services).items():
+        proc = after[pid]
+        # A process that started in between used everything since its start
+        prev = before.get(pid) or _ProcInfo(pid, 0, 0, 0, 0, 0, None)
+        u = usage[name]
+        u.procs += 1
+        u.cpu_percent += (100.0 * (proc.cpu_ticks - prev.cpu_ticks) /
+                          _CLOCK_TICKS / seconds)
+        u.rss_bytes += proc.rss_bytes
+        u.read_rate += (proc.read_bytes - prev.read_bytes) / seconds
+        u.write_rate += (proc.write_bytes - prev.write_bytes) / seconds
+    return usage.values()
+
+
+_TOP_SORT_KEYS = OrderedDict([
+    ("cpu", lambda u: -u.cpu_percent),
+    ("mem", lambda u: -u.rss_bytes),
+    ("read", lambda u: -u.read_rate),
+    ("write", lambda u: -u.write_rate),
+    ("name", lambda u: u.name),
+])
+
+
+def _top_table(usages, sort_by):
+    table = Table(["service", "procs", "cpu%", "mem", "read/s", "write/s"])
+    for u in sorted(usages, key=_TOP_SORT_KEYS[sort_by]):
+        table.with_row([u.name, u.procs, "%.1f" % u.cpu_percent,
+                        _format_bytes(u.rss_bytes),
+                        _format_bytes(u.read_rate),
+                        _format_bytes(u.write_rate)])
+    return table
+
+
+##############################################
+# Supervising
+##############################################
+
+_PR_SET_CHILD_SUBREAPER = 36
+
+
+def _become_subreaper():
+    """Adopt our orphaned descendants (Linux only).
+
+    start_cmds usually put the service in the background and exit, which
+    would leave it a child of init. As a subreaper, ads gets it instead, and
+    with it a SIGCHLD the moment it exits.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(_PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def _child_pgrps():
+    """{pid: process group} of each of our child processes.
+
+    Without /proc, that's {}, so every service is polled instead.
+    """
+    if not _HAS_PROC:
+        return {}
+    me = os.getpid()
+    return dict((pid, proc.pgrp) for (pid, proc) in _sample_procs().items()
+                if proc.ppid == me)
+
+
+class _RestartPolicy:
+    """Exponential backoff between restarts, giving up on crash loops.
+
+    The first restart waits backoff seconds, and each one after it twice as
+    long, up to max_backoff. A service that stays up for stable_after
+    seconds starts over; one that crashes more than max_restarts times in a
+    row is left down.
+    """
+
+    def __init__(self, backoff, max_backoff, max_restarts, stable_after):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.stable_after = stable_after
+        self.crashes = 0
+        self.started_at = None
+
+    def started(self, now):
+        self.started_at = now
+
+    def crashed(self, now):
+        """Seconds to wait before restarting, or None to give up."""
+        if (self.started_at is not None and
+                now - self.started_at >= self.stable_after):
+            self.crashes = 0
+        self.started_at = None
+        self.crashes += 1
+        if self.crashes > self.max_restarts:
+            return None
+        return min(self.backoff * 2 ** (self.crashes - 1), self.max_backoff)
+
+
+class _Supervisor:
+    """Keeps services running, restarting them when they exit.
+
+    The processes a service's start_cmd leaves behind (and, by process
+    group, whatever they start later) are tracked, and the service counts
+    as crashed once the last of them exits. Exits are reaped as they
+    happen, so an idle supervisor just sleeps. Services whose processes
+    ads didn't start (already running, or run elsewhere, e.g. by docker)
+    are checked with their status_cmd every poll_interval seconds instead.
+    """
+
+    def __init__(self, services, state_dir, make_policy, poll_interval):
+        self.services = OrderedDict((s.name, s) for s in services)
+        self.state_dir = state_dir
+        self.policies = dict((s.name, make_policy()) for s in services)
+        self.poll_interval = poll_interval
+        self.pids = dict((s.name, set()) for s in services)
+        self.groups = {}
+        self.restart_at = {}
+        self.poll_at = {}
+        self.given_up = set()
+
+    def _owner(self, pid):
+        for (name, pids) in self.pids.items():
+            if pid in pids:
+                return name
+        return None
+
+    def start(self, name, now, restart=False):
+        service = self.services[name]
+        before = _child_pgrps()
+        # A restart is recorded as such, rather than as another start
+        ok = _up(service, False, self.state_dir,
+                 record_as=restart and "restart" or "start")
+        if not ok:
+            self.crashed(name, now)
+            return
+        self.policies[name].started(now)
+        new = dict((pid, pgrp) for (pid, pgrp) in _child_pgrps().items()
+                   if pid not in before)
+        if new:
+            self.pids[name].update(new)
+            for pgrp in new.values():
+                # Commands run from a terminal share our group, and every
+                # later orphan in it isn't necessarily this service's
+                if pgrp != os.getpgrp():
+                    self.groups[pgrp] = name
+        else:
+            self.poll_at[name] = now + self.poll_interval
+
+    def crashed(self, name, now):
+        self.poll_at.pop(name, None)
+        delay = self.policies[name].crashed(now)
+        if delay is None:
+            error("%s keeps crashing (%d times in a row); giving up on it" %
+                  (name, self.policies[name].crashes))
+            self.given_up.add(name)
+        else:
+            warning("%s is down; restarting it in %.1fs" % (name, delay))
+            self.restart_at[name] = now + delay
+
+    def reap(self, now):
+        """Handle every child that exited since we last looked."""
+        exited = []
+        while True:
+            try:
+                (pid, _) = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                break
+            if pid == 0:
+                break
+            exited.append(pid)
+        if not exited:
+            return
+        # Processes orphaned by those exits are ours now
+        for (pid, pgrp) in _child_pgrps().items():
+            if pgrp in self.groups and self._owner(pid) is None:
+                self.pids[self.groups[pgrp]].add(pid)
+        for pid in exited:
+            name = self._owner(pid)
+            if name is None:
+                continue
+            self.pids[name].discard(pid)
+            if not self.pids[name]:
+                self.crashed(name, now)
+
+    def run_due(self, now):
+        for (name, due) in sorted(self.restart_at.items()):
+            if due <= now:
+                del self.restart_at[name]
+                self.start(name, now, restart=True)
+        for (name, due) in sorted(self.poll_at.items()):
+            if due <= now:
+                if _is_running(self.services[name], False):
+                    self.poll_at[name] = now + self.poll_interval
+                else:
+                    self.crashed(name, now)
+
+    def next_timeout(self, now):
+        """Seconds until run_due has something to do; None if never."""
+        dues = self.restart_at.values() + self.poll_at.values()
+        if not dues:
+            return None
+        return max(min(dues) - now, 0)
+
+    def supervising(self):
+        return len(self.given_up) < len(self.services)
+
+    def run(self, wakeup_fd):
+        """Supervise until every service is given up on.
+
+        wakeup_fd becomes readable when a SIGCHLD arrives.
+        """
+        for name in self.services:
+            self.start(name, time.time())
+        while self.supervising():
+            try:
+                select.select([wakeup_fd], [], [],
+                              self.next_timeout(time.time()))
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+            try:
+                while os.read(wakeup_fd, 4096):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+            now = time.time()
+            self.reap(now)
+            self.run_due(now)
+
+
+##############################################
+# Waiting
+##############################################
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+                  _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+_O_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _DirWatcher:
+    """Tells which of the watched directories changed, using inotify.
+
+    Each directory is watched on behalf of one or more keys (service
+    names); changed() returns the keys whose directories saw any activity.
+    """
+
+    @classmethod
+    def create(cls):
+        """A new _DirWatcher, or None where inotify isn't available."""
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | _O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return fd >= 0 and _DirWatcher(libc, fd) or None
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.keys_by_wd = {}
+        self.paths_by_wd = {}
+
+    def watch(self, path, key):
+        wd = self.libc.inotify_add_watch(self.fd, path, _IN_WATCH_MASK)
+        if wd < 0:
+            return False
+        self.keys_by_wd.setdefault(wd, set()).add(key)
+        self.paths_by_wd[wd] = path
+        return True
+
+    def _read_events(self):
+        """(wd, name) for each event so far; name is "" for the dir itself."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                (wd, _, _, name_len) = _INOTIFY_EVENT.unpack_from(data, offset)
+                start = offset + _INOTIFY_EVENT.size
+                events.append((wd, data[start:start + name_len].rstrip("\0")))
+                offset = start + name_len
+        return events
+
+    def changed(self):
+        keys = set()
+        for (wd, _) in self._read_events():
+            keys |= self.keys_by_wd.get(wd, set())
+        return keys
+
+    def changed_paths(self):
+        """Like changed(), but {key: paths of the entries that changed}."""
+        paths = {}
+        for (wd, name) in self._read_events():
+            if not name or wd not in self.paths_by_wd:
+                continue
+            path = os.path.join(self.paths_by_wd[wd], name)
+            for key in self.keys_by_wd.get(wd, ()):
+                paths.setdefault(key, set()).add(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Services with no news are probed this often at first, then half as often
+# after every probe, down to the max
+_WAIT_MIN_INTERVAL = 0.1
+_WAIT_MAX_INTERVAL = 2.0
+
+
+def _is_ready(service):
+    if not service.ready_cmd:
+        return _is_running(service, False)
+    return _shell(service.ready_cmd, service.home, NULL,
+                  service.name, "ready_cmd")[0] == 0
+
+
+_WAIT_CONDITIONS = OrderedDict([
+    ("up", lambda service: _is_running(service, False)),
+    ("down", lambda service: not _is_running(service, False)),
+    ("ready", _is_ready),
+])
+
+
+def _watch_service_dirs(watcher, services):
+    """Watch the dirs that services' logs (and often pid files) live in.
+
+    Services tend to write there as they come up or go down, which is a
+    good time to check on them again.
+    """
+    logs = _resolve_logs(services, "general")
+    for service in services:
+        dirs = set([service.home] +
+                   [os.path.dirname(os.path.abspath(log))
+                    for log in logs[service.name]])
+        for path in dirs:
+            watcher.watch(path, service.name)
+
+
+def _wait_for(services, condition, deadline, watcher=None):
+    """Wait until condition holds for each service, or until deadline.
+
+    All services are probed at once; those that don't pass yet are probed
+    again with a growing backoff, or right away when their dirs change.
+    Returns {name: seconds it took} for the services that got there.
+    """
+    by_name = dict((s.name, s) for s in services)
+    started = time.time()
+    schedule = _WatchSchedule(sorted(by_name), _WAIT_MIN_INTERVAL,
+                              _WAIT_MAX_INTERVAL, started)
+    reached = {}
+    while schedule.next_due:
+        now = time.time()
+        due = schedule.due(now)
+        if due:
+            results = _parallel_map(lambda name: condition(by_name[name]),
+                                    due)
+            now = time.time()
+            for (name, ok) in zip(due, results):
+                if ok:
+                    reached[name] = now - started
+                    del schedule.next_due[name]
+                else:
+                    schedule.probed(name, False, now)
+            continue
+        if deadline is not None and now >= deadline:
+            break
+        timeout = schedule.next_wakeup() - now
+        if deadline is not None:
+            timeout = min(timeout, deadline - now)
+        timeout = max(timeout, 0)
+        if not watcher:
+            time.sleep(timeout)
+            continue
+        try:
+            select.select([watcher.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+        now = time.time()
+        for name in watcher.changed():
+            if name in schedule.next_due:
+                schedule.wake(name, now)
+    return reached
+
+
+##############################################
+# Source watching
+##############################################
+
+# How often to look for changes where inotify isn't available
+_SOURCE_POLL_INTERVAL = 2.0
+
+
+def _compile_glob(abs_pattern):
+    return [_compile_glob_segment(segment)
+            for segment in os.path.normpath(abs_pattern).split(os.sep)]
+
+
+def _source_mtimes(abs_patterns):
+    mtimes = {}
+    for files in _glob_files(abs_patterns).values():
+        for path in files:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                # Gone since the glob
+                pass
+    return mtimes
+
+
+class _SourceWatcher:
+    """Tells which services' watch_paths changed.
+
+    With a _DirWatcher, only the directories the globs could match in are
+    watched, so even a big tree costs nothing while it's left alone.
+    Otherwise, the matching files' mtimes are compared every
+    _SOURCE_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, services, dir_watcher=None):
+        self.dir_watcher = dir_watcher
+        self.patterns = dict(
+            (s.name, [os.path.join(s.home, p) for p in s.watch_paths])
+            for s in services)
+        self.compiled = dict(
+            (name, [_compile_glob(p) for p in patterns])
+            for (name, patterns) in self.patterns.items())
+        self.mtimes = {}
+        for name in self.patterns:
+            self.rescan(name)
+
+    def rescan(self, name):
+        """Catch up with dirs (or, when polling, files) created lately."""
+        if self.dir_watcher:
+            dirs = []
+            _glob_files(self.patterns[name], dirs)
+            for path in dirs:
+                self.dir_watcher.watch(path, name)
+        else:
+            self.mtimes[name] = _source_mtimes(self.patterns[name])
+
+    def matches(self, name, path):
+        names = os.path.normpath(path).split(os.sep)
+        return any(_glob_match(segments, 0, names, 0)
+                   for segments in self.compiled[name])
+
+    def changed(self, timeout=None):
+        """Wait up to timeout (None: for good) for changes; returns names."""
+        if not self.dir_watcher:
+            time.sleep(_SOURCE_POLL_INTERVAL if timeout is None
+                       else min(timeout, _SOURCE_POLL_INTERVAL))
+            changed = set()
+            for name in self.patterns:
+                before = self.mtimes[name]
+                self.rescan(name)
+                if self.mtimes[name] != before:
+                    changed.add(name)
+            return changed
+        try:
+            select.select([self.dir_watcher.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+        changed = set()
+        for (name, paths) in self.dir_watcher.changed_paths().items():
+            if any(os.path.isdir(path) for path in paths):
+                # Files may turn up in there next
+                self.rescan(name)
+            if any(self.matches(name, path) for path in paths):
+                changed.add(name)
+        return changed
+
+
+class _Debouncer:
+    """Batches changes until none have come in for quiet seconds."""
+
+    def __init__(self, quiet):
+        self.quiet = quiet
+        self.pending = set()
+        self.last_change = None
+
+    def add(self, names, now):
+        if names:
+            self.pending |= set(names)
+            self.last_change = now
+
+    def next_timeout(self, now):
+        """How long until the batch is due (None: nothing pending)."""
+        if not self.pending:
+            return None
+        return max(self.last_change + self.quiet - now, 0)
+
+    def due(self, now):
+        """The batch, if it's been quiet long enough; empty otherwise."""
+        if not self.pending or now < self.last_change + self.quiet:
+            return set()
+        (batch, self.pending) = (self.pending, set())
+        return batch
+
+
+def _restart_on_changes(source_watcher, debouncer, restart):
+    """Call restart(names) after each burst of changes, until ctrl+c."""
+    while True:
+        batch = debouncer.due(time.time())
+        if batch:
+            restart(sorted(batch))
+        changed = source_watcher.changed(debouncer.next_timeout(time.time()))
+        debouncer.add(changed, time.time())
+
+
+##############################################
+# Plans
+##############################################
+
+_PLAN_STATES = ["up", "down"]
 
-    def __init__(self, service_sets=None, default_selector=None):
-        self.service_sets = service_sets or []
-        self.default_selector = default_selector
+
+def _load_plan(path):
+    """{"up": [selectors], "down": [selectors]} from a plan file."""
+    try:
+        with open(path) as f:
+            spec = yaml.safe_load(f) or {}
+    except IOError as e:
+        raise NotFound("Can't read plan %s: %s" % (path, e.strerror))
+    except yaml.YAMLError as e:
+        raise UsageError("%s isn't valid YAML: %s" % (path, e))
+    malformed = UsageError(
+        "%s: expected 'up' and/or 'down', each a list of selectors" % path)
+    if not isinstance(spec, dict) or set(spec) - set(_PLAN_STATES):
+        raise malformed
+    plan = {}
+    for state in _PLAN_STATES:
+        selectors = spec.get(state) or []
+        if isinstance(selectors, str):
+            selectors = [selectors]
+        if not (isinstance(selectors, list) and
+                all(isinstance(sel, str) for sel in selectors)):
+            raise malformed
+        plan[state] = selectors
+    return plan
+
+
+def _plan_transitions(wanted, statuses):
+    """Work out what it takes to get services to the wanted states.
+
+    wanted is [(service, "up" or "down")] and statuses has the matching
+    _check_status results. Returns (services to stop, services to start,
+    services already as wanted, services whose status is unknown).
+    """
+    (to_stop, to_start, unchanged, unknown) = ([], [], [], [])
+    for ((service, state), status) in zip(wanted, statuses):
+        if status.outcome == OpResult.NO_STATUS_CMD:
+            unknown.append(service)
+        elif status.ok == (state == "up"):
+            unchanged.append(service)
+        elif state == "up":
+            to_start.append(service)
+        else:
+            to_stop.append(service)
+    return (to_stop, to_start, unchanged, unknown)
 
 
 ##############################################
@@ -533,9 +3182,7 @@ class Ads:
 
     @staticmethod
     def load_from_env(use_cache):
-        profile_home = os.getenv("ADS_PROFILE_HOME")
-        if not profile_home or len(profile_home) == 0:
-            profile_home = os.path.expanduser("~")
+        profile_home = _get_profile_home()
 
         if use_cache == ALWAYS:
             check_cache = True
@@ -553,16 +3200,26 @@ class Ads:
     def __init__(self, project, profile=Profile()):
         self.project = project
         self.profile = profile
+        self.resolver = None
 
     def resolve(self, selector):
-
-        if selector == "default":
-            selector = self.get_default_selector()
-
-        return ServiceSet.resolve(
-            selector,
-            self.project,
-            self.project.service_sets + self.profile.service_sets)
+        return self.resolve_all([selector])
+
+    def resolve_all(self, selectors):
+        """Resolve a list of selector expressions, like 'backend',
+        '-flaky' and 'backend&critical', all at once."""
+        selectors = [self.get_default_selector() if s == "default" else s
+                     for s in selectors]
+        if all(s.startswith("-") for s in selectors):
+            # Exclusions alone narrow down the default
+            selectors.insert(0, self.get_default_selector())
+
+        if not self.resolver:
+            self.resolver = _SelectorResolver(
+                self.project,
+                self.project.service_sets + self.profile.service_sets,
+                self.project.cache)
+        return self.resolver.resolve_all(selectors)
 
     def get_default_selector(self):
         return (self.profile.default_selector or
@@ -602,6 +3259,46 @@ class Ads:
 ##############################################
 
 class MyArgParser(argparse.ArgumentParser):
+    def parse_args(self, args=None, namespace=None):
+        args = sys.argv[1:] if args is None else list(args)
+        if not any(a.dest == "service" for a in self._actions):
+            return super(MyArgParser, self).parse_args(args, namespace)
+        # Selector exclusions like -flaky look like options to argparse,
+        # which would even read -flaky as -f, so take them out first
+        (args, exclusions) = self._pull_exclusions(args)
+        parsed_args = super(MyArgParser, self).parse_args(args, namespace)
+        parsed_args.service += exclusions
+        return parsed_args
+
+    def _pull_exclusions(self, args):
+        kept = []
+        exclusions = []
+        value_next = False
+        for (i, arg) in enumerate(args):
+            if arg == "--":
+                return (kept + args[i:], exclusions)
+            is_option = arg in self._option_string_actions
+            if (value_next or len(arg) < 2 or arg[0] != "-" or
+                    arg.startswith("--") or is_option or
+                    self._is_attached_value(arg)):
+                kept.append(arg)
+            else:
+                exclusions.append(arg)
+            value_next = (is_option and not value_next and
+                          self._option_string_actions[arg].nargs != 0)
+        return (kept, exclusions)
+
+    def _is_attached_value(self, arg):
+        # Like -j4, but not -jenkins
+        action = self._option_string_actions.get(arg[:2])
+        if action is None or action.nargs == 0:
+            return False
+        try:
+            value = (action.type or str)(arg[2:])
+        except ValueError:
+            return False
+        return action.choices is None or value in action.choices
+
     def error(self, message):
         if "too few arguments" in message:
             # Default behavior of "ads" is too punishing
@@ -656,6 +3353,16 @@ class SomeDown(AdsCommandException):
         super(SomeDown, self).__init__(23)
 
 
+class ExecFailed(AdsCommandException):
+    def __init__(self, exit_code, msg):
+        super(ExecFailed, self).__init__(exit_code, msg)
+
+
+class WaitTimedOut(AdsCommandException):
+    def __init__(self):
+        super(WaitTimedOut, self).__init__(24)
+
+
 def _load_or_die(use_cache):
     ads = Ads.load_from_env(use_cache)
     if not ads:
@@ -666,121 +3373,353 @@ def _load_or_die(use_cache):
 
 
 def _tail(files):
-    status = _shell("tail -F " + " \\\n\t".join(files), os.curdir)[0]
-    return (status == 0 or
-            status == 47)  # tail was ended by ctrl+c (Mac OS)
+    try:
+        status = _shell("tail -F " + " \\\n\t".join(files), os.curdir,
+                        cmd_type="tail")[0]
+    except KeyboardInterrupt:
+        # The usual way to stop following logs
+        return True
+    return status == 0
+
+
+def _cat(files, offsets=None, ends=None):
+    # Anything already printed must come out before the raw file data
+    sys.stdout.flush()
+    return _dump_files(files, sys.stdout.fileno(), offsets, ends)
+
+
+# How often ads logs --since-start looks for more output
+_FOLLOW_INTERVAL = 0.5
+
+
+class _Follower:
+    """Copies what gets appended to files to out_fd, like tail -F.
+
+    Each file is picked up at offsets[path], or at its end if it has no
+    offset. When a file is rotated away, the rest of it is copied and the
+    new file at its path followed from the start.
+    """
+
+    def __init__(self, paths, offsets, out_fd):
+        self.paths = paths
+        self.offsets = dict((p, offsets.get(p)) for p in paths)
+        self.out_fd = out_fd
+        self.fds = {}
+        self.last_path = None
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def poll(self):
+        for path in self.paths:
+            fd = self.fds.get(path)
+            if fd is not None:
+                self._copy(path, fd)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Rotated, and the new file isn't there yet
+                continue
+            if fd is not None:
+                current = os.fstat(fd)
+                if (current.st_dev, current.st_ino) == (st.st_dev, st.st_ino):
+                    if st.st_size < os.lseek(fd, 0, os.SEEK_CUR):
+                        warning("%s: file truncated" % path)
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        self._copy(path, fd)
+                    continue
+                os.close(fd)
+                del self.fds[path]
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            self.fds[path] = fd
+            offset = self.offsets.pop(path, 0)
+            if offset is None:
+                os.lseek(fd, 0, os.SEEK_END)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+            self._copy(path, fd)
+
+    def _copy(self, path, fd):
+        while True:
+            chunk = os.read(fd, _COPY_CHUNK_SIZE)
+            if not chunk:
+                return
+            if len(self.paths) > 1 and path != self.last_path:
+                # Like tail's headers, to tell the files apart
+                _write_all(self.out_fd, "%s==> %s <==\n" % (
+                    self.last_path and "\n" or "", path))
+            self.last_path = path
+            _write_all(self.out_fd, chunk)
+
+
+def _follow(files, offsets):
+    """Follow files from offsets until interrupted; see _Follower."""
+    sys.stdout.flush()
+    follower = _Follower(files, offsets, sys.stdout.fileno())
+    try:
+        while True:
+            follower.poll()
+            time.sleep(_FOLLOW_INTERVAL)
+    except KeyboardInterrupt:
+        # The usual way to stop following logs
+        pass
+    except EnvironmentError as e:
+        if e.errno != errno.EPIPE:
+            raise
+    finally:
+        follower.close()
+
+
+class OpResult:
+    """What an operation did to one service.
+
+    outcome is one of the strings below; ok says whether the service ended
+    up how the operation wanted it. output is what the failed command
+    printed, when it wasn't streamed.
+    """
+
+    STARTED = "started"
+    STOPPED = "stopped"
+    ALREADY_RUNNING = "already running"
+    ALREADY_STOPPED = "already stopped"
+    RUNNING = "running"
+    NOT_RUNNING = "not running"
+    FAILED = "failed"
+    STILL_RUNNING = "still running"
+    NO_STATUS_CMD = "no status_cmd"
+    NO_START_CMD = "no start_cmd"
+    NO_STOP_CMD = "no stop_cmd"
+    BUSY = "busy"
+
+    def __init__(self, service, op, outcome, ok, seconds=0.0, attempts=0,
+                 output=None):
+        self.service = service
+        self.op = op
+        self.outcome = outcome
+        self.ok = ok
+        self.seconds = seconds
+        self.attempts = attempts
+        self.output = output
+
+    def __repr__(self):
+        return "<%s %s: %s>" % (self.op, self.service.name, self.outcome)
 
 
-def _cat(files):
-    return _shell("cat " + " ".join(files), os.curdir)[0] == 0
+def _check_status(service, verbose):
+    if not service.status_cmd:
+        return OpResult(service, "status", OpResult.NO_STATUS_CMD, False)
+    if verbose:
+        debug("Checking if %s is running" % service.name)
+    started_at = time.time()
+    running = _is_running(service, verbose)
+    return OpResult(service, "status",
+                    running and OpResult.RUNNING or OpResult.NOT_RUNNING,
+                    running, time.time() - started_at)
 
 
 def _status(service, verbose):
-    if not service.status_cmd:
-        running = False
-        msg = "status command not defined"
-    else:
-        if verbose:
-            debug("Checking if %s is running" % service.name)
-        running = _shell(service.status_cmd,
-                         service.home,
-                         verbose and STREAM or NULL)[0] == 0
-        msg = running and "ok" or "not running"
-    info(service.name + ": " + msg)
-    return running
+    result = _check_status(service, verbose)
+    info(service.name + ": " + {
+        OpResult.NO_STATUS_CMD: "status command not defined",
+        OpResult.RUNNING: "ok",
+        OpResult.NOT_RUNNING: "not running",
+    }[result.outcome])
+    return result.ok
 
 
 def _is_running(service, verbose):
     return _shell(service.status_cmd,
                   service.home,
-                  verbose and STREAM or NULL)[0] == 0
+                  verbose and STREAM or NULL,
+                  service.name, "status_cmd")[0] == 0
+
+
+def _get_lock_timeout():
+    try:
+        return float(os.environ["ADS_LOCK_TIMEOUT"])
+    except (KeyError, ValueError):
+        return None
 
 
-def _up(service, verbose):
+def _output_path(state_dir, service, op):
+    """Where to keep the full output of service's op, if anywhere.
+
+    The file is emptied, for the op's commands (retries included) to add
+    to.
+    """
+    if not state_dir or not os.getenv("ADS_KEEP_OUTPUT"):
+        return None
+    path = os.path.join(state_dir, "output", "%s.%s.log" % (service.name, op))
+    _mkdir_p(os.path.dirname(path))
+    open(path, "w").close()
+    return path
+
+
+def _locked_op(op, func, service, verbose, state_dir, announce, check_first):
+    """Run func (a service's start or stop) holding that service's lock.
+
+    The lock, under the project's state dir, keeps two ads processes from
+    both deciding to start (or stop) the same service. How long to wait
+    for it is up to $ADS_LOCK_TIMEOUT (default: as long as it takes); if
+    that runs out, the result is BUSY.
+    """
+    if not state_dir:
+        return func(service, verbose, state_dir, announce, check_first)
+    waited = []
+
+    def on_wait():
+        waited.append(True)
+        if announce:
+            announce("Waiting for another ads to finish with " +
+                     service.name)
+    try:
+        with _FileLock(os.path.join(state_dir, "locks",
+                                    service.name + ".lock"),
+                       _get_lock_timeout(), on_wait):
+            # Whatever the caller knew may have changed while we waited
+            return func(service, verbose, state_dir, announce,
+                        check_first or bool(waited))
+    except LockTimeout:
+        return OpResult(service, op, OpResult.BUSY, False)
+
+
+def _start_service(service, verbose, state_dir=None, announce=None,
+                   check_first=True, record_as="start"):
+    """Start service unless it's running; announce is called just before.
+
+    With check_first=False, the caller already knows it's not running. The
+    start goes in the history as a record_as op.
+    """
+    return _locked_op("start",
+                      lambda *args: _start_service_locked(
+                          *args, record_as=record_as),
+                      service, verbose, state_dir, announce, check_first)
+
+
+def _start_service_locked(service, verbose, state_dir, announce,
+                          check_first, record_as="start"):
     # Is it running?
     if not service.status_cmd:
-        error("Status command not defined for " + service.name +
-              "; can't tell if it's already running")
-        return False
-    if verbose:
-        debug("Checking if %s is already running" % service.name)
-    if _is_running(service, verbose):
-        info(service.name + " is already running")
-        return True
+        return OpResult(service, "start", OpResult.NO_STATUS_CMD, False)
+    if check_first:
+        if verbose:
+            debug("Checking if %s is already running" % service.name)
+        if _is_running(service, verbose):
+            return OpResult(service, "start", OpResult.ALREADY_RUNNING, True)
 
     # Is start defined?
     if not service.start_cmd:
-        error("Start command not defined for " + service.name)
-        return False
+        return OpResult(service, "start", OpResult.NO_START_CMD, False)
 
     # Do it
-    info("Starting " + service.name)
+    if announce:
+        announce("Starting " + service.name)
+    if state_dir:
+        # For `ads logs --since-start`
+        _record_start(state_dir, service)
+    output_path = _output_path(state_dir, service, "start")
+    started_at = time.time()
     (status, out) = _shell(service.start_cmd, service.home,
-                           verbose and STREAM or BUFFER)
+                           verbose and STREAM or BUFFER,
+                           service.name, "start_cmd", output_path)
+    _record_op(state_dir, service, record_as, started_at, 1,
+               status == 0 and "ok" or "failed")
+    seconds = time.time() - started_at
     if status == 0:
-        if verbose:
-            debug("Started " + service.name)
-        return True
-    else:
+        return OpResult(service, "start", OpResult.STARTED, True, seconds, 1)
+    return OpResult(service, "start", OpResult.FAILED, False, seconds, 1,
+                    out)
+
+
+def _up(service, verbose, state_dir=None, check_first=True,
+        record_as="start"):
+    result = _start_service(service, verbose, state_dir, info, check_first,
+                            record_as)
+    if result.outcome == OpResult.NO_STATUS_CMD:
+        error("Status command not defined for " + service.name +
+              "; can't tell if it's already running")
+    elif result.outcome == OpResult.ALREADY_RUNNING:
+        info(service.name + " is already running")
+    elif result.outcome == OpResult.NO_START_CMD:
+        error("Start command not defined for " + service.name)
+    elif result.outcome == OpResult.BUSY:
+        error("Gave up waiting for another ads to finish with " +
+              service.name)
+    elif result.outcome == OpResult.FAILED:
         error("Failed to start " + service.name)
         if not verbose:
-            sys.stderr.write(out)
+            sys.stderr.write(result.output)
             error(separator())
         else:
             # Output was already streamed
             pass
-        return False
+    elif verbose:
+        debug("Started " + service.name)
+    return result.ok
+
+
+def _stop_service(service, verbose, state_dir=None, announce=None,
+                  check_first=True):
+    """Stop service if it's running; announce is called just before.
 
+    With check_first=False, the caller already knows it's running.
+    """
+    return _locked_op("stop", _stop_service_locked, service, verbose,
+                      state_dir, announce, check_first)
 
-def _down(service, verbose):
+
+def _stop_service_locked(service, verbose, state_dir, announce, check_first):
     # Is it running?
     if not service.status_cmd:
-        error("Status command not defined for " + service.name +
-              "; can't tell if it's already stopped")
-        return False
-    if verbose:
-        debug("Checking if %s is running" % service.name)
-    if not _is_running(service, verbose):
-        info(service.name + " is already stopped")
-        return True
+        return OpResult(service, "stop", OpResult.NO_STATUS_CMD, False)
+    if check_first:
+        if verbose:
+            debug("Checking if %s is running" % service.name)
+        if not _is_running(service, verbose):
+            return OpResult(service, "stop", OpResult.ALREADY_STOPPED, True)
 
     # Is stop defined?
     if not service.stop_cmd:
-        error("Stop command not defined for " + service.name)
-        return False
+        return OpResult(service, "stop", OpResult.NO_STOP_CMD, False)
 
     # Do it
     attempts = 0
-    info("Stopping %s" % service.name)
+    if announce:
+        announce("Stopping %s" % service.name)
+    output_path = _output_path(state_dir, service, "stop")
+    started_at = time.time()
     while True:
         (status, out) = _shell(service.stop_cmd, service.home,
-                               verbose and STREAM or BUFFER)
+                               verbose and STREAM or BUFFER,
+                               service.name, "stop_cmd", output_path)
         attempts = attempts + 1
 
         if status == 0:
             if verbose:
                 debug("Stop command succeeded")
         else:
-            error("Stop command failed")
-            if not verbose:
-                sys.stderr.write(out)
-                error(separator())
-            else:
-                # Output was already streamed
-                pass
-            return False
+            _record_op(state_dir, service, "stop", started_at, attempts,
+                       "failed")
+            return OpResult(service, "stop", OpResult.FAILED, False,
+                            time.time() - started_at, attempts, out)
 
         if not _is_running(service, verbose):
             if verbose:
                 debug("Status says %s is down" % service.name)
-            return True
+            _record_op(state_dir, service, "stop", started_at, attempts, "ok")
+            return OpResult(service, "stop", OpResult.STOPPED, True,
+                            time.time() - started_at, attempts)
 
         elif attempts > 10:
-            error(("Stop command succeeded, but status says %s " +
-                   "is still running. This is a bug in your ads.yml. " +
-                   "If you can reproduce this, try with -v to debug.")
-                  % service.name)
-            return False
+            _record_op(state_dir, service, "stop", started_at, attempts,
+                       "still running")
+            return OpResult(service, "stop", OpResult.STILL_RUNNING, False,
+                            time.time() - started_at, attempts)
 
         else:
             if verbose:
@@ -789,6 +3728,34 @@ def _down(service, verbose):
             time.sleep(0.5)
 
 
+def _down(service, verbose, state_dir=None, check_first=True):
+    result = _stop_service(service, verbose, state_dir, info, check_first)
+    if result.outcome == OpResult.NO_STATUS_CMD:
+        error("Status command not defined for " + service.name +
+              "; can't tell if it's already stopped")
+    elif result.outcome == OpResult.ALREADY_STOPPED:
+        info(service.name + " is already stopped")
+    elif result.outcome == OpResult.NO_STOP_CMD:
+        error("Stop command not defined for " + service.name)
+    elif result.outcome == OpResult.BUSY:
+        error("Gave up waiting for another ads to finish with " +
+              service.name)
+    elif result.outcome == OpResult.FAILED:
+        error("Stop command failed")
+        if not verbose:
+            sys.stderr.write(result.output)
+            error(separator())
+        else:
+            # Output was already streamed
+            pass
+    elif result.outcome == OpResult.STILL_RUNNING:
+        error(("Stop command succeeded, but status says %s " +
+               "is still running. This is a bug in your ads.yml. " +
+               "If you can reproduce this, try with -v to debug.")
+              % service.name)
+    return result.ok
+
+
 def _collect_rel_homes(services):
     return [s.resolve_home_relative_to_cwd() for s in services]
 
@@ -812,8 +3779,7 @@ def _resolve_selectors(ads, selectors, fail_if_empty):
         selectors = ["default"]
 
     try:
-        service_names = reduce(frozenset.__or__,
-                               [ads.resolve(s) for s in selectors])
+        service_names = ads.resolve_all(selectors)
     except BadSelectorException as e:
         raise NotFound(str(e))
 
@@ -829,9 +3795,10 @@ def _resolve_selectors(ads, selectors, fail_if_empty):
 
 
 def _collect_logs_nonempty(services, log_type):
-    all_logs = []
-    for s in services:
-        all_logs += s.resolve_logs_relative_to_cwd(log_type)
+    all_logs = [
+        log
+        for logs in _resolve_logs(services, log_type).values()
+        for log in logs]
 
     if len(all_logs) == 0:
         raise NotFound("No %s log files found for services %s" %
@@ -840,6 +3807,22 @@ def _collect_logs_nonempty(services, log_type):
     return all_logs
 
 
+def _collect_logs_since_start(project, services, log_type):
+    state_dir = _get_state_dir(project)
+    paths = []
+    offsets = {}
+    for (name, logs) in _resolve_logs(services, log_type).items():
+        record = _load_start_record(state_dir, project.services_by_name[name])
+        if record is None:
+            error("ads hasn't started %s yet, so its logs are skipped" % name)
+            continue
+        (service_paths, service_offsets) = _offsets_since_start(
+            record, _order_log_history(logs))
+        paths += service_paths
+        offsets.update(service_offsets)
+    return paths, offsets
+
+
 def list_func(args):
     parser = MyArgParser(prog=cmd_list.name, description=cmd_list.description)
     parser.parse_args(args)
@@ -847,18 +3830,80 @@ def list_func(args):
     ads.list()
 
 
+def _follow_and_restart(services, watched, verbose, state_dir, debounce):
+    """Follow services' logs, and restart watched ones as sources change.
+
+    Runs until ctrl+c, which leaves the services running.
+    """
+    logs = [f for files in _resolve_logs(services, "general").values()
+            for f in files]
+    if logs:
+        follower = threading.Thread(target=_tail, args=(logs,))
+        follower.daemon = True
+        follower.start()
+    by_name = dict((s.name, s) for s in watched)
+
+    def bounce(name):
+        service = by_name[name]
+        return (_down(service, verbose, state_dir) and
+                _up(service, verbose, state_dir))
+
+    def restart(names):
+        info("Sources changed; restarting " + ", ".join(names))
+        _parallel_map(bounce, names)
+
+    dir_watcher = _DirWatcher.create()
+    info("Watching the sources of %s; ctrl+c to stop" %
+         ", ".join(sorted(by_name)))
+    try:
+        _restart_on_changes(_SourceWatcher(watched, dir_watcher),
+                            _Debouncer(debounce), restart)
+    except KeyboardInterrupt:
+        # The usual way to stop; this also stops following the logs
+        _engine.cancel_all()
+    finally:
+        if dir_watcher:
+            dir_watcher.close()
+
+
 def up(args):
     parser = MyArgParser(prog=cmd_up.name, description=cmd_up.description)
     _add_verbose_arg(parser)
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Then, until ctrl+c, follow the services' logs and restart "
+             "any whose watch_paths change")
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="With --watch, how long changes must stop coming in before "
+             "restarting (default: 0.5)")
     _add_services_arg(parser)
     parsed_args = parser.parse_args(args)
+    if parsed_args.debounce < 0:
+        raise UsageError("--debounce can't be negative")
     ads = _load_or_die(use_cache=ALWAYS
                        if len(parsed_args.service) > 0
                        else WITH_PROFILE)
     services = _resolve_selectors(ads, parsed_args.service, True)
+    watched = [s for s in services if s.watch_paths]
+    if parsed_args.watch and not watched:
+        raise UsageError("None of those services have watch_paths to watch")
     if len(services) > 1:
         info("Starting " + str(services))
-    if not all(map(lambda sp: _up(sp, parsed_args.verbose), services)):
+    state_dir = _get_state_dir(ads.project)
+    ok = all(map(lambda sp: _up(sp, parsed_args.verbose, state_dir),
+                 services))
+    if parsed_args.watch:
+        if not ok:
+            warning("Services that failed to start will be tried again "
+                    "when their sources change")
+        _follow_and_restart(services, watched, parsed_args.verbose,
+                            state_dir, parsed_args.debounce)
+    elif not ok:
         raise StartFailed("One or more services failed to start")
 
 
@@ -871,27 +3916,124 @@ def down(args):
                        if len(parsed_args.service) > 0
                        else WITH_PROFILE)
     services = _resolve_selectors(ads, parsed_args.service, True)
-    if not all(map(lambda sp: _down(sp, parsed_args.verbose), services)):
+    state_dir = _get_state_dir(ads.project)
+    if not all(map(lambda sp: _down(sp, parsed_args.verbose, state_dir),
+                   services)):
+        raise StopFailed("One or more services failed to stop")
+
+
+def apply_plan(args):
+    parser = MyArgParser(prog=cmd_apply.name,
+                         description=cmd_apply.description)
+    _add_verbose_arg(parser)
+    parser.add_argument(
+        "plan",
+        help="YAML file listing the services or groups that should be 'up' "
+             "and those that should be 'down'")
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        metavar="N",
+        help="Check, start or stop at most N services at a time "
+             "(default: all at once)")
+    parser.add_argument(
+        "-n", "--dry-run",
+        action="store_true",
+        help="Only print what would be started and stopped")
+    parsed_args = parser.parse_args(args)
+    _check_jobs_arg(parsed_args)
+    plan = _load_plan(parsed_args.plan)
+    ads = _load_or_die(use_cache=ALWAYS)
+
+    states = OrderedDict()
+    for state in _PLAN_STATES:
+        if not plan[state]:
+            continue
+        for service in _resolve_selectors(ads, plan[state], True):
+            if states.get(service, state) != state:
+                raise UsageError("%s is both up and down in %s" %
+                                 (service.name, parsed_args.plan))
+            states[service] = state
+    wanted = states.items()
+
+    # One sweep tells us everything that needs doing
+    statuses = _parallel_map(lambda service: _check_status(service, False),
+                             states.keys(), parsed_args.jobs)
+    (to_stop, to_start, unchanged, unknown) = _plan_transitions(wanted,
+                                                                statuses)
+    for service in unknown:
+        error("Status command not defined for %s; can't tell if it needs "
+              "changing" % service.name)
+    info("To stop: %s; to start: %s; already as planned: %d" %
+         (to_stop, to_start, len(unchanged)))
+    if parsed_args.dry_run:
+        return
+
+    # Stop first, in case what's starting needs what they're holding
+    state_dir = _get_state_dir(ads.project)
+    stopped = _parallel_map(
+        lambda service: _down(service, parsed_args.verbose, state_dir,
+                              check_first=False),
+        to_stop, parsed_args.jobs)
+    started = _parallel_map(
+        lambda service: _up(service, parsed_args.verbose, state_dir,
+                            check_first=False),
+        to_start, parsed_args.jobs)
+    if not all(stopped) or any(states[s] == "down" for s in unknown):
         raise StopFailed("One or more services failed to stop")
+    if not all(started) or unknown:
+        raise StartFailed("One or more services failed to start")
 
 
 def bounce(args):
     parser = MyArgParser(prog=cmd_bounce.name,
                          description=cmd_bounce.description)
     _add_verbose_arg(parser)
+    rollout_gp = parser.add_mutually_exclusive_group()
+    rollout_gp.add_argument(
+        "--rolling",
+        action="store_true",
+        help="Restart one service at a time, and stop at the first "
+             "failure (by default every service restarts at once)")
+    rollout_gp.add_argument(
+        "--max-unavailable",
+        type=int,
+        metavar="N",
+        help="Like --rolling, but restart up to N services at a time")
     _add_services_arg(parser)
     parsed_args = parser.parse_args(args)
     ads = _load_or_die(use_cache=ALWAYS
                        if len(parsed_args.service) > 0
                        else WITH_PROFILE)
     services = _resolve_selectors(ads, parsed_args.service, True)
-    all_stopped = all(
-        map(lambda sp: _down(sp, parsed_args.verbose), services))
-    all_started = all(
-        map(lambda sp: _up(sp, parsed_args.verbose), services))
-    if not all_stopped:
+    state_dir = _get_state_dir(ads.project)
+    max_unavailable = parsed_args.rolling and 1 or parsed_args.max_unavailable
+    if max_unavailable is not None and max_unavailable < 1:
+        raise UsageError("--max-unavailable must be at least 1")
+
+    # A rollout stops at the first failure rather than breaking everything
+    halted = []
+
+    def bounce_one(service):
+        if halted:
+            return None
+        stopped = _down(service, parsed_args.verbose, state_dir)
+        started = _up(service, parsed_args.verbose, state_dir)
+        if max_unavailable and not (stopped and started):
+            halted.append(service.name)
+        return (stopped, started)
+
+    # The longest restarts should get going first
+    services = _slowest_first(services, state_dir)
+    results = _parallel_map(bounce_one, services, max_unavailable)
+    skipped = [s.name for (s, result) in zip(services, results)
+               if result is None]
+    if skipped:
+        error("Stopped the rollout after %s failed; didn't restart %s" %
+              (halted[0], ", ".join(skipped)))
+    if not all(result[0] for result in results if result):
         raise StopFailed("One or more services failed to stop")
-    if not all_started:
+    if not all(result[1] for result in results if result):
         raise StartFailed("One or more services failed to restart")
 
 
@@ -909,6 +4051,186 @@ def status(args):
         raise SomeDown()
 
 
+def watch(args):
+    parser = MyArgParser(prog=cmd_watch.name,
+                         description=cmd_watch.description)
+    parser.add_argument(
+        "--min-interval", type=float, default=1.0, metavar="SECONDS",
+        help="how soon to check again on a service that just changed "
+             "(default: 1)")
+    parser.add_argument(
+        "--max-interval", type=float, default=30.0, metavar="SECONDS",
+        help="how long a service that isn't changing can go unchecked "
+             "(default: 30)")
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    if not 0 < parsed_args.min_interval <= parsed_args.max_interval:
+        raise UsageError(
+            "--min-interval must be positive and at most --max-interval")
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    screen = _WatchScreen(sorted(s.name for s in services))
+    screen.open()
+    try:
+        _watch(services, parsed_args.min_interval, parsed_args.max_interval,
+               screen)
+    except KeyboardInterrupt:
+        # The usual way to stop watching
+        _engine.cancel_all()
+    finally:
+        screen.close()
+
+
+def top(args):
+    parser = MyArgParser(prog=cmd_top.name, description=cmd_top.description)
+    parser.add_argument(
+        "-s", "--sort", choices=_TOP_SORT_KEYS.keys(), default="cpu",
+        help="the column to sort by (default: cpu)")
+    parser.add_argument(
+        "-n", "--interval", type=float, default=2.0, metavar="SECONDS",
+        help="how often to refresh (default: 2)")
+    parser.add_argument(
+        "--once", action="store_true",
+        help="print one table, after one interval, and exit")
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.interval <= 0:
+        raise UsageError("--interval must be positive")
+    if not _HAS_PROC:
+        raise UsageError("ads top needs /proc (Linux)")
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    redraw = sys.stdout.isatty() and not parsed_args.once
+    before = _sample_procs()
+    sampled_at = time.time()
+    try:
+        while True:
+            time.sleep(parsed_args.interval)
+            after = _sample_procs()
+            now = time.time()
+            lines = _top_table(
+                _service_usage(before, after, now - sampled_at, services),
+                parsed_args.sort).format_lines()
+            if redraw:
+                sys.stdout.write("\033[H\033[2J")
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            if parsed_args.once:
+                return
+            (before, sampled_at) = (after, now)
+    except KeyboardInterrupt:
+        # The usual way to stop
+        pass
+
+
+def _sigchld_wakeup_fd():
+    """A fd that becomes readable whenever a child process exits."""
+    (r, w) = os.pipe()
+    for fd in (r, w):
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    # Don't interrupt the reads of the commands we run meanwhile
+    signal.siginterrupt(signal.SIGCHLD, False)
+    signal.set_wakeup_fd(w)
+    return r
+
+
+def supervise(args):
+    parser = MyArgParser(prog=cmd_supervise.name,
+                         description=cmd_supervise.description)
+    parser.add_argument(
+        "--backoff", type=float, default=1.0, metavar="SECONDS",
+        help="how long to wait before the first restart; it doubles with "
+             "every crash after that (default: 1)")
+    parser.add_argument(
+        "--max-backoff", type=float, default=60.0, metavar="SECONDS",
+        help="the longest to wait before a restart (default: 60)")
+    parser.add_argument(
+        "--max-restarts", type=int, default=5, metavar="N",
+        help="give up on a service after it crashes this many times in a "
+             "row (default: 5)")
+    parser.add_argument(
+        "--stable-after", type=float, default=60.0, metavar="SECONDS",
+        help="how long a service must stay up to count as healthy again "
+             "(default: 60)")
+    parser.add_argument(
+        "--poll-interval", type=float, default=30.0, metavar="SECONDS",
+        help="how often to run the status_cmd of services ads can't track "
+             "by process (default: 30)")
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    if min(parsed_args.backoff, parsed_args.poll_interval) <= 0:
+        raise UsageError("--backoff and --poll-interval must be positive")
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    if not (_become_subreaper() and _HAS_PROC):
+        warning("Can't adopt daemonized services on this system; services "
+                "will be checked with their status_cmd instead")
+
+    def make_policy():
+        return _RestartPolicy(parsed_args.backoff, parsed_args.max_backoff,
+                              parsed_args.max_restarts,
+                              parsed_args.stable_after)
+    supervisor = _Supervisor(services, _get_state_dir(ads.project),
+                             make_policy, parsed_args.poll_interval)
+    try:
+        supervisor.run(_sigchld_wakeup_fd())
+    except KeyboardInterrupt:
+        # The usual way to stop; the services keep running
+        return
+    raise StartFailed("Gave up on every service")
+
+
+def wait(args):
+    parser = MyArgParser(prog=cmd_wait.name, description=cmd_wait.description)
+    parser.add_argument(
+        "--for", dest="condition", choices=_WAIT_CONDITIONS.keys(),
+        default="up",
+        help="what to wait for; ready runs the service's ready_cmd if it "
+             "has one (default: up)")
+    parser.add_argument(
+        "-t", "--timeout", type=float, metavar="SECONDS",
+        help="give up after this long (default: wait forever)")
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    unknowable = [s.name for s in services if not s.status_cmd]
+    if unknowable:
+        raise UsageError("Status command not defined for " +
+                         ", ".join(unknowable))
+    deadline = (time.time() + parsed_args.timeout
+                if parsed_args.timeout is not None else None)
+    watcher = _DirWatcher.create()
+    try:
+        if watcher:
+            _watch_service_dirs(watcher, services)
+        reached = _wait_for(services, _WAIT_CONDITIONS[parsed_args.condition],
+                            deadline, watcher)
+    finally:
+        if watcher:
+            watcher.close()
+    for service in services:
+        if service.name in reached:
+            info("%s: %s after %.1fs" % (service.name, parsed_args.condition,
+                                         reached[service.name]))
+        else:
+            error("%s: not %s after %.1fs" % (service.name,
+                                              parsed_args.condition,
+                                              parsed_args.timeout))
+    if len(reached) < len(services):
+        raise WaitTimedOut()
+
+
 def logs(args):
     parser = MyArgParser(prog=cmd_logs.name, description=cmd_logs.description)
     sub_cmd_gp = parser.add_mutually_exclusive_group()
@@ -924,7 +4246,29 @@ def logs(args):
     sub_cmd_gp.add_argument(
         "--cat",
         action="store_true",
-        help="Dump the contents of all log files to stdout")
+        help="Dump the contents of all log files to stdout, oldest first, "
+             "including rotated and compressed (.gz, .bz2) versions")
+    sub_cmd_gp.add_argument(
+        "--index",
+        action="store_true",
+        help="Bring the search index for the logs up to date (only new "
+             "data is read)")
+    sub_cmd_gp.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="Print the log lines that contain every word in QUERY, using "
+             "the search index (which is updated first)")
+    sub_cmd_gp.add_argument(
+        "--stats",
+        action="store_true",
+        help="Count the lines matching each --pattern that each service "
+             "logged since the last --stats, and their rate")
+    sub_cmd_gp.add_argument(
+        "--bundle",
+        metavar="PATH",
+        help="Write a .tar.gz (- for stdout) of every general and error "
+             "log, ads.yml and current status of the services, for "
+             "attaching to bug reports")
     which_logs_gp = parser.add_mutually_exclusive_group()
     which_logs_gp.add_argument(
         "--general",
@@ -935,6 +4279,22 @@ def logs(args):
         "--errors",
         action="store_true",
         help="Show the error logs specified by the err_log_paths field")
+    parser.add_argument(
+        "--since",
+        metavar="WHEN",
+        help="Skip log files not modified since WHEN, which is a duration "
+             "like 30m, 2h or 3d, or a local time like '2016-01-02 15:04'")
+    parser.add_argument(
+        "--since-start",
+        action="store_true",
+        help="With --cat or --tail, only show what was logged since ads "
+             "last started each service")
+    parser.add_argument(
+        "--pattern",
+        action="append",
+        metavar="REGEX",
+        help="With --stats, a kind of line to count (repeatable; default: "
+             "%s)" % ", ".join(DEFAULT_STATS_PATTERNS))
     _add_services_arg(parser)
     parsed_args = parser.parse_args(args)
 
@@ -944,23 +4304,264 @@ def logs(args):
         # Default
         log_type = "general"
 
+    since = None
+    if parsed_args.since:
+        since = _parse_since(parsed_args.since)
+        if since is None:
+            raise UsageError("Can't understand --since '%s'" %
+                             parsed_args.since)
+
+    if parsed_args.pattern and not parsed_args.stats:
+        raise UsageError("--pattern only works with --stats")
+    if parsed_args.since_start and (parsed_args.list or parsed_args.index or
+                                    parsed_args.stats or parsed_args.bundle or
+                                    parsed_args.search is not None):
+        raise UsageError("--since-start only works with --cat and --tail")
+    if parsed_args.search is not None and not _tokenize(parsed_args.search):
+        raise UsageError("--search needs words of two or more letters "
+                         "or digits")
+
     ads = _load_or_die(use_cache=ALWAYS
                        if len(parsed_args.service) > 0
                        else WITH_PROFILE)
     services = _resolve_selectors(ads, parsed_args.service, False)
+    if parsed_args.bundle:
+        # Services without logs still have a status worth bundling
+        (num_files, num_bytes) = _write_bundle(parsed_args.bundle, services)
+        if parsed_args.bundle != "-":
+            info("Bundled %d log files (%s) from %d services into %s" %
+                 (num_files, _format_bytes(num_bytes), len(services),
+                  parsed_args.bundle))
+        return
     resolved_log_paths = _collect_logs_nonempty(services, log_type)
 
     if parsed_args.list:
+        if since is not None:
+            resolved_log_paths = _modified_since(resolved_log_paths, since)
         print("\n".join(resolved_log_paths))
     elif parsed_args.cat:
-        if not _cat(resolved_log_paths):
+        if parsed_args.since_start:
+            (history, offsets) = _collect_logs_since_start(
+                ads.project, services, log_type)
+        else:
+            (history, offsets) = (_order_log_history(resolved_log_paths), {})
+        if since is not None:
+            history = _modified_since(history, since)
+        if not _cat(history, offsets):
             raise InternalError("cat command failed")
+    elif parsed_args.index or parsed_args.search is not None:
+        history = _order_log_history(resolved_log_paths)
+        if since is not None:
+            history = _modified_since(history, since)
+        index = _open_log_index(ads.project)
+        try:
+            indexed = index.update(history)
+            if parsed_args.index:
+                info("Indexed %d new bytes in %d log files" %
+                     (indexed, len(history)))
+            else:
+                found = False
+                for (path, line) in index.search(parsed_args.search, history):
+                    found = True
+                    print("%s:%s" % (path, line))
+                if not found:
+                    raise NotFound("No log lines match '%s'" %
+                                   parsed_args.search)
+        finally:
+            index.close()
+    elif parsed_args.stats:
+        patterns = parsed_args.pattern or DEFAULT_STATS_PATTERNS
+        checkpoint_path = os.path.join(_get_state_dir(ads.project),
+                                       "log_stats_%s.json" % log_type)
+        checkpoint = _read_json(checkpoint_path)
+        (stats, new_checkpoint) = _update_log_stats(
+            checkpoint, _resolve_logs(services, log_type), patterns)
+        _write_json_atomically(checkpoint_path, new_checkpoint)
+        _print_log_stats(stats, patterns, checkpoint)
     else:
-        # Default
-        if not _tail(resolved_log_paths):
+        # Default. Rotated files never change, so only follow live ones.
+        live_log_paths = _live_logs(resolved_log_paths)
+        if len(live_log_paths) == 0:
+            raise NotFound("Only rotated %s log files found for services %s" %
+                           (log_type, str(services)))
+        if parsed_args.since_start:
+            # Catch up on the current run, then follow from exactly where
+            # that stopped; tail can't start several files at different
+            # offsets, and tail -n 0 would miss what came in between
+            ends = {}
+            (history, offsets) = _collect_logs_since_start(
+                ads.project, services, log_type)
+            if not _cat(history, offsets, ends):
+                raise InternalError("cat command failed")
+            _follow(live_log_paths, ends)
+        elif not _tail(live_log_paths):
             raise InternalError("tail command failed")
 
 
+def stats(args):
+    parser = MyArgParser(prog=cmd_stats.name,
+                         description=cmd_stats.description)
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    history = _open_history(_get_state_dir(ads.project))
+    try:
+        if not _print_history(history, services):
+            raise NotFound("ads hasn't started or stopped %s yet" %
+                           ", ".join(s.name for s in services))
+    finally:
+        history.close()
+
+
+def _exec_in(service, cmd_str, prefix_lines):
+    """Run cmd_str in service's home; returns (status, seconds)."""
+    started_at = time.time()
+    buffered = []
+
+    def on_line(line):
+        if not line.endswith("\n"):
+            line += "\n"
+        if prefix_lines:
+            with _output_lock:
+                sys.stdout.write("[%s] %s" % (service.name, line))
+                sys.stdout.flush()
+        else:
+            buffered.append(line)
+
+    with _span("exec", service=service.name, cmd=cmd_str):
+        status = _shell_lines(cmd_str, service.home, on_line, service.name)
+    if status < 0:
+        # Killed by a signal; report it the way shells do
+        status = 128 - status
+    if not prefix_lines:
+        # All of one service's output together, as soon as it's done
+        with _output_lock:
+            (status == 0 and info or warning)(
+                "%s (exit status %d)" % (service.name, status))
+            sys.stdout.write("".join(buffered))
+            sys.stdout.flush()
+    return (status, time.time() - started_at)
+
+
+def _add_jobs_args(parser):
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        metavar="N",
+        help="Run in at most N services at a time (default: all at once)")
+    parser.add_argument(
+        "--prefix",
+        action="store_true",
+        help="Print output as it comes, each line prefixed with the "
+             "service name, instead of each service's output in one piece")
+
+
+def _check_jobs_arg(parsed_args):
+    if parsed_args.jobs is not None and parsed_args.jobs < 1:
+        raise UsageError("--jobs must be at least 1")
+
+
+def _report_runs(services, results):
+    """Print a summary of (status, seconds) per service, failures first.
+
+    A status of None means the run was skipped as up to date.
+    """
+    rows = sorted(zip(services, results),
+                  key=lambda row: row[1][0] in (0, None))
+    table = Table(["service", "result", "time"])
+    for (s, (status, seconds)) in rows:
+        table.with_row([s.name,
+                        status is None and "up to date" or
+                        status == 0 and "ok" or "exit %d" % status,
+                        "%.1fs" % seconds])
+    print("")
+    table.pretty_print()
+
+    failed = [(s, status) for (s, (status, _)) in zip(services, results)
+              if status not in (0, None)]
+    if failed:
+        # The exit status of the first service that failed
+        raise ExecFailed(failed[0][1],
+                         "Failed in %d of %d services: %s" %
+                         (len(failed), len(services),
+                          ", ".join(s.name for (s, _) in failed)))
+
+
+def exec_func(args):
+    parser = MyArgParser(
+        prog=cmd_exec.name,
+        description=cmd_exec.description,
+        usage="%s [-h] [--jobs N] [--prefix] [service ...] -- command" %
+              cmd_exec.name)
+    _add_jobs_args(parser)
+    _add_services_arg(parser)
+    split = args.index("--") if "--" in args else len(args)
+    parsed_args = parser.parse_args(args[:split])
+    if split == len(args):
+        raise UsageError("Put the command to run after '--', like "
+                         "'ads exec backend -- make test'")
+    cmd_words = args[split + 1:]
+    if not cmd_words:
+        raise UsageError("No command given after '--'")
+    _check_jobs_arg(parsed_args)
+    # Like ssh, so a quoted pipeline works as well as plain words
+    cmd_str = " ".join(cmd_words)
+
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = _resolve_selectors(ads, parsed_args.service, True)
+    results = _parallel_map(
+        lambda s: _exec_in(s, cmd_str, parsed_args.prefix),
+        services, parsed_args.jobs)
+    _report_runs(services, results)
+
+
+def run(args):
+    parser = MyArgParser(prog=cmd_run.name, description=cmd_run.description)
+    parser.add_argument(
+        "task",
+        help="The name of the task, from the tasks field of ads.yml")
+    parser.add_argument(
+        "--force", "-f",
+        action="store_true",
+        help="Run even where the task's inputs haven't changed")
+    _add_jobs_args(parser)
+    _add_services_arg(parser)
+    parsed_args = parser.parse_args(args)
+    _check_jobs_arg(parsed_args)
+    ads = _load_or_die(use_cache=ALWAYS
+                       if len(parsed_args.service) > 0
+                       else WITH_PROFILE)
+    services = [s for s in _resolve_selectors(ads, parsed_args.service, True)
+                if parsed_args.task in s.tasks]
+    if not services:
+        raise NotFound("None of the services define a '%s' task" %
+                       parsed_args.task)
+    state_dir = _get_state_dir(ads.project)
+
+    def run_task(service):
+        task = service.tasks[parsed_args.task]
+        started_at = time.time()
+        (record, files) = _load_task_record(state_dir, service, task)
+        with _span("hash inputs", service=service.name, task=task.name):
+            (digest, files) = _hash_task_inputs(task, service.home, files)
+        if (not parsed_args.force and digest is not None and
+                record.get("digest") == digest):
+            info("%s: %s is up to date" % (service.name, task.name))
+            return (None, time.time() - started_at)
+        (status, _) = _exec_in(service, task.cmd, parsed_args.prefix)
+        if status == 0:
+            _save_task_record(state_dir, service, task, digest, files)
+        return (status, time.time() - started_at)
+
+    _report_runs(services, _parallel_map(run_task, services,
+                                         parsed_args.jobs))
+
+
 def home(args):
     parser = MyArgParser(prog=cmd_home.name, description=cmd_home.description)
     _add_services_arg(parser)
@@ -1004,7 +4605,7 @@ cmd_list = Cmd(
 cmd_up = Cmd(
     "up", up,
     "Ensure the specified services are running", True,
-    ["start", "run"])
+    ["start"])
 cmd_down = Cmd(
     "down", down,
     "Ensure the specified services are not running", True,
@@ -1012,21 +4613,47 @@ cmd_down = Cmd(
 cmd_status = Cmd(
     "status", status,
     "Print status of the specified services", True)
+cmd_watch = Cmd(
+    "watch", watch,
+    "Keep showing the status of the specified services as it changes")
+cmd_top = Cmd(
+    "top", top,
+    "Show the CPU, memory and I/O used by the specified services")
+cmd_supervise = Cmd(
+    "supervise", supervise,
+    "Start the specified services and restart them whenever they crash")
+cmd_wait = Cmd(
+    "wait", wait,
+    "Wait until the specified services are up, down or ready")
 cmd_logs = Cmd(
     "logs", logs,
     "Tail the logs of the specified services", True)
+cmd_apply = Cmd(
+    "apply", apply_plan,
+    "Bring services up and down as listed in a plan file")
 cmd_bounce = Cmd(
     "bounce", bounce,
     "Stop and restart the specified services", False,
     ["restart"])
+cmd_stats = Cmd(
+    "stats", stats,
+    "Show how long the specified services take to start and stop")
+cmd_run = Cmd(
+    "run", run,
+    "Run a task from the specified services' ads.yml, unless its inputs "
+    "are unchanged")
+cmd_exec = Cmd(
+    "exec", exec_func,
+    "Run a command in each of the specified services' home directories")
 cmd_home = Cmd(
     "home", home,
     "Print paths to the specified services' home directories")
 cmd_edit = Cmd(
     "edit", edit,
     "Edit a service's ads.yml")
-all_cmds = [cmd_help, cmd_list, cmd_up, cmd_down, cmd_status, cmd_logs,
-            cmd_bounce, cmd_home, cmd_edit]
+all_cmds = [cmd_help, cmd_list, cmd_up, cmd_down, cmd_status, cmd_wait,
+            cmd_watch, cmd_top, cmd_supervise, cmd_logs, cmd_apply,
+            cmd_bounce, cmd_stats, cmd_run, cmd_exec, cmd_home, cmd_edit]
 
 cmds_by_alias = dict([
     (name, cmd)
@@ -1034,6 +4661,55 @@ cmds_by_alias = dict([
     for name in ([cmd.name] + cmd.aliases)])
 
 
+##############################################
+# Python API
+##############################################
+
+class Controller:
+    """Drives the services of one ads project from Python.
+
+    The project is loaded once and reused by every call. Each method takes
+    selectors just like the command line (none means the default) and
+    returns an OpResult per service rather than printing or raising:
+
+        ctl = Controller.load("/path/to/codebase")
+        if not all(r.ok for r in ctl.up("backend")):
+            ...
+
+    Timings are recorded for `ads stats` just as when using the CLI.
+    Bad selectors raise BadSelectorException.
+    """
+
+    @classmethod
+    def load(cls, root_dir=os.curdir, profile_dir=None, use_cache=True):
+        ads = Ads.load_from_fs(root_dir, profile_dir or _get_profile_home(),
+                               use_cache)
+        if not ads:
+            raise NotFound("%s is not in an ads project" %
+                           os.path.abspath(root_dir))
+        return Controller(ads)
+
+    def __init__(self, ads):
+        self.ads = ads
+        self.state_dir = _get_state_dir(ads.project)
+
+    def services(self, *selectors):
+        names = self.ads.resolve_all(list(selectors) or ["default"])
+        return [self.ads.project.services_by_name[name]
+                for name in sorted(names)]
+
+    def up(self, *selectors):
+        return [_start_service(s, False, self.state_dir)
+                for s in self.services(*selectors)]
+
+    def down(self, *selectors):
+        return [_stop_service(s, False, self.state_dir)
+                for s in self.services(*selectors)]
+
+    def status(self, *selectors):
+        return [_check_status(s, False) for s in self.services(*selectors)]
+
+
 ##############################################
 # main
 ##############################################
@@ -1057,6 +4733,9 @@ Some less common commands:
 %s
 
 See 'ads help <command>' to read about a specific subcommand.
+
+Add --timings to any command to see where its time went, or set
+ADS_TRACE=trace.json to save a trace for chrome://tracing or Perfetto.
 """ % (format_help_for_cmds(filter(lambda cmd: cmd.is_common, all_cmds)),
        format_help_for_cmds(filter(lambda cmd: not cmd.is_common, all_cmds)))
     usage = "ads [-h] <command> [args] [service [service ...]]"
@@ -1095,9 +4774,23 @@ def help(args):
 cmds_by_alias["help"].func = help
 
 
+def _pop_timings_flag(argv):
+    """Remove --timings from argv (but not from a command after --)."""
+    end = argv.index("--") if "--" in argv else len(argv)
+    if "--timings" not in argv[:end]:
+        return (argv, False)
+    return ([a for a in argv[:end] if a != "--timings"] + argv[end:], True)
+
+
 def main():
-    cmd_args = sys.argv[1:2]
-    subcmd_args = sys.argv[2:]
+    global _tracer
+    (argv, print_timings) = _pop_timings_flag(sys.argv[1:])
+    trace_path = os.getenv("ADS_TRACE")
+    if print_timings or trace_path:
+        _tracer = _Tracer()
+
+    cmd_args = argv[0:1]
+    subcmd_args = argv[1:]
 
     args = main_parser.parse_args(cmd_args)
     if args.command == "help" and len(subcmd_args) == 0:
@@ -1105,6 +4798,17 @@ def main():
         return
 
     try:
-        cmds_by_alias[args.command].func(subcmd_args)
+        with _span("ads " + args.command):
+            cmds_by_alias[args.command].func(subcmd_args)
     except AdsCommandException as e:
         fail(e.exit_code, e.msg)
+    except KeyboardInterrupt:
+        # Commands may be running on other threads
+        _engine.cancel_all()
+        fail(130)
+    finally:
+        if print_timings:
+            # stderr, so that output meant for pipes stays clean
+            sys.stderr.write("\n".join(_tracer.summary_lines()) + "\n")
+        if trace_path:
+            _tracer.write_chrome_trace(trace_path)
@@ -44,6 +44,148 @@ test_bounce() {
     assert_not_equal "$old_service_pid" "$new_service_pid"
 }
 
+test_rolling_bounce() {
+    go_test_project one-trivial-service
+
+    assert_ok "ads up service"
+    local old_service_pid="$(pgrep -f service.sh)"
+
+    assert_ok "ads bounce --rolling service" "Stopping" "Starting"
+    assert_not_equal "$old_service_pid" "$(pgrep -f service.sh)"
+
+    assert_ok "ads bounce --max-unavailable 2 service" "Starting"
+    assert_fails "ads bounce --max-unavailable 0 service" "at least 1"
+
+    go_test_project all-commands-fail
+    assert_fails "ads bounce --rolling" "failed to stop"
+}
+
+test_run_tasks() {
+    go_test_project one-trivial-service
+    cat >> service/ads.yml << EOF
+
+tasks:
+    build:
+        cmd: cat src/*.c > build.out && echo building
+        inputs:
+        - src/*.c
+    lint: echo linting
+EOF
+    mkdir service/src
+    echo "int x;" > service/src/main.c
+
+    assert_ok "ads run build" "building"
+    assert_equal "$(cat service/build.out)" "int x;"
+
+    # Same inputs: skipped
+    assert_ok "ads run build" "up to date"
+    assert_not_contains "$(ads run build)" "building"
+    assert_ok "ads run --force build" "building"
+    assert_ok "ads run -f build" "building"
+
+    # Changed inputs: runs again
+    echo "int y;" >> service/src/main.c
+    assert_ok "ads run build" "building"
+
+    # No inputs: always runs
+    assert_ok "ads run lint" "linting"
+    assert_ok "ads run lint" "linting"
+
+    assert_fails "ads run deploy" "define a 'deploy' task"
+}
+
+test_stats() {
+    go_test_project one-trivial-service
+
+    assert_fails "ads stats" "hasn't started or stopped"
+    ads up
+    ads down
+    ads up
+    assert_ok "ads stats" "p50" "start" "stop"
+    assert_contains "$(ads stats | grep start)" " 2 "
+}
+
+test_top() {
+    go_test_project one-trivial-service
+
+    local procs='NR > 1 && $1 == "service" { print $2 }'
+    assert_equal "$(ads top --once -n 0.1 | awk "$procs")" 0
+    ads up
+    assert_equal "$(ads top --once -n 0.1 --sort mem | awk "$procs")" 2
+}
+
+test_supervise() {
+    go_test_project one-trivial-service
+
+    ads supervise --backoff 0.1 &> supervise.log &
+    local supervisor=$!
+    sleep 1
+    assert_ok "ads status"
+    pgrep -f "bash service.sh" | xargs kill -9
+    sleep 1.5
+    assert_ok "ads status"
+    kill $supervisor
+    wait $supervisor || true
+    assert_contains "$(cat supervise.log)" "service is down; restarting it"
+    assert_contains "$(ads stats)" "restart"
+}
+
+test_wait() {
+    go_test_project one-trivial-service
+
+    assert_fails "ads wait --timeout 0.3" "service: not up after 0.3s"
+    assert_ok "ads wait --for down" "service: down after"
+    (sleep 0.5; ads up > /dev/null) &
+    assert_ok "ads wait --for ready --timeout 10" "service: ready after"
+}
+
+test_apply() {
+    go_test_project one-trivial-service
+
+    echo "up: [service]" > up.yml
+    echo "down: service" > down.yml
+    assert_ok "ads apply up.yml" "to start: [service]" "Starting service"
+    assert_ok "ads status"
+    assert_ok "ads apply up.yml" "already as planned: 1"
+    assert_ok "ads apply --dry-run down.yml" "To stop: [service]"
+    assert_ok "ads status"
+    assert_ok "ads apply down.yml" "Stopping service"
+    assert_fails "ads status"
+}
+
+test_up_concurrently() {
+    go_test_project one-trivial-service
+
+    ads up > up1.out &
+    local first=$!
+    ads up > up2.out &
+    wait $first $!
+    assert_equal "$(cat up1.out up2.out | grep -c 'Starting service')" 1
+    assert_equal "$(pgrep -f 'bash service.sh' | wc -l)" 1
+}
+
+test_up_watch() {
+    go_test_project one-trivial-service
+    echo "watch_paths: [src/*.txt]" >> service/ads.yml
+    mkdir service/src
+
+    # With job control, so that ads gets the SIGINT
+    set -m
+    ads up --watch --debounce 0.2 &> watch.log &
+    local watcher=$!
+    set +m
+    sleep 1
+    assert_ok "ads status"
+    touch service/src/a.txt service/src/b.txt service/src/c.log
+    sleep 2
+    kill -INT $watcher
+    wait $watcher
+    assert_equal "$(grep -c 'restarting service' watch.log)" 1
+    assert_contains "$(cat watch.log)" "some output from the service"
+    assert_ok "ads status"
+    assert_contains "$(ads stats | grep start)" " 2 "
+}
+
 test_up_verbose() {
     go_test_project one-trivial-service
     assert_not_contains "$(ads up)" 'Checking if' 'bash service.sh'
@@ -13,14 +13,21 @@ test_cmd_helps() {
     assert_ok 'ads help list' 'Print the list of available service'
     assert_ok 'ads help up' 'Ensure the specified services are running'
     assert_ok 'ads help down' 'Ensure the specified services are not running'
+    assert_ok 'ads help apply' 'Bring services up and down as listed in'
     assert_ok 'ads help bounce' 'Stop and restart the specified services'
     assert_ok 'ads help status' 'Print status of the specified services'
+    assert_ok 'ads help wait' 'Wait until the specified services are up'
+    assert_ok 'ads help watch' 'Keep showing the status of the specified'
+    assert_ok 'ads help top' 'Show the CPU, memory and I/O used by'
+    assert_ok 'ads help supervise' 'Start the specified services and restart'
     assert_ok 'ads help logs' 'Tail the logs of the specified services'
+    assert_ok 'ads help stats' 'Show how long the specified services take'
+    assert_ok 'ads help run' 'Run a task from the specified services'
+    assert_ok 'ads help exec' 'Run a command in each of the specified'
     assert_ok 'ads help home' 'Print paths to the specified services'
     assert_ok 'ads help edit' 'Edit a service'
 
     assert_equal "$(ads help start)" "$(ads help up)"
-    assert_equal "$(ads help run)" "$(ads help up)"
     assert_equal "$(ads help stop)" "$(ads help down)"
     assert_equal "$(ads help kill)" "$(ads help down)"
     assert_equal "$(ads help restart)" "$(ads help bounce)"
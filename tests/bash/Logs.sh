@@ -62,16 +62,133 @@ test_cat_logs() {
     ads up service
     sleep 1
 
-    # ads logs cat actually prints the cat command
-    assert_contains \
-        "$(ads logs --cat service)" \
-        "cat service/logs/stdout service/logs/stderr"
+    local cat_output="$(ads logs --cat service)"
+    assert_contains "$cat_output" \
+        "some output from the service" \
+        "some errors from the service"
+
+    # Only the file contents go to stdout
+    assert_not_contains "$cat_output" "cat service/logs/stdout"
 
-    # cat args are cwd-relative
+    # Works from anywhere in the project
     cd service/logs
     assert_contains \
         "$(ads logs --cat service)" \
-        "cat stdout stderr"
+        "some output from the service"
+}
+
+test_cat_logs_to_file() {
+    go_test_project one-trivial-service
+
+    ads up service
+    sleep 1
+    ads down service
+
+    # Redirecting to a file gives exactly the concatenated logs
+    ads logs --cat service > "$project_tmp/cat_output"
+    assert_equal \
+        "$(cat "$project_tmp/cat_output")" \
+        "$(cat service/logs/stdout service/logs/stderr)"
+}
+
+test_cat_rotated_logs() {
+    go_test_project one-trivial-service
+
+    mkdir -p service/logs
+    echo "oldest" | gzip > service/logs/stdout.2.gz
+    echo "older" > service/logs/stdout.1
+    echo "newest" > service/logs/stdout
+
+    # Rotated siblings are found, decompressed and ordered oldest first
+    assert_equal "$(ads logs --cat service)" "oldest
+older
+newest"
+
+    # tail only follows the live file
+    ads logs service > "$project_tmp/tail_output" &
+    local pid="$!"
+    sleep 1
+    kill -9 "$pid"
+    assert_not_contains "$(cat "$project_tmp/tail_output")" "stdout.1"
+}
+
+test_search_logs() {
+    go_test_project one-trivial-service
+
+    echo "all quiet" > service/logs/stdout
+    echo "disk is on fire" > service/logs/stderr
+
+    assert_ok "ads logs --index" "Indexed"
+    assert_ok "ads logs --search fire" "service/logs/stderr:disk is on fire"
+    assert_fails "ads logs --search water" "No log lines match"
+
+    # Search catches up with new output by itself
+    echo "now the network is on fire too" >> service/logs/stdout
+    assert_ok "ads logs --search fire" \
+        "service/logs/stdout:now the network is on fire too" \
+        "service/logs/stderr:disk is on fire"
+}
+
+test_cat_since_start() {
+    go_test_project one-trivial-service
+
+    echo "from the last run" > service/logs/stdout
+    echo "old errors" > service/logs/stderr
+    assert_ok "ads logs --cat --since-start"
+    assert_contains "$(ads logs --cat --since-start 2>&1)" \
+        "hasn't started service"
+
+    ads up service
+    sleep 1
+
+    local since_start="$(ads logs --cat --since-start)"
+    assert_contains "$since_start" "some output from the service"
+    assert_not_contains "$since_start" "from the last run" "old errors"
+
+    # Following picks up right where catching up stopped
+    ads logs --since-start service > "$project_tmp/follow_output" &
+    local pid="$!"
+    sleep 1
+    echo "written while following" >> service/logs/stdout
+    sleep 1
+    kill -9 "$pid"
+    local followed="$(cat "$project_tmp/follow_output")"
+    assert_contains "$followed" \
+        "some output from the service" "written while following"
+    assert_not_contains "$followed" "from the last run"
+
+    assert_fails "ads logs --list --since-start" "only works with"
+}
+
+test_log_stats() {
+    go_test_project one-trivial-service
+
+    printf "ERROR a\nWARN b\nERROR c\n" > service/logs/stdout
+    touch service/logs/stderr
+
+    assert_ok "ads logs --stats" "first look" "service" "ERROR" "WARN"
+    printf "ERROR d\n" >> service/logs/stdout
+    local stats="$(ads logs --stats --pattern ERROR)"
+    assert_contains "$stats" "ERROR/min" "8B"
+    assert_not_contains "$stats" "WARN"
+}
+
+test_log_bundle() {
+    go_test_project one-trivial-service
+
+    echo "some output" > service/logs/stdout
+    echo "some errors" > service/logs/stderr
+
+    assert_ok "ads logs --bundle $project_tmp/incident.tar.gz" "Bundled 3"
+    local listing="$(tar tzf "$project_tmp/incident.tar.gz")"
+    assert_contains "$listing" \
+        "incident/service/ads.yml" \
+        "incident/service/status.txt" \
+        "incident/service/logs/stdout" \
+        "incident/service/logs/stderr"
+    assert_equal \
+        "$(tar xzOf "$project_tmp/incident.tar.gz" incident/service/logs/stderr)" \
+        "some errors"
 }
 
 test_logs_commands_when_logs_missing() {
@@ -84,10 +201,10 @@ test_logs_commands_when_logs_missing() {
 test_logs_commands_when_some_logs_missing() {
     go_test_project interesting-hierarchy
 
-    touch burger/burger.log
+    echo "hold the pickles" > burger/burger.log
 
     assert_ok "ads logs --list" "burger.log"
-    assert_ok "ads logs --cat" "burger.log"
+    assert_ok "ads logs --cat" "hold the pickles"
 }
 
 test_general_vs_error_logs() {
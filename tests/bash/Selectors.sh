@@ -28,6 +28,96 @@ EOF
         "europe: ireland"
 }
 
+test_selector_expressions() {
+    go_test_project interesting-selectors
+    set_ads_profile << EOF
+groups:
+    english-speaking:
+    - all
+    - -canada
+    - canada&north-america
+EOF
+
+    local status="$(ads status all -america)"
+    assert_contains "$status" "canada" "ireland"
+    assert_not_contains "$status" "america:"
+
+    local status="$(ads status north-america -canada)"
+    assert_contains "$status" "america"
+    assert_not_contains "$status" "canada" "ireland"
+
+    local status="$(ads status 'north-america&canada')"
+    assert_contains "$status" "canada"
+    assert_not_contains "$status" "america:" "ireland"
+
+    assert_ok "ads status english-speaking" "america" "ireland"
+    assert_fails "ads status north-america&" "Malformed selector"
+}
+
+test_exclusions_that_look_like_options() {
+    go_test_project interesting-selectors
+    set_ads_profile << EOF
+groups:
+    verbose-ones:
+    - america
+    jenkins:
+    - canada
+    flaky:
+    - ireland
+EOF
+    for service in america canada ireland; do
+        printf '\ntasks:\n    greet: echo greeting %s\n' $service \
+            >> $service/ads.yml
+    done
+
+    local status="$(ads status all -verbose-ones)"
+    assert_contains "$status" "canada" "ireland"
+    assert_not_contains "$status" "america:"
+
+    local output="$(ads exec all -jenkins -- 'echo in $(basename $PWD)')"
+    assert_contains "$output" "in america" "in ireland"
+    assert_not_contains "$output" "in canada"
+
+    local output="$(ads run greet all -flaky)"
+    assert_contains "$output" "greeting america" "greeting canada"
+    assert_not_contains "$output" "greeting ireland"
+
+    # Real short options still work, values attached or not
+    local output="$(ads run -f -j1 greet all -flaky -jenkins)"
+    assert_contains "$output" "greeting america"
+    assert_not_contains "$output" "greeting canada" "greeting ireland"
+}
+
+test_apply_conflicts() {
+    go_test_project interesting-selectors
+
+    printf "up: [north-america]\ndown: [america]\n" > plan.yml
+    assert_fails "ads apply plan.yml" "america is both up and down"
+}
+
+test_exec() {
+    go_test_project interesting-selectors
+
+    local output="$(ads exec north-america -- 'echo in $(basename $PWD)')"
+    assert_contains "$output" "in america" "in canada" "ok"
+    assert_not_contains "$output" "in ireland"
+
+    assert_ok "ads exec --prefix ireland -- echo hello" "[ireland] hello"
+
+    # -j and exclusions before '--' are for ads, the rest for the command
+    local output="$(ads exec -j1 --prefix all -canada -- echo -j4 -canada)"
+    assert_contains "$output" "[america] -j4 -canada" "[ireland] -j4 -canada"
+    assert_not_contains "$output" "[canada]"
+
+    assert_fails "ads exec all -- false" "Failed in 3 of 3 services"
+    set +o errexit
+    ads exec all -- exit 4
+    assert_equal "$?" "4"
+    set -o errexit
+
+    assert_fails "ads exec all" "after '--'"
+}
+
 test_default_selector_is_all_when_none_defined() {
     go_test_project one-trivial-service
 
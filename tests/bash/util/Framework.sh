@@ -20,7 +20,7 @@ copy_project_to_tmp_and_go() {
     if [[ "$(ls "$project_dir")" ]]; then
         cp -R "$project_dir"/* "$project_tmp"
     fi
-    project_cache="$project_tmp/../.ads_cache.yml"
+    project_cache="$project_tmp/../.ads_cache.json"
     if [ -f $project_cache ]; then
         rm "$project_cache"
     fi
@@ -42,7 +42,7 @@ set_ads_profile() {
 # Temporarily sets your ads cache to the value of stdin
 set_ads_cache() {
     export ADS_CACHE_HOME="$test_tmp"
-    cat > "$test_tmp/.ads_cache.yml"
+    cat > "$test_tmp/.ads_cache.json"
 }
 
 ###############################################################################
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import patch
+from ads import Controller, OpResult, BadSelectorException
+
+
+class TestController(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write("adsroot.yml", "default: all")
+        self.add_service("db", "")
+        self.add_service("web", "")
+        self.add_service("broken", "exit 3")
+        patcher = patch.dict(os.environ, {"ADS_STATE_HOME": self.root})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ctl = Controller.load(self.root, self.root, use_cache=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, rel, text):
+        with open(os.path.join(self.root, rel), "w") as f:
+            f.write(text)
+
+    def add_service(self, name, start_suffix):
+        os.mkdir(os.path.join(self.root, name))
+        self.write(name + "/ads.yml",
+                   "start_cmd: touch running; echo oops; %s\n"
+                   "stop_cmd: rm running\n"
+                   "status_cmd: test -f running\n" % start_suffix)
+
+    def outcomes(self, results):
+        return [(r.service.name, r.outcome, r.ok) for r in results]
+
+    def test_up_down_status(self):
+        with patch("sys.stdout", StringIO()) as out:
+            self.assertEqual(self.outcomes(self.ctl.up("web")),
+                             [("web", OpResult.STARTED, True)])
+            self.assertEqual(
+                self.outcomes(self.ctl.up("db", "web")),
+                [("db", OpResult.STARTED, True),
+                 ("web", OpResult.ALREADY_RUNNING, True)])
+            self.assertEqual(
+                self.outcomes(self.ctl.status("-broken")),
+                [("db", OpResult.RUNNING, True),
+                 ("web", OpResult.RUNNING, True)])
+            self.assertEqual(
+                self.outcomes(self.ctl.down("web")),
+                [("web", OpResult.STOPPED, True)])
+            self.assertEqual(
+                self.outcomes(self.ctl.status("web")),
+                [("web", OpResult.NOT_RUNNING, False)])
+        self.assertEqual(out.getvalue(), "")
+
+    def test_failure_output(self):
+        [result] = self.ctl.up("broken")
+        self.assertEqual((result.outcome, result.ok),
+                         (OpResult.FAILED, False))
+        self.assertIn("oops", result.output)
+
+    def test_bad_selector(self):
+        self.assertRaises(BadSelectorException, self.ctl.up, "nope")
+
+
+if __name__ == '__main__':
+    unittest.main()
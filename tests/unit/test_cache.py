@@ -1,37 +1,43 @@
 import sys
 import os
+import json
+import shutil
+import tempfile
 import unittest
-from mock import patch, mock_open
+from mock import patch
 from ads import Service, ServiceSet, Cache, _load_spec_file
 
-class MockDevice():
-    """MockDevice to suppress stdout"""
-
-    @classmethod 
-    def flush(s): pass
-    
-    def write(self, s): pass
-
 class TestCache(unittest.TestCase):
 
     def setUp(self):
-        self.cachefile = ".ads_cache.yml"
+        self.profile_dir = tempfile.mkdtemp()
+        self.cachefile = os.path.join(self.profile_dir, ".ads_cache.json")
         self.project_file = "/adsroot/adsroot.yml"
-        self.profile_dir = "/profile"
         self.service_sets = [ServiceSet("service1", ["service1"]),
                         ServiceSet("service1", ["service2"])]
-        self.map = {"adsroot": self.project_file,
-                    "service1": "/adsroot/service1/ads.yml",
+        self.map = {"service1": "/adsroot/service1/ads.yml",
                     "service2": "/adsroot/service2/ads.yml"}
-        self.read_data = "adsroot: /adsroot/adsroot.yml\n"\
-                       + "service1: /adsroot/service1/ads.yml\n"\
-                       + "service2: /adsroot/service2/ads.yml\n"
+        self.env = patch.dict(os.environ)
+        self.env.start()
+        os.environ.pop("ADS_CACHE_HOME", None)
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.profile_dir)
+
+    def write_cache(self, projects):
+        with open(self.cachefile, "w") as f:
+            json.dump({"projects": projects}, f)
+
+    def write_project(self, project_file=None, used_at=None):
+        self.write_cache({project_file or self.project_file: {
+            "services": self.map, "used_at": used_at or 1e12}})
 
     def test_get_cache_path(self):
         default_home = "/default"
         self.assertEqual(
             Cache.get_cache_path(default_home),
-            "%s/.ads_cache.yml" % (default_home)
+            "%s/.ads_cache.json" % (default_home)
         )
 
     def test_get_cache_path_with_env_var(self):
@@ -40,62 +46,106 @@ class TestCache(unittest.TestCase):
         os.environ["ADS_CACHE_HOME"] = cache_home
         self.assertEqual(
             Cache.get_cache_path(default_home),
-            "%s/.ads_cache.yml" % (cache_home)
+            "%s/.ads_cache.json" % (cache_home)
         )
 
     def test_load_from_cache_no_cachefile(self):
-        with patch('os.path.isfile', return_value=False):
-            self.assertEqual(
-                Cache.load_from_cache(self.cachefile,
-                                      self.project_file,
-                                      self.profile_dir), {}
-            )
-    
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  self.project_file,
+                                  self.profile_dir), {}
+        )
+
     def test_load_from_cache_cachefile(self):
-        with patch("os.path.isfile", return_value=True):
-            with patch("ads.ads.open", mock_open(read_data=self.read_data), create=True):
-                with patch("ads.ads._load_spec_file", return_value=self.map):
-                  self.assertEqual(
-                      Cache.load_from_cache(self.cachefile,
-                                            self.project_file,
-                                            self.profile_dir), self.map
-                  )
+        self.write_project()
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  self.project_file,
+                                  self.profile_dir), self.map
+        )
+
+    def test_load_from_cache_other_project(self):
+        self.write_project("/elsewhere/adsroot.yml")
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  self.project_file,
+                                  self.profile_dir), {}
+        )
+
+    def test_load_from_corrupt_cachefile(self):
+        with open(self.cachefile, "w") as f:
+            f.write("adsroot: /adsroot/adsroot.yml\n")
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  self.project_file,
+                                  self.profile_dir), {}
+        )
 
     def test_get_isinstance_of_service(self):
-        with patch("os.path.isfile", return_value=True):
-            with patch("ads.ads.open", mock_open(read_data=self.read_data), create=True):
-                with patch("ads.ads._load_spec_file", return_value=self.map):
-                    cache = Cache(self.project_file, self.profile_dir)
-                    value = cache.get(Service("service2", self.map.get("service2")))
-                    self.assertEqual(value, "/adsroot/service2/ads.yml")
+        self.write_project()
+        cache = Cache(self.project_file, self.profile_dir)
+        value = cache.get(Service("service2", self.map.get("service2")))
+        self.assertEqual(value, "/adsroot/service2/ads.yml")
 
     def test_get_is_string(self):
-        with patch("os.path.isfile", return_value=True):
-            with patch("ads.ads.open", mock_open(read_data=self.read_data), create=True):
-                with patch("ads.ads._load_spec_file", return_value=self.map):
-                    cache = Cache(self.project_file, self.profile_dir)
-                    value = cache.get("service2")
-                    self.assertEqual(value, "/adsroot/service2/ads.yml")
+        self.write_project()
+        cache = Cache(self.project_file, self.profile_dir)
+        value = cache.get("service2")
+        self.assertEqual(value, "/adsroot/service2/ads.yml")
 
     def test_valid_groups_true(self):
+        self.write_project()
         with patch("os.path.isfile", return_value=True):
-            with patch("ads.ads.open", mock_open(read_data=self.read_data), create=True):
-                with patch("ads.ads._load_spec_file", return_value=self.map):
-                    cache = Cache(self.project_file, self.profile_dir)
-                    self.assertEqual(cache.valid_groups(self.service_sets), True)
+            cache = Cache(self.project_file, self.profile_dir)
+            self.assertEqual(cache.valid_groups(self.service_sets), True)
+
+    def test_valid_groups_looks_inside_expressions(self):
+        self.write_project()
+        with patch("os.path.isfile", return_value=True):
+            cache = Cache(self.project_file, self.profile_dir)
+            self.assertEqual(
+                cache.valid_groups([ServiceSet("g", ["-service1",
+                                                     "service1&service2"])]),
+                True)
 
     def test_write_to_cache(self):
-        with patch("os.path.isfile", return_value=False):
-            with patch("ads.ads._load_spec_file", return_value={}):
-                cache = Cache(self.project_file, self.profile_dir)
-                m_open = mock_open(read_data=self.read_data)
-                with patch("ads.ads.open", m_open, create=True):
-                    cache.write_to_cache(self.project_file, 
-                        {"random-service": "/random-service/ads.yml"}
-                    )
-                    self.assertEqual(cache.get("random-service"), "/random-service/ads.yml")
-                    file_desc = m_open()
-                    self.assertTrue(file_desc.write.called)
-                      
+        cache = Cache(self.project_file, self.profile_dir)
+        cache.write_to_cache(self.project_file,
+            {"random-service": "/random-service/ads.yml"}
+        )
+        self.assertEqual(cache.get("random-service"), "/random-service/ads.yml")
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  self.project_file,
+                                  self.profile_dir),
+            {"random-service": "/random-service/ads.yml"})
+
+    def test_write_keeps_other_projects(self):
+        self.write_project("/elsewhere/adsroot.yml")
+        cache = Cache(self.project_file, self.profile_dir)
+        cache.write_to_cache(self.project_file, {"mine": "/mine/ads.yml"})
+        self.assertEqual(
+            Cache.load_from_cache(self.cachefile,
+                                  "/elsewhere/adsroot.yml",
+                                  self.profile_dir), self.map)
+
+    def test_least_recently_used_projects_evicted(self):
+        self.write_cache(dict(
+            ("/p%d/adsroot.yml" % i, {"services": {}, "used_at": 100 + i})
+            for i in range(3)))
+        with patch("ads.ads.CACHE_MAX_PROJECTS", 3):
+            cache = Cache(self.project_file, self.profile_dir)
+            cache.write_to_cache(self.project_file, self.map)
+        self.assertEqual(
+            sorted(Cache.read_projects(self.cachefile)),
+            ["/adsroot/adsroot.yml", "/p1/adsroot.yml", "/p2/adsroot.yml"])
+
+    def test_stale_entry_touched_on_load(self):
+        self.write_project(used_at=1)
+        Cache(self.project_file, self.profile_dir)
+        entry = Cache.read_projects(self.cachefile)[self.project_file]
+        self.assertTrue(entry["used_at"] > 1)
+        self.assertEqual(entry["services"], self.map)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import time
+import threading
+import unittest
+from mock import patch
+from ads.ads import _parallel_map, bounce, Ads, Project, Service
+from ads.ads import StartFailed
+
+
+class TestParallelMap(unittest.TestCase):
+
+    def test_results_in_order(self):
+        def slow_for_small(n):
+            time.sleep(0.01 * (5 - n))
+            return n * n
+        self.assertEqual(_parallel_map(slow_for_small, range(5)),
+                         [0, 1, 4, 9, 16])
+
+    def test_max_workers(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def track(_):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        _parallel_map(track, range(6), max_workers=2)
+        self.assertEqual(running[1], 2)
+
+    def test_first_exception_reraised(self):
+        def fail_on_two(n):
+            if n == 2:
+                raise ValueError("two")
+            return n
+        self.assertRaisesRegexp(ValueError, "two",
+                                _parallel_map, fail_on_two, range(4))
+
+    def test_no_items(self):
+        self.assertEqual(_parallel_map(lambda x: x, []), [])
+
+
+class TestBounce(unittest.TestCase):
+
+    def setUp(self):
+        self.services = [Service(name, "/" + name) for name in "abcd"]
+        self.ads = Ads(Project("test", "/test", self.services))
+        self.bounced = []
+        for patcher in [
+                patch("ads.ads._load_or_die", return_value=self.ads),
+                patch("ads.ads._get_state_dir", return_value="/state"),
+                patch("ads.ads._slowest_first", lambda services, _: services),
+                patch("ads.ads._down", return_value=True),
+                patch("ads.ads.error")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def up(self, service, verbose, state_dir):
+        self.bounced.append(service.name)
+        return service.name != "b"
+
+    def test_rolling_stops_at_first_failure(self):
+        with patch("ads.ads._up", self.up):
+            self.assertRaises(StartFailed, bounce, ["--rolling", "all"])
+        self.assertEqual(self.bounced, ["a", "b"])
+
+    def test_pipelined_bounces_everything(self):
+        with patch("ads.ads._up", self.up):
+            self.assertRaises(StartFailed, bounce, ["all"])
+        self.assertEqual(sorted(self.bounced), ["a", "b", "c", "d"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch
+from ads.ads import _CommandEngine, _parallel_map
+
+
+class TestCommandEngine(unittest.TestCase):
+
+    def group_alive(self, pgid):
+        # SIGKILL reaches the rest of the group asynchronously
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            try:
+                os.killpg(pgid, 0)
+            except OSError:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_status_and_lines(self):
+        engine = _CommandEngine(4, 1)
+        lines = []
+        self.assertEqual(engine.run(["sh", "-c", "echo a; echo b; exit 3"],
+                                    "/", on_line=lines.append), 3)
+        self.assertEqual(lines, ["a\n", "b\n"])
+
+    def test_one_at_a_time_per_service(self):
+        engine = _CommandEngine(4, 1)
+        started = time.time()
+        _parallel_map(lambda _: engine.run(["sleep", "0.2"], "/", "svc"),
+                      range(3))
+        self.assertGreaterEqual(time.time() - started, 0.6)
+
+    def pgid_of_command(self):
+        with tempfile.TemporaryFile() as out:
+            _CommandEngine(4, 1).run(
+                ["sh", "-c", "ps -o pgid= -p $$; echo $$"], "/", stdout=out)
+            out.seek(0)
+            return [int(word) for word in out.read().split()]
+
+    def test_own_group_unless_terminal(self):
+        with patch("ads.ads._stdin_is_tty", return_value=False):
+            (pgid, pid) = self.pgid_of_command()
+            self.assertEqual(pgid, pid)
+        # Or it would be stopped as soon as it read from the terminal
+        with patch("ads.ads._stdin_is_tty", return_value=True):
+            (pgid, _) = self.pgid_of_command()
+            self.assertEqual(pgid, os.getpgrp())
+
+    @patch("ads.ads._stdin_is_tty", return_value=False)
+    def test_cancel_all_kills_process_group(self, _):
+        engine = _CommandEngine(4, 1)
+        result = []
+
+        def run():
+            try:
+                # The shell ignores SIGINT, so it takes a SIGKILL
+                engine.run(["sh", "-c", "trap '' INT; sleep 30"], "/")
+            except KeyboardInterrupt:
+                result.append("interrupted")
+        thread = threading.Thread(target=run)
+        thread.start()
+        while not engine.running:
+            time.sleep(0.01)
+        pid = list(engine.running)[0].pid
+        engine.cancel_all(grace=0.1)
+        thread.join(5)
+        self.assertEqual(result, ["interrupted"])
+        self.assertFalse(self.group_alive(pid))
+        self.assertRaises(KeyboardInterrupt, engine.run, ["true"], "/")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ads.ads import History, Service, _percentile, _slowest_first
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.history = History(os.path.join(self.tmp, "history.db"))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.tmp)
+
+    def test_percentiles(self):
+        values = range(1, 101)
+        self.assertEqual(_percentile(values, 50), 50)
+        self.assertEqual(_percentile(values, 99), 99)
+        self.assertEqual(_percentile(values, 100), 100)
+        self.assertEqual(_percentile([7], 90), 7)
+
+    def test_ops_grouped_and_sorted(self):
+        self.history.record("svc", "start", 3.0, 1, "ok")
+        self.history.record("svc", "start", 1.0, 1, "failed")
+        self.history.record("svc", "stop", 2.0, 3, "ok")
+        self.history.record("other", "start", 9.0, 1, "ok")
+        self.assertEqual(self.history.ops("svc"),
+                         [("start", [1.0, 3.0], [1, 1], 1),
+                          ("stop", [2.0], [3], 0)])
+
+    def test_slowest_first(self):
+        self.history.record("quick", "start", 1.0, 1, "ok")
+        self.history.record("slow", "start", 5.0, 1, "ok")
+        # Failures don't count towards how long a start takes
+        self.history.record("quick", "start", 60.0, 1, "failed")
+        self.history.close()
+        services = [Service("quick", "/q"), Service("slow", "/s"),
+                    Service("new", "/n")]
+        self.assertEqual([s.name for s in _slowest_first(services, self.tmp)],
+                         ["new", "slow", "quick"])
+        self.history = History(os.path.join(self.tmp, "history.db"))
+
+
+if __name__ == '__main__':
+    unittest.main()
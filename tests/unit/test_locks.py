@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch
+from ads.ads import OpResult, Service, _FileLock, _start_service
+
+
+class TestServiceLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.service = Service("svc", "/svc", start_cmd="start",
+                               status_cmd="status")
+        self.lock_path = os.path.join(self.state_dir, "locks", "svc.lock")
+        self.running = False
+        for patcher in [
+                patch("ads.ads._is_running", lambda s, v: self.running),
+                patch("ads.ads._shell", return_value=(0, "")),
+                patch("ads.ads._record_start"),
+                patch("ads.ads._record_op")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def hold_lock(self, seconds):
+        """Hold the service's lock, as another ads would, for a while."""
+        locked = threading.Event()
+
+        def hold():
+            with _FileLock(self.lock_path):
+                locked.set()
+                time.sleep(seconds)
+                # The other ads started it meanwhile
+                self.running = True
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+        return thread
+
+    def test_fail_fast(self):
+        thread = self.hold_lock(0.2)
+        with patch.dict(os.environ, {"ADS_LOCK_TIMEOUT": "0"}):
+            result = _start_service(self.service, False, self.state_dir)
+        thread.join()
+        self.assertEqual(result.outcome, OpResult.BUSY)
+
+    def test_wait_then_recheck(self):
+        announced = []
+        thread = self.hold_lock(0.2)
+        result = _start_service(self.service, False, self.state_dir,
+                                announced.append, check_first=False)
+        thread.join()
+        self.assertEqual(announced, ["Waiting for another ads to finish "
+                                     "with svc"])
+        self.assertEqual(result.outcome, OpResult.ALREADY_RUNNING)
+
+    def test_uncontended(self):
+        result = _start_service(self.service, False, self.state_dir)
+        self.assertEqual(result.outcome, OpResult.STARTED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ads.ads import LogIndex
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmp, "app.log")
+        self.index = LogIndex(os.path.join(self.tmp, "index.db"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp)
+
+    def append(self, text):
+        with open(self.log, "a") as f:
+            f.write(text)
+
+    def search(self, query):
+        return [line for (_, line) in self.index.search(query, [self.log])]
+
+    def test_lines_must_contain_every_word(self):
+        self.append("ERROR disk full\nWARN disk slow\nERROR net down\n")
+        self.index.update([self.log])
+        self.assertEqual(self.search("error"),
+                         ["ERROR disk full", "ERROR net down"])
+        self.assertEqual(self.search("Disk ERROR"), ["ERROR disk full"])
+        self.assertEqual(self.search("missing"), [])
+
+    def test_only_new_data_is_indexed(self):
+        self.append("first line\npartial")
+        self.assertEqual(self.index.update([self.log]), len("first line\n"))
+        self.append(" line\nsecond line\n")
+        self.assertEqual(self.index.update([self.log]),
+                         len("partial line\nsecond line\n"))
+        self.assertEqual(self.index.update([self.log]), 0)
+        self.assertEqual(self.search("line"),
+                         ["first line", "partial line", "second line"])
+
+    def test_truncated_file_is_reindexed(self):
+        self.append("old stuff\nmore old stuff\n")
+        self.index.update([self.log])
+        with open(self.log, "w") as f:
+            f.write("new stuff\n")
+        self.index.update([self.log])
+        self.assertEqual(self.search("stuff"), ["new stuff"])
+
+    def test_rotation_keeps_what_was_indexed(self):
+        self.append("first generation\n")
+        self.index.update([self.log])
+        for generation in ["second", "third"]:
+            if os.path.exists(self.log + ".1"):
+                os.rename(self.log + ".1", self.log + ".2")
+            os.rename(self.log, self.log + ".1")
+            self.append(generation + " generation\n")
+            history = [self.log + ".2", self.log + ".1", self.log]
+            # Only the new file is read
+            self.assertEqual(
+                self.index.update([p for p in history if os.path.exists(p)]),
+                len(generation + " generation\n"))
+        self.assertEqual(
+            [(os.path.basename(path), line) for (path, line)
+             in self.index.search("generation", history)],
+            [("app.log.2", "first generation"),
+             ("app.log.1", "second generation"),
+             ("app.log", "third generation")])
+
+    def test_replaced_file_is_reindexed(self):
+        self.append("old stuff\n")
+        self.index.update([self.log])
+        os.rename(self.log, self.log + ".gone")
+        self.append("new stuff\n")
+        os.remove(self.log + ".gone")
+        self.index.update([self.log])
+        self.assertEqual(self.search("stuff"), ["new stuff"])
+
+    def test_rewritten_file_is_reindexed(self):
+        # Same inode and no shorter, like a new file that got the inode
+        # of a deleted one
+        self.append("old stuff\n")
+        self.index.update([self.log])
+        with open(self.log, "w") as f:
+            f.write("new stuff, and more of it\n")
+        self.index.update([self.log])
+        self.assertEqual(self.search("stuff"), ["new stuff, and more of it"])
+        self.assertEqual(self.search("old"), [])
+
+    def test_deleted_files_are_forgotten(self):
+        self.append("first generation\n")
+        self.index.update([self.log])
+        os.rename(self.log, self.log + ".1")
+        self.append("second generation\n")
+        self.index.update([self.log + ".1", self.log])
+        os.remove(self.log + ".1")
+        self.index.update([self.log])
+        self.assertEqual(
+            self.index.db.execute("SELECT path FROM files").fetchall(),
+            [(self.log,)])
+        self.assertEqual(
+            self.index.db.execute(
+                "SELECT COUNT(*) FROM postings WHERE token = 'first'"
+            ).fetchone(),
+            (0,))
+
+    def test_search_limited_to_given_paths(self):
+        self.append("needle\n")
+        self.index.update([self.log])
+        self.assertEqual(list(self.index.search("needle", [])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
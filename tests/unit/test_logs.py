@@ -0,0 +1,468 @@
+import os
+import bz2
+import gzip
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+from mock import patch
+from ads.ads import _order_log_history, _live_logs, _parse_since, _dump_files
+from ads.ads import _glob_files, _walk_globs, _offsets_since_start
+from ads.ads import _update_log_stats, _write_bundle, _ReadAheadFile
+from ads.ads import _Follower
+from ads.ads import Service
+
+
+class TestLogHistory(unittest.TestCase):
+
+    def test_rotated_logs_ordered_oldest_to_newest(self):
+        self.assertEqual(
+            _order_log_history(["logs/app.log",
+                                "logs/app.log.1",
+                                "logs/app.log.10.gz",
+                                "logs/app.log.2.gz"],
+                               include_siblings=False),
+            ["logs/app.log.10.gz",
+             "logs/app.log.2.gz",
+             "logs/app.log.1",
+             "logs/app.log"])
+
+    def test_dated_logs_ordered_by_date(self):
+        self.assertEqual(
+            _order_log_history(["app.log",
+                                "app.log-20160103.gz",
+                                "app.log-20160101.bz2"],
+                               include_siblings=False),
+            ["app.log-20160101.bz2",
+             "app.log-20160103.gz",
+             "app.log"])
+
+    def test_families_keep_first_appearance_order(self):
+        self.assertEqual(
+            _order_log_history(["b.log", "a.log.1", "a.log", "b.log.1"],
+                               include_siblings=False),
+            ["b.log.1", "b.log", "a.log.1", "a.log"])
+
+    def test_siblings_found_next_to_live_logs(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for name in ["app.log", "app.log.1", "app.log.2.gz", "other.1"]:
+                open(os.path.join(tmp, name), "w").close()
+            app_log = os.path.join(tmp, "app.log")
+            self.assertEqual(
+                _order_log_history([app_log]),
+                [app_log + ".2.gz", app_log + ".1", app_log])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_live_logs(self):
+        self.assertEqual(
+            _live_logs(["app.log", "app.log.1", "app.log.2.gz", "out"]),
+            ["app.log", "out"])
+
+
+class TestSince(unittest.TestCase):
+
+    def test_durations(self):
+        self.assertEqual(_parse_since("90s", now=1000), 910)
+        self.assertEqual(_parse_since("2h", now=10000), 2800)
+        self.assertEqual(_parse_since("1d", now=100000), 13600)
+
+    def test_dates(self):
+        self.assertTrue(_parse_since("2016-01-02") <
+                        _parse_since("2016-01-02 15:04"))
+
+    def test_garbage(self):
+        self.assertEqual(_parse_since("yesterday-ish"), None)
+
+
+class TestDumpFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def dump(self, paths):
+        with open(self.path("out"), "wb") as out:
+            ok = _dump_files(paths, out.fileno())
+        return ok, open(self.path("out"), "rb").read()
+
+    def test_plain_and_compressed(self):
+        with open(self.path("app.log"), "wb") as f:
+            f.write(b"live\n")
+        g = gzip.open(self.path("app.log.1.gz"), "wb")
+        g.write(b"gzipped\n")
+        g.close()
+        b = bz2.BZ2File(self.path("app.log.2.bz2"), "wb")
+        b.write(b"bzipped\n")
+        b.close()
+
+        self.assertEqual(
+            self.dump([self.path("app.log.2.bz2"),
+                       self.path("app.log.1.gz"),
+                       self.path("app.log")]),
+            (True, b"bzipped\ngzipped\nlive\n"))
+
+    def test_concatenated_gzip_members(self):
+        for name, text in [("a.gz", b"first\n"), ("b.gz", b"second\n")]:
+            g = gzip.open(self.path(name), "wb")
+            g.write(text)
+            g.close()
+        with open(self.path("both.gz"), "wb") as f:
+            f.write(open(self.path("a.gz"), "rb").read())
+            f.write(open(self.path("b.gz"), "rb").read())
+
+        self.assertEqual(self.dump([self.path("both.gz")]),
+                         (True, b"first\nsecond\n"))
+
+    def test_missing_file_is_reported_but_others_still_dumped(self):
+        with open(self.path("there"), "wb") as f:
+            f.write(b"here\n")
+        with patch("ads.ads.error") as error:
+            ok, output = self.dump([self.path("not-there"),
+                                    self.path("there")])
+        self.assertFalse(ok)
+        self.assertTrue(error.called)
+        self.assertEqual(output, b"here\n")
+
+    def test_ends_recorded(self):
+        with open(self.path("app.log"), "wb") as f:
+            f.write(b"skipped\nshown\n")
+        g = gzip.open(self.path("app.log.1.gz"), "wb")
+        g.write(b"gzipped\n")
+        g.close()
+        paths = [self.path("app.log.1.gz"), self.path("app.log")]
+        ends = {}
+        with open(self.path("out"), "wb") as out:
+            _dump_files(paths, out.fileno(), {self.path("app.log"): 8}, ends)
+        self.assertEqual(ends, {self.path("app.log"): 14})
+
+
+class TestFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.out = open(os.path.join(self.tmp, "out"), "w+b")
+
+    def tearDown(self):
+        self.out.close()
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text, mode="a"):
+        path = os.path.join(self.tmp, name)
+        with open(path, mode) as f:
+            f.write(text)
+        return path
+
+    def output(self):
+        self.out.seek(0)
+        text = self.out.read()
+        self.out.seek(0)
+        self.out.truncate()
+        return text
+
+    def test_starts_at_offsets(self):
+        log = self.write("app.log", "seen\nwritten meanwhile\n")
+        other = self.write("other.log", "before\n")
+        follower = _Follower([log], {log: len("seen\n")}, self.out.fileno())
+        follower.poll()
+        self.assertEqual(self.output(), "written meanwhile\n")
+        self.write("app.log", "later\n")
+        follower.poll()
+        self.assertEqual(self.output(), "later\n")
+        follower.close()
+
+        # No offset: only what comes next
+        follower = _Follower([other], {}, self.out.fileno())
+        follower.poll()
+        self.write("other.log", "after\n")
+        follower.poll()
+        self.assertEqual(self.output(), "after\n")
+        follower.close()
+
+    def test_rotation(self):
+        log = self.write("app.log", "old\n")
+        follower = _Follower([log], {log: 0}, self.out.fileno())
+        follower.poll()
+        self.write("app.log", "end of old\n")
+        os.rename(log, log + ".1")
+        follower.poll()
+        self.write("app.log", "new\n")
+        follower.poll()
+        self.assertEqual(self.output(), "old\nend of old\nnew\n")
+        follower.close()
+
+    def test_headers_for_several_files(self):
+        a = self.write("a.log", "")
+        b = self.write("b.log", "")
+        follower = _Follower([a, b], {a: 0, b: 0}, self.out.fileno())
+        self.write("a.log", "from a\n")
+        self.write("b.log", "from b\n")
+        follower.poll()
+        self.assertEqual(self.output(),
+                         "==> %s <==\nfrom a\n\n==> %s <==\nfrom b\n" %
+                         (a, b))
+        follower.close()
+
+
+class TestOffsetsSinceStart(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text, mode="w"):
+        path = os.path.join(self.tmp, name)
+        with open(path, mode) as f:
+            f.write(text)
+        return path
+
+    def record(self, paths, started_at):
+        files = {}
+        for path in paths:
+            st = os.stat(path)
+            files[path] = [st.st_dev, st.st_ino, st.st_size]
+        return {"started_at": started_at, "files": files}
+
+    def test_reads_from_recorded_offset(self):
+        log = self.write("app.log", "before\n")
+        record = self.record([log], 0)
+        self.write("app.log", "after\n", "a")
+        self.assertEqual(_offsets_since_start(record, [log]),
+                         ([log], {log: len("before\n")}))
+
+    def test_follows_inode_across_rotation(self):
+        old = self.write("app.log.1", "ancient\n")
+        log = self.write("app.log", "before\n")
+        record = self.record([old, log], 0)
+        os.rename(log, log + ".0")
+        rotated = log + ".0"
+        os.rename(old, log + ".2")
+        fresh = self.write("app.log", "after rotation\n")
+        self.assertEqual(
+            _offsets_since_start(record, [log + ".2", rotated, fresh]),
+            ([rotated, fresh], {rotated: len("before\n"), fresh: 0}))
+
+    def test_truncated_or_unknown_files_read_from_start(self):
+        log = self.write("app.log", "a long line before start\n")
+        record = self.record([log], 0)
+        self.write("app.log", "short\n")
+        new = self.write("new.log", "created after start\n")
+        self.assertEqual(_offsets_since_start(record, [log, new]),
+                         ([log, new], {log: 0, new: 0}))
+
+    def test_unknown_files_older_than_start_skipped(self):
+        old = self.write("old.log", "stale\n")
+        record = {"started_at": os.path.getmtime(old) + 10, "files": {}}
+        self.assertEqual(_offsets_since_start(record, [old]), ([], {}))
+
+
+class TestLogStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmp, "app.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def append(self, text, path=None):
+        with open(path or self.log, "a") as f:
+            f.write(text)
+
+    def stats(self, checkpoint):
+        (stats, checkpoint) = _update_log_stats(
+            checkpoint, {"svc": [self.log]}, ["ERROR", "WARN"])
+        return stats["svc"], checkpoint
+
+    def test_counts_lines_not_hits(self):
+        self.append("ERROR ERROR\nWARN\nINFO\nERROR and WARN\n")
+        ((new_bytes, counts), _) = self.stats(None)
+        self.assertEqual(counts, [2, 2])
+        self.assertEqual(new_bytes, os.path.getsize(self.log))
+
+    def test_only_new_complete_lines_counted(self):
+        self.append("ERROR one\nERROR two")
+        ((_, counts), checkpoint) = self.stats(None)
+        self.assertEqual(counts, [1, 0])
+        self.append(" finished\nWARN three\n")
+        ((_, counts), checkpoint) = self.stats(checkpoint)
+        self.assertEqual(counts, [1, 1])
+        ((new_bytes, counts), _) = self.stats(checkpoint)
+        self.assertEqual((new_bytes, counts), (0, [0, 0]))
+
+    def test_rotated_file_finished_off(self):
+        self.append("ERROR before\n")
+        (_, checkpoint) = self.stats(None)
+        self.append("ERROR after, before rotation\n")
+        os.rename(self.log, self.log + ".1")
+        self.append("WARN new file\n")
+        ((_, counts), _) = self.stats(checkpoint)
+        self.assertEqual(counts, [1, 1])
+
+    def test_services_looked_at_separately(self):
+        other = os.path.join(self.tmp, "other.log")
+        self.append("ERROR a\n")
+        self.append("ERROR b\n", other)
+
+        def stats_of(name, checkpoint):
+            logs = {"a": [self.log], "b": [other]}
+            (stats, checkpoint) = _update_log_stats(
+                checkpoint, {name: logs[name]}, ["ERROR"])
+            return stats[name][1], checkpoint
+
+        (counts, checkpoint) = stats_of("a", None)
+        self.assertEqual(counts, [1])
+        (counts, checkpoint) = stats_of("b", checkpoint)
+        self.assertEqual(counts, [1])
+        self.append("ERROR a again\n")
+        (counts, checkpoint) = stats_of("b", checkpoint)
+        self.assertEqual(counts, [0])
+        (counts, checkpoint) = stats_of("a", checkpoint)
+        self.assertEqual(counts, [1])
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = os.path.realpath(tempfile.mkdtemp())
+        self.home = os.path.join(self.tmp, "svc")
+        os.makedirs(os.path.join(self.home, "logs"))
+        with open(os.path.join(self.home, "ads.yml"), "w") as f:
+            f.write("status_cmd: echo fine\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_log(self, name, text):
+        with open(os.path.join(self.home, "logs", name), "w") as f:
+            f.write(text)
+
+    def test_bundle_contents(self):
+        self.write_log("out", "x" * 3000000)
+        self.write_log("out.1", "older\n")
+        self.write_log("err", "oops\n")
+        svc = Service("svc", self.home, status_cmd="echo fine",
+                      log_paths=["logs/out"], err_log_paths=["logs/err"])
+        bundle = os.path.join(self.tmp, "incident.tar.gz")
+        self.assertEqual(_write_bundle(bundle, [svc]), (3, 3000000 + 11))
+
+        tar = tarfile.open(bundle)
+        self.assertEqual(tar.getnames(),
+                         ["incident/svc/ads.yml",
+                          "incident/svc/status.txt",
+                          "incident/svc/logs/out.1",
+                          "incident/svc/logs/out",
+                          "incident/svc/logs/err"])
+        self.assertIn("fine", tar.extractfile("incident/svc/status.txt").read())
+        self.assertEqual(tar.extractfile("incident/svc/logs/out").read(),
+                         "x" * 3000000)
+
+    def test_bundle_to_stdout(self):
+        self.write_log("out", "hi\n")
+        svc = Service("svc", self.home, log_paths=["logs/out"])
+        bundle = os.path.join(self.tmp, "stdout.tar.gz")
+        with open(bundle, "wb") as out:
+            with patch("sys.stdout", out):
+                _write_bundle("-", [svc])
+        self.assertEqual(tarfile.open(bundle).getnames(),
+                         ["ads-bundle/svc/ads.yml",
+                          "ads-bundle/svc/status.txt",
+                          "ads-bundle/svc/logs/out"])
+
+    def test_symlinked_log_bundled_as_file(self):
+        self.write_log("real", "through a link\n")
+        os.symlink("real", os.path.join(self.home, "logs", "out"))
+        svc = Service("svc", self.home, log_paths=["logs/out"])
+        bundle = os.path.join(self.tmp, "linked.tar.gz")
+        _write_bundle(bundle, [svc])
+        tar = tarfile.open(bundle)
+        member = tar.getmember("linked/svc/logs/out")
+        self.assertTrue(member.isreg())
+        self.assertEqual(tar.extractfile(member).read(), "through a link\n")
+
+    def test_shrunk_file_padded_to_stat_size(self):
+        self.write_log("out", "short\n")
+        done = threading.Semaphore(0)
+        f = _ReadAheadFile(os.path.join(self.home, "logs", "out"), 10, done)
+        self.assertEqual(f.read(4), "shor")
+        self.assertEqual(f.read(100), "t\n\0\0\0\0")
+        self.assertEqual(f.errors, ["4 bytes missing"])
+        f.close()
+        self.assertTrue(done.acquire(False))
+
+
+class TestGlobFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = os.path.realpath(tempfile.mkdtemp())
+        for rel in ["a/logs/out.log",
+                    "a/logs/old/out.log",
+                    "a/logs/old/older/out.log",
+                    "a/logs/.hidden.log",
+                    "a/src/main.py",
+                    "b/logs/out.log"]:
+            path = self.path(rel)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, rel):
+        return os.path.join(self.tmp, rel)
+
+    def glob(self, pattern):
+        return _glob_files([self.path(pattern)])[self.path(pattern)]
+
+    def test_star_stays_within_one_dir(self):
+        self.assertEqual(self.glob("a/logs/*"), [self.path("a/logs/out.log")])
+
+    def test_globstar_matches_zero_or_more_dirs(self):
+        self.assertEqual(
+            self.glob("a/logs/**/out.log"),
+            [self.path("a/logs/old/older/out.log"),
+             self.path("a/logs/old/out.log"),
+             self.path("a/logs/out.log")])
+
+    def test_wildcard_dirs(self):
+        self.assertEqual(
+            self.glob("*/logs/out.log"),
+            [self.path("a/logs/out.log"), self.path("b/logs/out.log")])
+
+    def test_hidden_files_need_explicit_dot(self):
+        self.assertEqual(self.glob("a/logs/.*"),
+                         [self.path("a/logs/.hidden.log")])
+        self.assertNotIn(self.path("a/logs/.hidden.log"),
+                         self.glob("a/**"))
+
+    def test_literal_paths(self):
+        self.assertEqual(self.glob("a/logs/out.log"),
+                         [self.path("a/logs/out.log")])
+        self.assertEqual(self.glob("a/logs/nope.log"), [])
+        # Only files count as logs
+        self.assertEqual(self.glob("a/logs"), [])
+
+    def test_nested_bases_share_a_walk(self):
+        patterns = [self.path("a/logs/*.log"), self.path("a/**/main.py"),
+                    self.path("nonexistent/*")]
+        with patch("ads.ads._walk_globs", wraps=_walk_globs) as walk:
+            result = _glob_files(patterns)
+        self.assertEqual([c[0][0] for c in walk.call_args_list],
+                         [self.path("a")])
+        self.assertEqual(result[patterns[0]], [self.path("a/logs/out.log")])
+        self.assertEqual(result[patterns[1]], [self.path("a/src/main.py")])
+        self.assertEqual(result[patterns[2]], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
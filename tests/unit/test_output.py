@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ads.ads import BUFFER, Service, _output_path, _shell
+
+# 2000 lines of 100 bytes each (99 digits and a newline)
+CHATTY = "for i in $(seq 1 2000); do printf '%099d\\n' $i; done"
+
+
+class TestBufferedOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_short_output_is_all_there(self):
+        (status, out) = _shell("echo hi; exit 3", self.dir, BUFFER)
+        self.assertEqual(status, 3)
+        self.assertEqual(out.splitlines()[-1], "hi")
+        self.assertIn("cd " + self.dir, out)
+
+    @patch.dict(os.environ, {"ADS_OUTPUT_TAIL_KB": "1"})
+    def test_long_output_keeps_the_tail(self):
+        (status, out) = _shell(CHATTY, self.dir, BUFFER)
+        self.assertEqual(status, 0)
+        lines = out.splitlines()
+        self.assertTrue(lines[0].startswith("[... first "))
+        # Whole lines only, up to the last one
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(int(lines[1]), 1991)
+        self.assertEqual(int(lines[-1]), 2000)
+
+    @patch.dict(os.environ, {"ADS_OUTPUT_TAIL_KB": "1"})
+    def test_full_output_saved(self):
+        path = os.path.join(self.dir, "output", "svc.start.log")
+        (_, out) = _shell(CHATTY, self.dir, BUFFER, output_path=path)
+        self.assertIn("; see " + path, out.splitlines()[0])
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(int(lines[-2000]), 1)
+        self.assertEqual(int(lines[-1]), 2000)
+
+    @patch.dict(os.environ, {"ADS_KEEP_OUTPUT": "1"})
+    def test_every_attempt_saved(self):
+        service = Service("svc", self.dir)
+        for op in range(2):
+            path = _output_path(self.dir, service, "stop")
+            for attempt in ["first", "second"]:
+                _shell("echo %s try %d" % (attempt, op), self.dir, BUFFER,
+                       output_path=path)
+            with open(path) as f:
+                output = f.read()
+            # This op's attempts, not the last op's
+            self.assertIn("first try %d" % op, output)
+            self.assertIn("second try %d" % op, output)
+            self.assertNotIn("try %d" % (op - 1), output)
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ads.ads import OpResult, Service, UsageError, _load_plan
+from ads.ads import _plan_transitions
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "plan.yml")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def load(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+        return _load_plan(self.path)
+
+    def test_load(self):
+        self.assertEqual(self.load("up: [a, -b]\ndown: c\n"),
+                         {"up": ["a", "-b"], "down": ["c"]})
+        self.assertEqual(self.load(""), {"up": [], "down": []})
+        self.assertRaises(UsageError, self.load, "restart: [a]")
+        self.assertRaises(UsageError, self.load, "up: {a: 1}")
+
+    def test_transitions(self):
+        def status(name, outcome):
+            service = Service(name, "/" + name)
+            return (service, OpResult(service, "status", outcome,
+                                      outcome == OpResult.RUNNING))
+        rows = [
+            (status("a", OpResult.RUNNING), "up"),
+            (status("b", OpResult.NOT_RUNNING), "up"),
+            (status("c", OpResult.RUNNING), "down"),
+            (status("d", OpResult.NOT_RUNNING), "down"),
+            (status("e", OpResult.NO_STATUS_CMD), "up"),
+        ]
+        wanted = [(service, state) for ((service, _), state) in rows]
+        statuses = [result for ((_, result), _) in rows]
+        names = [[s.name for s in group]
+                 for group in _plan_transitions(wanted, statuses)]
+        self.assertEqual(names, [["c"], ["b"], ["a", "d"], ["e"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
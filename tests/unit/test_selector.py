@@ -1,4 +1,5 @@
 import unittest
+from mock import MagicMock
 from ads import Ads, Project, Service, ServiceSet, Profile, BadSelectorException
 
 some_services = [Service("a", "/a"),
@@ -91,5 +92,57 @@ class TestSelectors(unittest.TestCase):
             frozenset(["c"]))
         pass
 
+    def test_exclusion(self):
+        ads = Ads(Project("test", "/test", some_services, [a_and_b]))
+        self.assertEqual(ads.resolve_all(["all", "-a-and-b", "b"]),
+                         frozenset(["c", "d"]))
+        # Exclusions on their own apply to the default
+        self.assertEqual(ads.resolve_all(["-a"]), frozenset(["b", "c", "d"]))
+
+    def test_intersection(self):
+        ads = Ads(Project("test", "/test", some_services, [a_and_b, b_and_c]))
+        self.assertEqual(ads.resolve("a-and-b&b-and-c"), frozenset(["b"]))
+        self.assertEqual(ads.resolve_all(["a-and-b", "-a-and-b&b-and-c"]),
+                         frozenset(["a"]))
+
+    def test_expressions_inside_groups(self):
+        ads = Ads(Project("test", "/test", some_services,
+                          [a_and_b, ServiceSet("most", ["all", "-a-and-b"])]))
+        self.assertEqual(ads.resolve("most"), frozenset(["c", "d"]))
+
+    def test_malformed_expression(self):
+        ads = Ads(Project("test", "/test", some_services))
+        self.assertRaisesRegexp(
+            BadSelectorException, "Malformed", ads.resolve, "a&&b")
+
+    def test_overlapping_groups_resolved_once(self):
+        # Each level refers to the previous one twice: without memoization
+        # this takes 2^40 steps
+        groups = [ServiceSet("level0", ["a", "b"])]
+        for i in range(1, 40):
+            groups.append(ServiceSet("level%d" % i,
+                                     ["level%d" % (i - 1)] * 2 + ["c"]))
+        self.assertEqual(
+            Ads(Project("test", "/test", some_services, groups))
+            .resolve("level39"),
+            frozenset(["a", "b", "c"]))
+
+    def test_group_closures_stored_in_cache(self):
+        cache = MagicMock()
+        cache.get_closures.return_value = {}
+        project = Project("test", "/test", some_services, [a_and_b],
+                          cache=cache)
+        self.assertEqual(Ads(project).resolve("a-and-b"),
+                         frozenset(["a", "b"]))
+        (fingerprint, closures) = cache.write_closures.call_args[0]
+        self.assertEqual(closures, {"a-and-b": ["a", "b"]})
+
+        # A later load uses the stored closure instead of the definition
+        cache.get_closures.return_value = {"a-and-b": ["c"]}
+        cache.write_closures.reset_mock()
+        self.assertEqual(Ads(project).resolve("a-and-b"), frozenset(["c"]))
+        self.assertEqual(cache.get_closures.call_args[0][0], fingerprint)
+        self.assertFalse(cache.write_closures.called)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
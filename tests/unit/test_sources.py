@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ads.ads import Service, _Debouncer, _DirWatcher, _SourceWatcher
+
+
+class TestDebouncer(unittest.TestCase):
+
+    def test_waits_for_quiet(self):
+        debouncer = _Debouncer(1.0)
+        self.assertIsNone(debouncer.next_timeout(0))
+        debouncer.add(["a"], 10)
+        debouncer.add(["b"], 10.5)
+        self.assertEqual(debouncer.due(11), set())
+        self.assertEqual(debouncer.next_timeout(11), 0.5)
+        self.assertEqual(debouncer.due(11.5), set(["a", "b"]))
+        self.assertIsNone(debouncer.next_timeout(11.5))
+
+    def test_nothing_changed(self):
+        debouncer = _Debouncer(1.0)
+        debouncer.add([], 10)
+        self.assertEqual(debouncer.due(20), set())
+
+
+class TestSourceWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name in ["a", "b"]:
+            os.makedirs(os.path.join(self.tmp, name, "src", "pkg"))
+        self.services = [
+            Service("a", os.path.join(self.tmp, "a"),
+                    watch_paths=["src/**/*.py"]),
+            Service("b", os.path.join(self.tmp, "b"),
+                    watch_paths=["src/*.py"])]
+        self.dir_watcher = _DirWatcher.create()
+
+    def tearDown(self):
+        if self.dir_watcher:
+            self.dir_watcher.close()
+        shutil.rmtree(self.tmp)
+
+    def inotify_watcher(self):
+        if not self.dir_watcher:
+            self.skipTest("inotify isn't available")
+        return _SourceWatcher(self.services, self.dir_watcher)
+
+    def touch(self, *parts):
+        with open(os.path.join(self.tmp, *parts), "w") as f:
+            f.write("x")
+
+    def test_only_matching_files_count(self):
+        watcher = self.inotify_watcher()
+        self.touch("a", "src", "pkg", "mod.py")
+        self.touch("b", "src", "pkg", "mod.py")
+        self.touch("b", "src", "notes.txt")
+        self.assertEqual(watcher.changed(1), set(["a"]))
+        self.touch("b", "src", "main.py")
+        self.assertEqual(watcher.changed(1), set(["b"]))
+        self.assertEqual(watcher.changed(0), set())
+
+    def test_new_dirs_get_watched(self):
+        watcher = self.inotify_watcher()
+        os.mkdir(os.path.join(self.tmp, "a", "src", "new"))
+        self.assertEqual(watcher.changed(1), set())
+        self.touch("a", "src", "new", "mod.py")
+        self.assertEqual(watcher.changed(1), set(["a"]))
+
+    @patch("ads.ads._SOURCE_POLL_INTERVAL", 0.01)
+    def test_polling(self):
+        watcher = _SourceWatcher(self.services)
+        self.touch("a", "src", "pkg", "mod.py")
+        self.touch("b", "src", "notes.txt")
+        self.assertEqual(watcher.changed(), set(["a"]))
+        self.assertEqual(watcher.changed(), set())
+        os.remove(os.path.join(self.tmp, "a", "src", "pkg", "mod.py"))
+        self.assertEqual(watcher.changed(), set(["a"]))
@@ -0,0 +1,114 @@
+import os
+import unittest
+from mock import patch
+from ads.ads import _RestartPolicy, _Supervisor, _child_pgrps, Service
+
+
+class TestRestartPolicy(unittest.TestCase):
+
+    def test_backoff_doubles_up_to_max(self):
+        policy = _RestartPolicy(1, 5, 10, 60)
+        self.assertEqual([policy.crashed(now) for now in range(5)],
+                         [1, 2, 4, 5, 5])
+
+    def test_gives_up_on_crash_loop(self):
+        policy = _RestartPolicy(1, 5, 2, 60)
+        policy.crashed(0)
+        policy.started(1)
+        policy.crashed(2)
+        policy.started(3)
+        self.assertEqual(policy.crashed(4), None)
+
+    def test_stable_run_resets_backoff(self):
+        policy = _RestartPolicy(1, 5, 2, 60)
+        policy.crashed(0)
+        policy.started(1)
+        policy.crashed(2)
+        policy.started(3)
+        self.assertEqual(policy.crashed(63), 1)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.children = {}
+        self.exited = []
+        for patcher in [
+                patch("ads.ads._up", self.up),
+                patch("ads.ads._child_pgrps", lambda: dict(self.children)),
+                patch("ads.ads.os.waitpid", self.waitpid),
+                patch("ads.ads._record_op"),
+                patch("ads.ads.warning")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.supervisor = _Supervisor(
+            [Service("a", "/a"), Service("b", "/b")], "/state",
+            lambda: _RestartPolicy(1, 60, 3, 60), 30)
+
+    def up(self, service, verbose, state_dir=None, record_as="start"):
+        self.recorded_as = record_as
+        self.children.update(self.started)
+        return True
+
+    def waitpid(self, pid, options):
+        return self.exited and (self.exited.pop(0), 0) or (0, 0)
+
+    def start(self, name, pids, pgrp):
+        self.started = dict((pid, pgrp) for pid in pids)
+        self.supervisor.start(name, 0)
+
+    def exit(self, pid, now):
+        del self.children[pid]
+        self.exited.append(pid)
+        self.supervisor.reap(now)
+
+    def test_crash_after_last_process_exits(self):
+        self.start("a", [10, 11], 9)
+        self.start("b", [20], 19)
+        self.exit(10, 5)
+        self.assertEqual(self.supervisor.restart_at, {})
+        self.exit(11, 6)
+        self.assertEqual(self.supervisor.restart_at, {"a": 7})
+        self.assertEqual(self.supervisor.next_timeout(6), 1)
+        self.assertEqual(self.recorded_as, "start")
+        self.started = {}
+        self.supervisor.run_due(7)
+        self.assertEqual(self.recorded_as, "restart")
+
+    def test_orphans_adopted_by_process_group(self):
+        self.start("a", [10], 9)
+        # 10's child, left to us when 10 exits
+        self.children[12] = 9
+        self.exit(10, 5)
+        self.assertEqual(self.supervisor.pids["a"], set([12]))
+        self.exit(12, 6)
+        self.assertEqual(self.supervisor.restart_at, {"a": 7})
+
+    def test_own_group_not_adopted(self):
+        self.start("a", [10], os.getpgrp())
+        self.assertEqual(self.supervisor.groups, {})
+        # b's orphan, which happens to be in our group too
+        self.start("b", [20], 19)
+        self.children[21] = os.getpgrp()
+        self.exit(20, 5)
+        self.assertEqual(self.supervisor.pids["a"], set([10]))
+        self.assertEqual(self.supervisor.restart_at, {"b": 6})
+
+    def test_untracked_services_polled(self):
+        self.start("a", [], None)
+        self.assertEqual(self.supervisor.poll_at, {"a": 30})
+        with patch("ads.ads._is_running", return_value=False):
+            self.supervisor.run_due(30)
+        self.assertEqual(self.supervisor.restart_at, {"a": 31})
+
+
+class TestChildPgrps(unittest.TestCase):
+
+    @patch("ads.ads._HAS_PROC", False)
+    def test_none_without_proc(self):
+        # Services then all take the polling path
+        self.assertEqual(_child_pgrps(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
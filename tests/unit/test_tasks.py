@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ads.ads import Task, _hash_task_inputs, ParseProjectException
+
+
+class TestTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.home, "src"))
+        self.write("src/a.c", "int a;")
+        self.write("src/b.c", "int b;")
+        self.task = Task("build", "make", ["src/*.c"])
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def write(self, rel, text):
+        with open(os.path.join(self.home, rel), "w") as f:
+            f.write(text)
+
+    def hash(self, task=None, known=None):
+        return _hash_task_inputs(task or self.task, self.home, known or {})
+
+    def test_load(self):
+        tasks = Task.load_multiple(
+            {"lint": "flake8", "build": {"cmd": "make", "inputs": ["*.c"]}},
+            "ads.yml")
+        self.assertEqual((tasks["lint"].cmd, tasks["lint"].inputs),
+                         ("flake8", []))
+        self.assertEqual((tasks["build"].cmd, tasks["build"].inputs),
+                         ("make", ["*.c"]))
+        self.assertRaises(ParseProjectException, Task.load_multiple,
+                          {"build": {"inputs": ["*.c"]}}, "ads.yml")
+
+    def test_digest_follows_contents_and_command(self):
+        (digest, files) = self.hash()
+        self.assertEqual(sorted(files), ["src/a.c", "src/b.c"])
+        self.assertEqual(self.hash()[0], digest)
+
+        self.write("src/b.c", "int c;")
+        self.assertNotEqual(self.hash()[0], digest)
+        self.write("src/b.c", "int b;")
+        self.assertNotEqual(
+            self.hash(Task("build", "make -j8", ["src/*.c"]))[0], digest)
+
+    def test_unchanged_files_not_reread(self):
+        (digest, files) = self.hash()
+        with patch("ads.ads._hash_file") as hash_file:
+            self.assertEqual(self.hash(known=files), (digest, files))
+        self.assertFalse(hash_file.called)
+
+    def test_no_inputs(self):
+        self.assertEqual(self.hash(Task("lint", "flake8")), (None, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ads.ads import Service, UsageError, top
+from ads.ads import _sample_procs, _service_usage, _top_table
+from ads.ads import _CLOCK_TICKS, _PAGE_SIZE
+
+
+class TestTop(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.proc = os.path.join(self.tmp, "proc")
+        os.mkdir(self.proc)
+        for name in ["web", "db", "db/replica"]:
+            os.makedirs(os.path.join(self.tmp, name))
+        self.services = [Service(name, os.path.join(self.tmp, name))
+                         for name in ["web", "db", "replica"]]
+        self.services[2].home = os.path.join(self.tmp, "db/replica")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def add_proc(self, pid, ppid, cwd, ticks=0, pages=0, io=(0, 0),
+                 comm="sh"):
+        pid_dir = os.path.join(self.proc, str(pid))
+        if not os.path.isdir(pid_dir):
+            os.mkdir(pid_dir)
+        fields = ["S", ppid, pid] + [0] * 8 + [ticks, ticks] + [0] * 8 + \
+            [pages]
+        with open(os.path.join(pid_dir, "stat"), "w") as f:
+            f.write("%d (%s) %s\n" % (pid, comm, " ".join(map(str, fields))))
+        with open(os.path.join(pid_dir, "io"), "w") as f:
+            f.write("rchar: 1\nread_bytes: %d\nwrite_bytes: %d\n" % io)
+        cwd_link = os.path.join(pid_dir, "cwd")
+        if os.path.lexists(cwd_link):
+            os.remove(cwd_link)
+        os.symlink(cwd, cwd_link)
+
+    def usage(self, before, after):
+        return dict((u.name, u) for u in
+                    _service_usage(before, after, 2.0, self.services))
+
+    def test_processes_mapped_by_home_and_parent(self):
+        self.add_proc(10, 1, os.path.join(self.tmp, "web"), comm="a (b) c")
+        # Runs elsewhere, but was started by a web process
+        self.add_proc(11, 10, "/")
+        self.add_proc(20, 1, os.path.join(self.tmp, "db/replica/data"))
+        self.add_proc(30, 1, self.tmp)
+        usage = self.usage({}, _sample_procs(self.proc))
+        self.assertEqual((usage["web"].procs, usage["db"].procs,
+                          usage["replica"].procs), (2, 0, 1))
+
+    def test_rates_between_samples(self):
+        web = os.path.join(self.tmp, "web")
+        self.add_proc(10, 1, web, ticks=0, pages=1, io=(0, 0))
+        before = _sample_procs(self.proc)
+        self.add_proc(10, 1, web, ticks=_CLOCK_TICKS, pages=2,
+                      io=(4096, 1024))
+        usage = self.usage(before, _sample_procs(self.proc))["web"]
+        # Two seconds of cpu (user + system) over two seconds
+        self.assertEqual(usage.cpu_percent, 100.0)
+        self.assertEqual(usage.rss_bytes, 2 * _PAGE_SIZE)
+        self.assertEqual((usage.read_rate, usage.write_rate), (2048, 512))
+
+    def test_sorting(self):
+        web = os.path.join(self.tmp, "web")
+        self.add_proc(10, 1, web, pages=1)
+        self.add_proc(20, 1, os.path.join(self.tmp, "db"), pages=5)
+        usage = _service_usage({}, _sample_procs(self.proc), 1.0,
+                               self.services)
+        names = [line.split()[0]
+                 for line in _top_table(usage, "mem").format_lines()[1:]]
+        self.assertEqual(names, ["db", "web", "replica"])
+
+    @patch("ads.ads._HAS_PROC", False)
+    def test_needs_proc(self):
+        self.assertRaises(UsageError, top, ["--once"])
+
+
+if __name__ == '__main__':
+    unittest.main()
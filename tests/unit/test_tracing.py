@@ -0,0 +1,72 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ads.ads import _Tracer, _span, _pop_timings_flag
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tracer = _Tracer()
+        self.patch = patch("ads.ads._tracer", self.tracer)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_spans_recorded_even_on_error(self):
+        with _span("outer", service="svc"):
+            try:
+                with _span("inner"):
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEqual([(name, args) for (name, _, _, _, args)
+                          in self.tracer.spans],
+                         [("inner", {}), ("outer", {"service": "svc"})])
+
+    def test_summary_groups_spans_slowest_first(self):
+        self.tracer.record("quick", 0, 1, {})
+        self.tracer.record("slow", 0, 3, {})
+        self.tracer.record("quick", 0, 1, {})
+        lines = self.tracer.summary_lines()
+        self.assertEqual(lines[1].split(), ["slow", "1", "3.000s",
+                                            "3.000s", "3.000s"])
+        self.assertEqual(lines[2].split(), ["quick", "2", "2.000s",
+                                            "1.000s", "1.000s"])
+
+    def test_chrome_trace(self):
+        start = self.tracer.started_at
+        self.tracer.record("status_cmd", start + 1, start + 1.5,
+                           {"service": "svc"})
+        path = os.path.join(self.tmp, "trace.json")
+        self.tracer.write_chrome_trace(path)
+        [event] = json.load(open(path))["traceEvents"]
+        self.assertEqual((event["name"], event["ph"], event["ts"],
+                          event["dur"], event["args"]),
+                         ("status_cmd", "X", 1000000, 500000,
+                          {"service": "svc"}))
+
+    def test_no_tracer_no_spans(self):
+        with patch("ads.ads._tracer", None):
+            with _span("ignored"):
+                pass
+        self.assertEqual(self.tracer.spans, [])
+
+    def test_timings_flag(self):
+        self.assertEqual(_pop_timings_flag(["up", "--timings", "svc"]),
+                         (["up", "svc"], True))
+        self.assertEqual(
+            _pop_timings_flag(["up", "svc", "--", "--timings"]),
+            (["up", "svc", "--", "--timings"], False))
+        self.assertEqual(_pop_timings_flag(["--", "--timings"]),
+                         (["--", "--timings"], False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from ads.ads import Service, _DirWatcher, _wait_for
+
+
+class TestWaitFor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.services = [Service("a", self.tmp), Service("b", self.tmp)]
+        self.probes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_returns_when_all_pass(self):
+        def condition(service):
+            self.probes.append(service.name)
+            return service.name == "a" or self.probes.count("b") == 3
+        reached = _wait_for(self.services, condition, time.time() + 5)
+        self.assertEqual(sorted(reached), ["a", "b"])
+        self.assertEqual(self.probes.count("a"), 1)
+
+    def test_deadline(self):
+        started = time.time()
+        reached = _wait_for(self.services, lambda s: s.name == "a",
+                            started + 0.3)
+        self.assertEqual(reached.keys(), ["a"])
+        self.assertTrue(0.3 <= time.time() - started < 1)
+
+    def test_dir_watcher(self):
+        watcher = _DirWatcher.create()
+        if not watcher:
+            self.skipTest("inotify not available")
+        self.addCleanup(watcher.close)
+        self.assertTrue(watcher.watch(self.tmp, "a"))
+        flag = os.path.join(self.tmp, "ready")
+        with open(flag, "w"):
+            pass
+        self.assertEqual(watcher.changed(), set(["a"]))
+        self.assertEqual(watcher.changed(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
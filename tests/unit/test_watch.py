@@ -0,0 +1,69 @@
+import unittest
+from StringIO import StringIO
+from ads.ads import _WatchSchedule, _WatchScreen
+
+
+class FakeTerminal(StringIO):
+
+    def isatty(self):
+        return True
+
+
+class TestWatchSchedule(unittest.TestCase):
+
+    def test_backs_off_while_unchanged(self):
+        schedule = _WatchSchedule(["a", "b"], 1, 8, now=0)
+        self.assertEqual(schedule.due(0), ["a", "b"])
+        for now in [0, 1, 3, 7, 15]:
+            schedule.probed("a", False, now)
+        self.assertEqual(schedule.next_due["a"], 15 + 8)
+
+    def test_change_resets_interval(self):
+        schedule = _WatchSchedule(["a", "b"], 1, 8, now=0)
+        schedule.probed("a", False, 0)
+        schedule.probed("a", False, 2)
+        schedule.probed("b", True, 0)
+        self.assertEqual(schedule.due(1), ["b"])
+        self.assertEqual(schedule.next_wakeup(), 1)
+        schedule.probed("a", True, 6)
+        self.assertEqual(schedule.next_due["a"], 7)
+
+    def test_wake_is_rate_limited(self):
+        schedule = _WatchSchedule(["a"], 1, 8, now=0)
+        for now in [0, 1, 3]:
+            schedule.probed("a", False, now)
+        self.assertEqual(schedule.next_due["a"], 3 + 8)
+        schedule.wake("a", 3.1)
+        self.assertEqual(schedule.next_due["a"], 4)
+        schedule.wake("a", 5)
+        self.assertEqual(schedule.next_due["a"], 4)
+        # The backoff carries on
+        schedule.probed("a", False, 5)
+        self.assertEqual(schedule.next_due["a"], 5 + 8)
+
+
+class TestWatchScreen(unittest.TestCase):
+
+    def test_redraws_only_the_changed_row(self):
+        out = FakeTerminal()
+        screen = _WatchScreen(["a", "bb", "c"], out)
+        screen.open()
+        out.truncate(0)
+        screen.update("bb", "ok", 0)
+        # Row 2 of the table, below the header
+        self.assertTrue(out.getvalue().startswith("\033[4;1H\033[2Kbb "))
+        self.assertEqual(out.getvalue().count("\n"), 0)
+
+    def test_lines_when_not_a_terminal(self):
+        out = StringIO()
+        screen = _WatchScreen(["a", "bb"], out)
+        screen.open()
+        screen.update("a", "not running", 0)
+        screen.close()
+        self.assertEqual(out.getvalue().count("\n"), 1)
+        self.assertIn("a   \033[91mnot running", out.getvalue())
+        self.assertNotIn("\033[2K", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()